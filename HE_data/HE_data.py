@@ -1,13 +1,83 @@
 import argparse
+from collections import OrderedDict
+from functools import cached_property
+import hashlib
+import json
+import os
+import queue
+import re
 import sys
+import threading
+import zlib
 
 from bfv.bfv_decryptor import BFVDecryptor
 from bfv.bfv_encryptor import BFVEncryptor
+from bfv.bfv_evaluator import BFVEvaluator
 from bfv.bfv_key_generator import BFVKeyGenerator
 from bfv.bfv_parameters import BFVParameters
+from bfv.bfv_relin_key import BFVRelinKey
 from bfv.int_encoder import IntegerEncoder
 from util.ciphertext import Ciphertext
+from util.ntt import NTTContext
+from util.number_theory import is_prime, root_of_unity
+from util.plaintext import Plaintext
 from util.polynomial import Polynomial
+from util.public_key import PublicKey
+from util.random_sample import sample_triangle
+from util.secret_key import SecretKey
+
+from profiling import add_profile_arguments, run_profiled
+
+# Ciphertext serializations start with <length>:<checksum>: where length is the
+# number of characters after the header and checksum is their CRC32 in hex
+CIPHERTEXT_HEADER_REGEX = r"([0-9]+):([0-9a-f]{8}):"
+# Coefficient list of a serialized polynomial, <ring_degree> <coeff_1> ... <coeff_n>
+POLYNOMIAL_REGEX = r"[0-9]+( [0-9]+)*"
+# c1 of a seeded ciphertext, <ciph_modulus> <seed in hex>
+SEED_REGEX = r"[0-9]+ [0-9a-f]{32}"
+# Bytes of the seeds c1 is expanded from
+SEED_BYTES = 16
+# Prefix of the SHAKE-128 input, so seeds expand differently in other uses
+SEED_DOMAIN = b"bfv-c1"
+
+KEY_FILE_MAGIC = "HEKEYS"
+# Sections of a key file, in the order of the line-based format
+KEY_SECTIONS = ("params", "public_key", "secret_key", "relin_key", "ntt_root")
+# Sections needed by the tools, which never decrypt
+PUBLIC_SECTIONS = ("params", "public_key", "relin_key", "ntt_root")
+# Sections needed for decryption
+SECRET_SECTIONS = ("params", "secret_key", "ntt_root")
+# Key files written by save_key_files
+KEY_FILE = "HE.txt"
+PUBLIC_KEY_FILE = "HE_public.txt"
+SECRET_KEY_FILE = "HE_secret.txt"
+
+# NTT-friendly parameter presets. Every ciph_modulus is a prime congruent to
+# 1 modulo 2 * degree, so polynomial multiplication modulo ciph_modulus can use
+# a number theoretic transform instead of schoolbook multiplication.
+PARAMETER_PRESETS = {
+    "default": {"degree": 8, "plain_modulus": 401, "ciph_modulus": 8000000000753},
+    "evaluation": {
+        "degree": 8,
+        "plain_modulus": 1601,
+        "ciph_modulus": 8000000000753,
+    },
+    "degree16": {
+        "degree": 16,
+        "plain_modulus": 1601,
+        "ciph_modulus": 1125899906842817,
+    },
+    "degree32": {
+        "degree": 32,
+        "plain_modulus": 1601,
+        "ciph_modulus": 1152921504606850369,
+    },
+    "degree64": {
+        "degree": 64,
+        "plain_modulus": 1601,
+        "ciph_modulus": 1152921504606851201,
+    },
+}
 
 
 def serialize_polynomial(polynomial: Polynomial) -> str:
@@ -25,36 +95,508 @@ def serialize_polynomial(polynomial: Polynomial) -> str:
     return serialization
 
 
-def serialize_encoder(params: BFVParameters, key_generator: BFVKeyGenerator) -> str:
+def is_ntt_friendly(poly_degree: int, ciph_modulus: int) -> bool:
     """
-    Serializes params and key generator of an encryptor into a string.
+    Checks whether polynomials modulo ciph_modulus can be multiplied with an NTT,
+    which needs a power of two poly_degree and a prime ciph_modulus congruent to
+    1 modulo 2 * poly_degree.
+    """
+    return (
+        poly_degree > 0
+        and poly_degree & (poly_degree - 1) == 0
+        and ciph_modulus % (2 * poly_degree) == 1
+        and is_prime(ciph_modulus)
+    )
+
+
+def find_ntt_modulus(poly_degree: int, min_modulus: int) -> int:
+    """Returns the smallest NTT-friendly ciphertext modulus >= min_modulus."""
+    if poly_degree <= 0 or poly_degree & (poly_degree - 1) != 0:
+        raise ValueError(f"Degree {poly_degree} is not a power of 2")
+    modulus = min_modulus + (1 - min_modulus) % (2 * poly_degree)
+    while not is_prime(modulus):
+        modulus += 2 * poly_degree
+    return modulus
+
+
+def validate_preset(preset: dict) -> None:
+    """Raises ValueError if a parameter preset is not NTT-friendly."""
+    if not preset["plain_modulus"] % 16 == 1 or not is_prime(preset["plain_modulus"]):
+        raise ValueError(
+            f"{preset['plain_modulus']} is not a prime congruent to 1 modulo 16"
+        )
+    if not is_ntt_friendly(preset["degree"], preset["ciph_modulus"]):
+        raise ValueError(
+            f"{preset['ciph_modulus']} is not a prime congruent to 1 modulo {2 * preset['degree']}"
+        )
+
+
+def load_preset(filename: str) -> dict:
+    """Loads and validates a parameter preset saved as JSON, like tune.py's output."""
+    with open(filename, "r") as f:
+        data = json.load(f)
+    preset = {
+        key: int(data[key]) for key in ("degree", "plain_modulus", "ciph_modulus")
+    }
+    validate_preset(preset)
+    return preset
+
+
+def find_ntt_root(params: BFVParameters) -> int:
+    """
+    Returns a primitive 2 * poly_degree-th root of unity modulo ciph_modulus, or
+    None if the parameters are not NTT-friendly.
+    """
+    if not is_ntt_friendly(params.poly_degree, params.ciph_modulus):
+        return None
+    return root_of_unity(order=2 * params.poly_degree, modulus=params.ciph_modulus)
+
+
+class NTTBFVEncryptor(BFVEncryptor):
+    """BFVEncryptor that multiplies polynomials with an NTT if given a context."""
+
+    def __init__(
+        self, params: BFVParameters, public_key, ntt_context: NTTContext = None
+    ):
+        super().__init__(params, public_key)
+        self.params = params
+        self.public_key = public_key
+        self.ntt_context = ntt_context
+
+    def encrypt(self, message: Plaintext) -> Ciphertext:
+        if self.ntt_context is None:
+            return super().encrypt(message)
+        degree = self.params.poly_degree
+        modulus = self.params.ciph_modulus
+        scaled_message = message.poly.scalar_multiply(
+            int(self.params.scaling_factor), modulus
+        )
+        random_vec = Polynomial(degree, sample_triangle(degree))
+        error1 = Polynomial(degree, sample_triangle(degree))
+        error2 = Polynomial(degree, sample_triangle(degree))
+        c0 = error1.add(
+            self.public_key.p0.multiply(random_vec, modulus, ntt=self.ntt_context),
+            modulus,
+        ).add(scaled_message, modulus)
+        c1 = error2.add(
+            self.public_key.p1.multiply(random_vec, modulus, ntt=self.ntt_context),
+            modulus,
+        )
+        return Ciphertext(c0, c1)
+
+
+def expand_seed(seed: bytes, ring_degree: int, ciph_modulus: int) -> Polynomial:
+    """
+    Expands a seed into a uniformly random polynomial modulo ciph_modulus. The
+    SHAKE-128 stream of the seed is cut into numbers of ciph_modulus's bit
+    length, and numbers that are not below ciph_modulus are skipped.
+
+        Args:
+            seed (bytes): Seed of SEED_BYTES bytes
+            ring_degree (int): Number of coefficients
+            ciph_modulus (int): Ciphertext modulus
+
+        Returns:
+            (Polynomial): Polynomial with coefficients in [0, ciph_modulus - 1]
+    """
+    bits = ciph_modulus.bit_length()
+    size = (bits + 7) // 8
+    mask = (1 << bits) - 1
+    # Every number is accepted with probability above 1/2
+    length = 2 * ring_degree * size
+    stream = hashlib.shake_128(SEED_DOMAIN + seed).digest(length)
+    coeffs = []
+    offset = 0
+    while len(coeffs) < ring_degree:
+        if offset + size > len(stream):
+            # A longer SHAKE output starts with the shorter one
+            length *= 2
+            stream = hashlib.shake_128(SEED_DOMAIN + seed).digest(length)
+        coeff = int.from_bytes(stream[offset : offset + size], "little") & mask
+        offset += size
+        if coeff < ciph_modulus:
+            coeffs.append(coeff)
+    return Polynomial(ring_degree, coeffs)
+
+
+class SeededCiphertext(Ciphertext):
+    """
+    Ciphertext whose c1 is a uniformly random polynomial expanded from a short
+    seed. Serializations store the seed instead of c1, and c1 is only expanded
+    the first time it is used, so it works wherever a Ciphertext does.
+    """
+
+    def __init__(self, c0: Polynomial, seed: bytes, ciph_modulus: int):
+        # c1 is left unset so the cached property expands it
+        self.c0 = c0
+        self.seed = seed
+        self.ciph_modulus = ciph_modulus
+        self.scaling_factor = None
+        self.modulus = None
+
+    @cached_property
+    def c1(self) -> Polynomial:
+        return expand_seed(self.seed, self.c0.ring_degree, self.ciph_modulus)
+
+
+class SecretKeyBFVEncryptor:
+    """
+    Encrypts with the secret key instead of the public key, for the data owner
+    who holds it. c1 is expanded from a random seed and c0 = -c1*s + e + m*q/t,
+    which decrypts and evaluates like a public key encryption. It needs one
+    polynomial multiplication and one error sample instead of two and three,
+    and its serialization is up to half as long, since c1 is stored as a seed.
+    """
+
+    def __init__(
+        self, params: BFVParameters, secret_key, ntt_context: NTTContext = None
+    ):
+        self.params = params
+        self.secret_key = secret_key
+        self.ntt_context = ntt_context
+
+    def encrypt(self, message: Plaintext) -> SeededCiphertext:
+        degree = self.params.poly_degree
+        modulus = self.params.ciph_modulus
+        scaled_message = message.poly.scalar_multiply(
+            int(self.params.scaling_factor), modulus
+        )
+        seed = os.urandom(SEED_BYTES)
+        c1 = expand_seed(seed, degree, modulus)
+        error = Polynomial(degree, sample_triangle(degree))
+        c0 = error.add(scaled_message, modulus).subtract(
+            c1.multiply(self.secret_key.s, modulus, ntt=self.ntt_context), modulus
+        )
+        ciphertext = SeededCiphertext(c0, seed, modulus)
+        ciphertext.c1 = c1
+        return ciphertext
+
+
+class NTTBFVDecryptor(BFVDecryptor):
+    """BFVDecryptor that multiplies polynomials with an NTT if given a context."""
+
+    def __init__(
+        self, params: BFVParameters, secret_key, ntt_context: NTTContext = None
+    ):
+        super().__init__(params, secret_key)
+        self.params = params
+        self.secret_key = secret_key
+        self.ntt_context = ntt_context
+
+    def decrypt(self, ciphertext: Ciphertext) -> Plaintext:
+        if self.ntt_context is None:
+            return super().decrypt(ciphertext)
+        modulus = self.params.ciph_modulus
+        intermed_message = ciphertext.c0.add(
+            ciphertext.c1.multiply(self.secret_key.s, modulus, ntt=self.ntt_context),
+            modulus,
+        )
+        intermed_message = intermed_message.scalar_multiply(
+            1 / self.params.scaling_factor
+        )
+        intermed_message = intermed_message.round()
+        return Plaintext(intermed_message.mod(self.params.plain_modulus))
+
+
+class NTTBFVEvaluator(BFVEvaluator):
+    """
+    BFVEvaluator that relinearizes with an NTT if given a context and supports
+    operations between a ciphertext and a plaintext.
+    """
+
+    def __init__(self, params: BFVParameters, ntt_context: NTTContext = None):
+        super().__init__(params)
+        self.params = params
+        self.ntt_context = ntt_context
 
+    def add_plain(self, ciph: Ciphertext, plain: Plaintext) -> Ciphertext:
+        """Adds a plaintext to a ciphertext without encrypting the plaintext."""
+        modulus = self.params.ciph_modulus
+        scaled_plain = plain.poly.scalar_multiply(
+            int(self.params.scaling_factor), modulus
+        )
+        return Ciphertext(ciph.c0.add(scaled_plain, modulus), ciph.c1)
+
+    def multiply_plain(self, ciph: Ciphertext, plain: Plaintext) -> Ciphertext:
+        """
+        Multiplies a ciphertext by a plaintext without encrypting the plaintext.
+        The product keeps two components, so it needs no relinearization.
+        """
+        modulus = self.params.ciph_modulus
+        return Ciphertext(
+            ciph.c0.multiply(plain.poly, modulus, ntt=self.ntt_context),
+            ciph.c1.multiply(plain.poly, modulus, ntt=self.ntt_context),
+        )
+
+    def multiply(self, ciph1, ciph2, relin_key):
+        return self.relinearize(relin_key, *self.multiply_unrelinearized(ciph1, ciph2))
+
+    def multiply_unrelinearized(
+        self, ciph1: Ciphertext, ciph2: Ciphertext
+    ) -> tuple[Polynomial, Polynomial, Polynomial]:
+        """
+        Returns the three components of a product before relinearization. They
+        add up component by component, so a sum of products can be relinearized
+        once instead of once per product.
+        """
+        modulus = self.params.ciph_modulus
+        components = (
+            ciph1.c0.multiply_naive(ciph2.c0),
+            ciph1.c0.multiply_naive(ciph2.c1).add(ciph1.c1.multiply_naive(ciph2.c0)),
+            ciph1.c1.multiply_naive(ciph2.c1),
+        )
+        return tuple(
+            poly.scalar_multiply(1 / self.params.scaling_factor).round().mod(modulus)
+            for poly in components
+        )
+
+    def relinearize(self, relin_key, c0, c1, c2):
+        if self.ntt_context is None:
+            return super().relinearize(relin_key, c0, c1, c2)
+        modulus = self.params.ciph_modulus
+        c2_decomposed = c2.base_decompose(relin_key.base, len(relin_key.keys))
+        for i, poly in enumerate(c2_decomposed):
+            c0 = c0.add(
+                relin_key.keys[i][0].multiply(poly, modulus, ntt=self.ntt_context),
+                modulus,
+            )
+            c1 = c1.add(
+                relin_key.keys[i][1].multiply(poly, modulus, ntt=self.ntt_context),
+                modulus,
+            )
+        return Ciphertext(c0, c1)
+
+
+class ZeroEncryptionPool:
+    """
+    Pool of fresh encryptions of zero under one public key, refilled by a
+    background thread so that encryption cost is paid off the request path.
+
+    A fresh encryption of m is a pooled encryption of zero with the scaled
+    plaintext added onto c0. Every pooled ciphertext is handed out at most once.
+    Can be used anywhere an encryptor is expected.
+    """
+
+    def __init__(
+        self,
+        params: BFVParameters,
+        encryptor: BFVEncryptor,
+        size: int = 32,
+        background: bool = True,
+    ):
+        self.params = params
+        self.encryptor = encryptor
+        self.zero = Plaintext(Polynomial(params.poly_degree, [0] * params.poly_degree))
+        self.zeros = queue.Queue(maxsize=size)
+        self.stopped = threading.Event()
+        self.refill_thread = None
+        if background:
+            self.refill_thread = threading.Thread(target=self._refill, daemon=True)
+            self.refill_thread.start()
+
+    def _refill(self):
+        """Keeps the pool full until the pool is closed."""
+        zero = None
+        while not self.stopped.is_set():
+            if zero is None:
+                zero = self.encryptor.encrypt(self.zero)
+            try:
+                self.zeros.put(zero, timeout=0.1)
+                zero = None
+            except queue.Full:
+                continue
+
+    def fill(self):
+        """Fills the pool on the calling thread."""
+        while not self.zeros.full():
+            try:
+                self.zeros.put_nowait(self.encryptor.encrypt(self.zero))
+            except queue.Full:
+                break
+
+    def encrypt(self, message: Plaintext) -> Ciphertext:
+        """
+        Encrypts a plaintext by adding it onto a pooled encryption of zero.
+        Encrypts zero on the spot if the pool is empty.
+        """
+        try:
+            zero = self.zeros.get_nowait()
+        except queue.Empty:
+            zero = self.encryptor.encrypt(self.zero)
+        modulus = self.params.ciph_modulus
+        scaled_message = message.poly.scalar_multiply(
+            int(self.params.scaling_factor), modulus
+        )
+        c0 = zero.c0.add(scaled_message, modulus)
+        if isinstance(zero, SeededCiphertext):
+            # Keeps the seed so the ciphertext still serializes without c1
+            ciphertext = SeededCiphertext(c0, zero.seed, zero.ciph_modulus)
+            ciphertext.c1 = zero.c1
+            return ciphertext
+        return Ciphertext(c0, zero.c1)
+
+    def close(self):
+        """Stops the background refill thread."""
+        self.stopped.set()
+        if self.refill_thread is not None:
+            self.refill_thread.join()
+
+
+# Zero pools of the most recently used key sets, keyed by the id of the public key
+# object, which the pool's encryptor keeps alive so the id is not reused
+_zero_pools = OrderedDict()
+MAX_ZERO_POOLS = 4
+
+
+def get_zero_pool(
+    params: BFVParameters, public_key, ntt_context: NTTContext = None
+) -> ZeroEncryptionPool:
+    """
+    Returns the shared encryption of zero pool for a key set, creating it on
+    first use. Pools of key sets that have not been used recently are closed.
+    Callers pass the public key cached by open_key_file, so every call for the
+    same key file finds the same pool.
+    """
+    key = id(public_key)
+    if key in _zero_pools:
+        _zero_pools.move_to_end(key)
+        return _zero_pools[key]
+    _zero_pools[key] = ZeroEncryptionPool(
+        params, NTTBFVEncryptor(params, public_key, ntt_context)
+    )
+    while len(_zero_pools) > MAX_ZERO_POOLS:
+        _zero_pools.popitem(last=False)[1].close()
+    return _zero_pools[key]
+
+
+def serialize_params(params: BFVParameters) -> str:
+    """
+    Format:
+    <params.poly_degree> <params.plain_modulus> <params.ciph_modulus>
+    """
+    return f"{params.poly_degree} {params.plain_modulus} {params.ciph_modulus}"
+
+
+def serialize_public_key(public_key: PublicKey) -> str:
+    """
+    Format:
+    <public_key.p0>|<public_key.p1>
+    """
+    return (
+        f"{serialize_polynomial(public_key.p0)}|{serialize_polynomial(public_key.p1)}"
+    )
+
+
+def serialize_relin_key(relin_key: BFVRelinKey) -> str:
+    """
     Note: The tuple elements of the relin_key keys are comma-separated.\n
+    Format:
+    <relin_key.base>-<relin_key.keys[0]>|...|<relin_key.keys[len(relin_key.keys) - 1]>
+    """
+    return (
+        str(relin_key.base)
+        + "-"
+        + "|".join(
+            ",".join(serialize_polynomial(polynomial) for polynomial in tup)
+            for tup in relin_key.keys
+        )
+    )
+
+
+def serialize_sections(
+    params: BFVParameters,
+    key_generator: BFVKeyGenerator,
+    ntt_root: int = None,
+    sections: tuple[str] = KEY_SECTIONS,
+) -> dict[str, str]:
+    """
+    Serializes the requested sections of a key set. The ntt_root section is
+    skipped if ntt_root is not provided.
+    """
+    serializers = {
+        "params": lambda: serialize_params(params),
+        "public_key": lambda: serialize_public_key(key_generator.public_key),
+        "secret_key": lambda: serialize_polynomial(key_generator.secret_key.s),
+        "relin_key": lambda: serialize_relin_key(key_generator.relin_key),
+        "ntt_root": lambda: str(ntt_root),
+    }
+    return {
+        name: serializers[name]()
+        for name in sections
+        if name != "ntt_root" or ntt_root is not None
+    }
+
+
+def serialize_encoder(
+    params: BFVParameters, key_generator: BFVKeyGenerator, ntt_root: int = None
+) -> str:
+    """
+    Serializes params and key generator of an encryptor into a string.
+
+    Note: The tuple elements of the relin_key keys are comma-separated.
+    The NTT root of unity line is only written if ntt_root is provided.\n
     Format:\n
     <params.poly_degree> <params.plain_modulus> <params.ciph_modulus>\n
     <public_key.p0>|<public_key.p1>\n
     <secret_key.s>\n
-    <relin_key.base>-<relin_key.keys[0]>|...|<relin_key.keys[len(relin_key.keys) - 1]>
+    <relin_key.base>-<relin_key.keys[0]>|...|<relin_key.keys[len(relin_key.keys) - 1]>\n
+    <ntt_root>
     """
-    # Serialize params
-    serialization = (
-        f"{params.poly_degree} {params.plain_modulus} {params.ciph_modulus}\n"
-    )
-    # Serialize public key
-    serialization += f"{serialize_polynomial(key_generator.public_key.p0)}|{serialize_polynomial(key_generator.public_key.p1)}\n"
-    # Serialize secret key
-    serialization += serialize_polynomial(key_generator.secret_key.s)
-    serialization += "\n"
-
-    # Serialize relin key
-    serialization += str(key_generator.relin_key.base) + "-"
-    # List of tuples of polynomials
-    for tup in key_generator.relin_key.keys:
-        for polynomial in tup:
-            serialization += serialize_polynomial(polynomial) + ","
-        serialization = serialization.strip(",")
-        serialization += "|"
-    return serialization.strip("|")
+    return "\n".join(serialize_sections(params, key_generator, ntt_root).values())
+
+
+def serialize_key_file(sections: dict[str, str]) -> str:
+    """
+    Serializes key sections into a container whose sections can be read
+    independently. Section offsets are relative to the first byte after the
+    empty line that ends the offset table.
+
+    Format:\n
+    HEKEYS\n
+    <name> <offset> <length>\n
+    ...\n
+    \n
+    <section>\n
+    ...
+    """
+    header = KEY_FILE_MAGIC + "\n"
+    data = ""
+    for name, serialization in sections.items():
+        header += f"{name} {len(data)} {len(serialization)}\n"
+        data += serialization + "\n"
+    return header + "\n" + data
+
+
+def save_key_files(
+    directory: str,
+    params: BFVParameters,
+    key_generator: BFVKeyGenerator,
+    ntt_root: int = None,
+):
+    """
+    Saves a key set into a directory as a key file with every section, a public
+    key file for the tools and a secret key file for decryption.
+    """
+    for filename, sections in [
+        (KEY_FILE, KEY_SECTIONS),
+        (PUBLIC_KEY_FILE, PUBLIC_SECTIONS),
+        (SECRET_KEY_FILE, SECRET_SECTIONS),
+    ]:
+        save_encoder(
+            os.path.join(directory, filename),
+            serialize_key_file(
+                serialize_sections(params, key_generator, ntt_root, sections)
+            ),
+        )
+
+
+class CiphertextFormatError(ValueError):
+    """Raised when a ciphertext serialization is truncated, altered or malformed."""
+
+
+def ciphertext_checksum(body: str) -> str:
+    """Returns the CRC32 of a ciphertext serialization's body in hex."""
+    return f"{zlib.crc32(body.encode()):08x}"
 
 
 def serialize_ciphertext(ciphertext: Ciphertext) -> str:
@@ -62,24 +604,142 @@ def serialize_ciphertext(ciphertext: Ciphertext) -> str:
     Serializes a ciphertext into a string representation.
 
     Format:
-    <ciphertext.c0>w<ciphertext.c1>
+    <length>:<checksum>:<ciphertext.c0>w<ciphertext.c1>
+    or for a SeededCiphertext
+    <length>:<checksum>:<ciphertext.c0>s<ciph_modulus> <seed in hex>
     """
-    return (
-        serialize_polynomial(ciphertext.c0) + "w" + serialize_polynomial(ciphertext.c1)
-    )
+    if isinstance(ciphertext, SeededCiphertext):
+        body = (
+            serialize_polynomial(ciphertext.c0)
+            + f"s{ciphertext.ciph_modulus} {ciphertext.seed.hex()}"
+        )
+    else:
+        body = (
+            serialize_polynomial(ciphertext.c0)
+            + "w"
+            + serialize_polynomial(ciphertext.c1)
+        )
+    return f"{len(body)}:{ciphertext_checksum(body)}:{body}"
+
+
+def validate_ciphertext(
+    serialization: str, params: BFVParameters = None, require_header: bool = False
+) -> str:
+    """
+    Checks a ciphertext serialization before it is parsed. The length and checksum
+    in the header catch truncated or altered serializations, and the structure is
+    checked for serializations without a header, which are still accepted from
+    legacy files unless require_header is set.
 
+        Args:
+            serialization (str): Output of serialize_ciphertext
+            params (BFVParameters): Parameters the ciphertext should be encrypted
+                under, to also check its ring degree and coefficients
+            require_header (bool): Whether to reject serializations without a
+                header, whose changes can't be detected
 
-def load_ciphertext(serialization: str = None, filename: str = None) -> Ciphertext:
+        Returns:
+            (str): Serialization without its header
+
+        Raises:
+            CiphertextFormatError: The serialization can't be a valid ciphertext
+    """
+    serialization = serialization.strip()
+    header = re.match(CIPHERTEXT_HEADER_REGEX, serialization)
+    if header:
+        body = serialization[header.end() :]
+        if len(body) != int(header[1]):
+            raise CiphertextFormatError(
+                f"Ciphertext has {len(body)} characters after its header but should "
+                f"have {header[1]}, it was truncated or extended"
+            )
+        if ciphertext_checksum(body) != header[2]:
+            raise CiphertextFormatError(
+                "Ciphertext checksum does not match, some characters were changed"
+            )
+    elif re.match(r"[0-9]*:", serialization):
+        raise CiphertextFormatError(
+            "Ciphertext header is malformed, it should be <length>:<checksum>:"
+        )
+    elif require_header:
+        raise CiphertextFormatError(
+            "Ciphertext has no <length>:<checksum>: header, pass the whole "
+            "serialization"
+        )
+    else:
+        body = serialization
+
+    if "s" in body:
+        polynomials = body.split("s")
+        if len(polynomials) != 2 or not re.fullmatch(SEED_REGEX, polynomials[1]):
+            raise CiphertextFormatError(
+                "Seeded ciphertext should be <c0>s<ciph_modulus> <seed>, "
+                f"with a seed of {2 * SEED_BYTES} hex digits"
+            )
+        ciph_modulus = int(polynomials[1].split(" ")[0])
+        if params is not None and ciph_modulus != params.ciph_modulus:
+            raise CiphertextFormatError(
+                f"Seeded ciphertext has modulus {ciph_modulus} but the keys use "
+                f"{params.ciph_modulus}"
+            )
+        # Only c0 is a polynomial
+        polynomials = polynomials[:1]
+    else:
+        polynomials = body.split("w")
+        if len(polynomials) != 2:
+            raise CiphertextFormatError(
+                f"Ciphertext should have 2 polynomials separated by w, found {len(polynomials)}"
+            )
+    for name, polynomial in zip(("c0", "c1"), polynomials):
+        if not re.fullmatch(POLYNOMIAL_REGEX, polynomial):
+            raise CiphertextFormatError(
+                f"Polynomial {name} should be space-separated non-negative integers"
+            )
+        ring_degree, *coeffs = polynomial.split(" ")
+        if len(coeffs) != int(ring_degree):
+            raise CiphertextFormatError(
+                f"Polynomial {name} has {len(coeffs)} coefficients but its ring "
+                f"degree is {ring_degree}"
+            )
+        if params is None:
+            continue
+        if int(ring_degree) != params.poly_degree:
+            raise CiphertextFormatError(
+                f"Polynomial {name} has ring degree {ring_degree} but the keys use "
+                f"{params.poly_degree}"
+            )
+        if any(int(coeff) >= params.ciph_modulus for coeff in coeffs):
+            raise CiphertextFormatError(
+                f"Polynomial {name} has coefficients that are not below the "
+                f"ciphertext modulus {params.ciph_modulus}"
+            )
+    return body
+
+
+def load_ciphertext(
+    serialization: str = None,
+    filename: str = None,
+    params: BFVParameters = None,
+    require_header: bool = False,
+) -> Ciphertext:
     """
     Recreates ciphertext from serialization.\n
     If filename is provided, prioritizes loading from file.
+    Seeded serializations load as a SeededCiphertext, whose c1 is only expanded
+    when it is used.
+    Raises CiphertextFormatError if validate_ciphertext rejects the serialization.
     """
     if filename:
         with open(filename, "r") as f:
-            lines = f.readlines()
-        tokens = [x.split(" ") for x in lines[0].split("w")]
-    else:
-        tokens = [x.split(" ") for x in serialization.split("w")]
+            serialization = f.readline()
+    body = validate_ciphertext(serialization, params, require_header)
+    if "s" in body:
+        c0, seed = body.split("s")
+        ciph_modulus, seed = seed.split(" ")
+        return SeededCiphertext(
+            load_polynomial(c0), bytes.fromhex(seed), int(ciph_modulus)
+        )
+    tokens = [x.split(" ") for x in body.split("w")]
     c0 = Polynomial(int(tokens[0][0]), [int(x) for x in tokens[0][1:]])
     c1 = Polynomial(int(tokens[1][0]), [int(x) for x in tokens[1][1:]])
     return Ciphertext(c0, c1)
@@ -91,9 +751,132 @@ def save_encoder(filename: str, serialized_encoder: str):
         f.write(serialized_encoder)
 
 
+def load_polynomial(serialization: str) -> Polynomial:
+    """Recreates a polynomial from serialize_polynomial's output."""
+    tokens = serialization.split(" ")
+    return Polynomial(int(tokens[0]), [int(x) for x in tokens[1:]])
+
+
+def load_params(serialization: str) -> BFVParameters:
+    """Recreates params from serialize_params's output."""
+    tokens = serialization.split(" ")
+    return BFVParameters(
+        poly_degree=int(tokens[0]),
+        plain_modulus=int(tokens[1]),
+        ciph_modulus=int(tokens[2]),
+    )
+
+
+def load_public_key(serialization: str) -> PublicKey:
+    """Recreates a public key from serialize_public_key's output."""
+    p0, p1 = serialization.split("|")
+    return PublicKey(load_polynomial(p0), load_polynomial(p1))
+
+
+def load_relin_key(serialization: str) -> BFVRelinKey:
+    """Recreates a relin key from serialize_relin_key's output."""
+    base, keys = serialization.split("-")
+    return BFVRelinKey(
+        int(base),
+        [
+            tuple(load_polynomial(polynomial) for polynomial in tup.split(","))
+            for tup in keys.split("|")
+        ],
+    )
+
+
+class KeyFile:
+    """
+    Key container with independently addressable sections.
+
+    Opening a key file only reads its offset table. Every section is read and
+    parsed the first time it is accessed, so callers that only need the params
+    or the secret key never parse the relin key. Files in the line-based format
+    written by serialize_encoder can be read as well.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        # Maps section name to (offset, length) in bytes from data_start
+        self.offsets = {}
+        with open(filename, "rb") as f:
+            if f.readline().strip() == KEY_FILE_MAGIC.encode():
+                for line in iter(f.readline, b""):
+                    if not line.strip():
+                        break
+                    name, offset, length = line.decode().split(" ")
+                    self.offsets[name] = (int(offset), int(length))
+                self.data_start = f.tell()
+            else:
+                # Line-based format, one section per line
+                f.seek(0)
+                self.data_start = 0
+                offset = 0
+                for name, line in zip(KEY_SECTIONS, f):
+                    if line.strip():
+                        self.offsets[name] = (offset, len(line.rstrip(b"\r\n")))
+                    offset += len(line)
+
+    def has_section(self, name: str) -> bool:
+        return name in self.offsets
+
+    def read_section(self, name: str) -> str:
+        """Reads the raw serialization of one section."""
+        if name not in self.offsets:
+            raise ValueError(f"{self.filename} has no {name} section")
+        offset, length = self.offsets[name]
+        with open(self.filename, "rb") as f:
+            f.seek(self.data_start + offset)
+            return f.read(length).decode().strip()
+
+    @cached_property
+    def params(self) -> BFVParameters:
+        return load_params(self.read_section("params"))
+
+    @cached_property
+    def public_key(self) -> PublicKey:
+        return load_public_key(self.read_section("public_key"))
+
+    @cached_property
+    def secret_key(self) -> SecretKey:
+        return SecretKey(load_polynomial(self.read_section("secret_key")))
+
+    @cached_property
+    def relin_key(self) -> BFVRelinKey:
+        return load_relin_key(self.read_section("relin_key"))
+
+    @cached_property
+    def ntt_context(self) -> NTTContext:
+        """NTT context stored next to the keys, or None if there is none."""
+        if not self.has_section("ntt_root"):
+            return None
+        return NTTContext(
+            self.params.poly_degree,
+            self.params.ciph_modulus,
+            int(self.read_section("ntt_root")),
+        )
+
+
+# Opened key files, keyed by filename, with the file version they were read at
+_key_files = {}
+
+
+def open_key_file(filename: str) -> KeyFile:
+    """
+    Returns a KeyFile whose parsed sections are shared with earlier calls, as
+    long as the file has not been rewritten since.
+    """
+    stat = os.stat(filename)
+    version = (stat.st_mtime_ns, stat.st_size)
+    if filename not in _key_files or _key_files[filename][0] != version:
+        _key_files[filename] = (version, KeyFile(filename))
+    return _key_files[filename][1]
+
+
 def load_encoder(filename: str):
     """
-    Recreates encoder from serialization stored in a file.
+    Recreates encoder from a key file or a serialization stored in a file.
+    Keys of sections missing from the file are None.
 
     Note: The tuple elements of the relin_key keys are comma-separated.\n
     Format:\n
@@ -102,45 +885,28 @@ def load_encoder(filename: str):
     <secret_key.s>\n
     <relin_key.base>-<relin_key.keys[0]>|...|<relin_key.keys[len(relin_key.keys) - 1]>
     """
-    with open(filename, "r") as f:
-        lines = [line.strip() for line in f.readlines()]
-    # Parse serializations
-    params_serialization = lines[0].split(" ")
-    pk_serialization = [x.split(" ") for x in lines[1].split("|")]
-    sk_serialization = lines[2].split(" ")
-    rk_serialization = lines[3].split("-")
-    # Recreate params object
-    params = BFVParameters(
-        poly_degree=int(params_serialization[0]),
-        plain_modulus=int(params_serialization[1]),
-        ciph_modulus=int(params_serialization[2]),
-    )
-    # Recreate key generator by setting all necessary member variables
-    key_generator = BFVKeyGenerator(params)
-    key_generator.public_key.p0.ring_degree = int(pk_serialization[0][0])
-    key_generator.public_key.p0.coeffs = [int(x) for x in pk_serialization[0][1:]]
-    key_generator.public_key.p1.ring_degree = int(pk_serialization[1][0])
-    key_generator.public_key.p1.coeffs = [int(x) for x in pk_serialization[1][1:]]
-
-    key_generator.secret_key.s.ring_degree = int(sk_serialization[0])
-    key_generator.secret_key.s.coeffs = [int(x) for x in sk_serialization[1:]]
-
-    key_generator.relin_key.base = int(rk_serialization[0])
-    tuples = rk_serialization[1].split("|")
-    key_generator.relin_key.keys = []
-    for tup in tuples:
-        cur_tuple = []
-        polynomials = tup.split(",")
-        for polynomial in polynomials:
-            poly_params = polynomial.split(" ")
-            cur_tuple.append(
-                Polynomial(int(poly_params[0]), [int(x) for x in poly_params[1:]])
-            )
-        key_generator.relin_key.keys.append(tuple(cur_tuple))
-
+    key_file = KeyFile(filename)
+    params = key_file.params
+    # Recreate key generator by setting all necessary member variables, without
+    # generating keys that would be overwritten
+    key_generator = BFVKeyGenerator.__new__(BFVKeyGenerator)
+    for section in ("public_key", "secret_key", "relin_key"):
+        setattr(
+            key_generator,
+            section,
+            getattr(key_file, section) if key_file.has_section(section) else None,
+        )
     return params, key_generator
 
 
+def load_ntt_context(filename: str) -> NTTContext:
+    """
+    Recreates the NTT context stored next to the keys of a key file.
+    Returns None if the file was saved without one.
+    """
+    return KeyFile(filename).ntt_context
+
+
 def check_load_relin_key(k1, k2):
     if k1.base != k2.base or len(k1.keys) != len(k2.keys):
         return False
@@ -156,6 +922,21 @@ def check_load_relin_key(k1, k2):
 
 
 def main(args):
+    if args.preset is not None or args.preset_file is not None:
+        if args.preset_file is not None:
+            preset = load_preset(args.preset_file)
+        else:
+            preset = PARAMETER_PRESETS[args.preset]
+            validate_preset(preset)
+        args.degree = preset["degree"]
+        args.plain_modulus = preset["plain_modulus"]
+        args.ciph_modulus = preset["ciph_modulus"]
+    elif not is_ntt_friendly(args.degree, args.ciph_modulus):
+        print(
+            f"Warning: {args.ciph_modulus} is not a prime congruent to 1 modulo {2 * args.degree}, "
+            + f"polynomial multiplication will not use an NTT. Try --ciph_modulus {find_ntt_modulus(args.degree, args.ciph_modulus)}"
+        )
+
     # Setup of encryptor
     params = BFVParameters(
         poly_degree=args.degree,
@@ -166,32 +947,51 @@ def main(args):
     public_key = key_generator.public_key
     secret_key = key_generator.secret_key
     relin_key = key_generator.relin_key
-    # Save encryptor parameters to file
-    save_encoder("HE.txt", serialize_encoder(params, key_generator))
+    ntt_root = find_ntt_root(params)
+    # Save encryptor parameters to key files
+    save_key_files(args.output_dir, params, key_generator, ntt_root)
     # Test loading encryptor back in
-    loaded_params, loaded_key_generator = load_encoder("HE.txt")
+    key_file = os.path.join(args.output_dir, KEY_FILE)
+    loaded_params, loaded_key_generator = load_encoder(key_file)
+    ntt_context = load_ntt_context(key_file)
+    assert (ntt_context is None) == (ntt_root is None)
     assert loaded_params.scaling_factor == params.scaling_factor
     assert str(loaded_key_generator.public_key) == str(public_key)
     assert str(loaded_key_generator.secret_key) == str(secret_key)
     assert check_load_relin_key(relin_key, loaded_key_generator.relin_key)
+    public_key_file = KeyFile(os.path.join(args.output_dir, PUBLIC_KEY_FILE))
+    secret_key_file = KeyFile(os.path.join(args.output_dir, SECRET_KEY_FILE))
+    assert not public_key_file.has_section("secret_key")
+    assert not secret_key_file.has_section("relin_key")
+    assert str(public_key_file.public_key) == str(public_key)
+    assert str(secret_key_file.secret_key) == str(secret_key)
 
     encoder = IntegerEncoder(params, 10)
-    encryptor = BFVEncryptor(params, public_key)
-    decryptor = BFVDecryptor(params, secret_key)
+    if args.symmetric:
+        # Seeded secret key encryptions serialize to up to half the length
+        base_encryptor = SecretKeyBFVEncryptor(params, secret_key, ntt_context)
+    else:
+        base_encryptor = NTTBFVEncryptor(params, public_key, ntt_context)
+    encryptor = ZeroEncryptionPool(params, base_encryptor)
+    decryptor = NTTBFVDecryptor(params, secret_key, ntt_context)
 
     # Generate and save numbers
     # Limiting max number so all numbers multiplied by themselves can be
     # handled by encryptor since user can choose to do that in HE_agent.
     num = 0
-    while num**2 <= (args.plain_modulus - 1):
+    while num**2 <= (args.plain_modulus - 1) and (
+        args.num_ciphertexts is None or num < args.num_ciphertexts
+    ):
         plaintext = encoder.encode(num)
         ciphtext = encryptor.encrypt(plaintext)
-        with open(f"{num}.txt", "w") as f:
+        filename = os.path.join(args.output_dir, f"{num}.txt")
+        with open(filename, "w") as f:
             f.write(serialize_ciphertext(ciphtext))
         # Verify save works
-        loaded_ciphertext = load_ciphertext(filename=f"{num}.txt")
+        loaded_ciphertext = load_ciphertext(filename=filename)
         assert encoder.decode(decryptor.decrypt(loaded_ciphertext)) == num
         num += 1
+    encryptor.close()
 
 
 if __name__ == "__main__":
@@ -208,7 +1008,7 @@ if __name__ == "__main__":
             return value
         except ValueError:
             print(
-                "usage: HE_data.py [-h] [--degree DEGREE] [--plain_modulus PLAIN_MODULUS] [--ciph_modulus CIPH_MODULUS]"
+                "usage: HE_data.py [-h] [--degree DEGREE] [--plain_modulus PLAIN_MODULUS] [--ciph_modulus CIPH_MODULUS] [--preset PRESET]"
             )
             print(
                 f"HE_data.py: error: argument --plain_modulus: invalid check_plain_modulus value: '{value}'"
@@ -228,8 +1028,45 @@ if __name__ == "__main__":
         help="Prime congruent to 1 modulo 16, encryptor can only handle numbers in interval [0, plain_modulus - 1]",
     )
     parser.add_argument(
-        "--ciph_modulus", type=int, required=False, default=8000000000000
+        "--ciph_modulus",
+        type=int,
+        required=False,
+        default=PARAMETER_PRESETS["default"]["ciph_modulus"],
+        help="Ciphertext modulus, NTT multiplication is used if it is a prime congruent to 1 modulo 2 * degree",
+    )
+    parser.add_argument(
+        "--preset",
+        choices=list(PARAMETER_PRESETS),
+        default=None,
+        required=False,
+        help="NTT-friendly parameter preset, overrides --degree, --plain_modulus and --ciph_modulus",
+    )
+    parser.add_argument(
+        "--preset_file",
+        default=None,
+        required=False,
+        help="JSON parameter preset written by tune.py, overrides --preset",
+    )
+    parser.add_argument(
+        "--num_ciphertexts",
+        type=int,
+        default=None,
+        required=False,
+        help="Only pre-encrypt numbers below this, agents/HE_agent.py --numbers encrypts others on demand",
+    )
+    parser.add_argument(
+        "--symmetric",
+        action="store_true",
+        help="Encrypt with the secret key and store c1 as a seed, shrinking ciphertexts by up to half",
+    )
+
+    parser.add_argument(
+        "--output_dir",
+        default=os.path.dirname(os.path.abspath(__file__)),
+        required=False,
+        help="Directory to write the key and ciphertext files to, defaults to HE_data",
     )
 
+    add_profile_arguments(parser, llm=False)
     args = parser.parse_args()
-    main(args)
+    run_profiled(main, args)
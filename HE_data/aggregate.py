@@ -0,0 +1,300 @@
+import argparse
+from array import array
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import partial
+import os
+import time
+from typing import Callable
+
+from bfv.int_encoder import IntegerEncoder
+from util.ciphertext import Ciphertext
+
+from HE_data.compact import COEFF_TYPECODE, CompactCiphertext, CompactCiphertextArray
+from HE_data.HE_data import (
+    NTTBFVEvaluator,
+    PUBLIC_KEY_FILE,
+    get_zero_pool,
+    open_key_file,
+    serialize_ciphertext,
+)
+from HE_data.store import CiphertextStore
+
+OPERATIONS = ("sum", "product")
+# Rows reduced by one task
+SHARD_ROWS = 8192
+# Base of the IntegerEncoder the stored values are encoded with
+ENCODER_BASE = 10
+# Products of more rows need more than one multiplication, which overflows the
+# noise budget of the presets
+MAX_PRODUCT_ROWS = 2
+
+
+class ResultOverflowError(ValueError):
+    """Raised when the result of an aggregation could exceed the plaintext modulus."""
+
+    def __init__(self, operation: str, rows: int, max_rows: int):
+        super().__init__(
+            f"The {operation} of {rows} rows can overflow the plaintext modulus, "
+            f"at most {max_rows} rows are supported"
+        )
+        self.operation = operation
+        self.rows = rows
+        self.max_rows = max_rows
+
+
+def max_rows(params, operation: str) -> int:
+    """
+    Returns the most rows an aggregation can combine without its result
+    decrypting wrong. Every coefficient of an encoded value is a digit below
+    ENCODER_BASE, and the coefficients of sums and products add up modulo
+    plain_modulus with no carry, so a sum of n rows is only safe while
+    n * (ENCODER_BASE - 1) < plain_modulus. Products are also limited by noise.
+
+        Args:
+            params (BFVParameters): Parameters of the store's keys
+            operation (str): "sum" or "product"
+
+        Returns:
+            (int): Largest number of rows
+    """
+    largest_digit = ENCODER_BASE - 1
+    if operation == "sum":
+        return (params.plain_modulus - 1) // largest_digit
+    digits = len(str(params.plain_modulus - 1))
+    if digits * largest_digit**2 >= params.plain_modulus:
+        return 1
+    return MAX_PRODUCT_ROWS
+
+
+def tree_reduce(items: list, combine: Callable, executor: Executor = None):
+    """
+    Combines items pairwise, level by level, until one is left. Products then
+    chain log2(n) multiplications instead of n - 1, which keeps their noise low,
+    and the pairs of a level run in parallel if an executor is given.
+
+        Args:
+            items (list): Items to combine, at least one
+            combine (Callable): Associative function of two items
+            executor (Executor): Pool that combines the pairs of a level
+
+        Returns:
+            Combination of all items
+    """
+    while len(items) > 1:
+        pairs = list(zip(items[::2], items[1::2]))
+        if executor is None:
+            combined = [combine(left, right) for left, right in pairs]
+        else:
+            combined = list(executor.map(combine, *zip(*pairs)))
+        items = combined + items[len(pairs) * 2 :]
+    return items[0]
+
+
+def sum_compact(ciphertexts: CompactCiphertextArray, ciph_modulus: int) -> array:
+    """
+    Adds the ciphertexts of an array. Ciphertext addition adds coefficients
+    modulo ciph_modulus, so every coefficient of the sum is one strided sum
+    over the array, without building a Ciphertext per row.
+
+        Args:
+            ciphertexts (CompactCiphertextArray): Ciphertexts to add, at least one
+            ciph_modulus (int): Ciphertext modulus of the keys
+
+        Returns:
+            (array): Coefficients of the sum, c0 followed by c1
+    """
+    size = 2 * ciphertexts.ring_degree
+    coeffs = ciphertexts.coeffs
+    return array(
+        COEFF_TYPECODE, (sum(coeffs[j::size]) % ciph_modulus for j in range(size))
+    )
+
+
+def _evaluator(key_file: str):
+    keys = open_key_file(key_file)
+    return keys, NTTBFVEvaluator(keys.params, keys.ntt_context)
+
+
+def multiply_coeffs(key_file: str, coeffs1: array, coeffs2: array) -> array:
+    """Multiplies two ciphertexts given as compact coefficients and relinearizes."""
+    keys, evaluator = _evaluator(key_file)
+    degree = keys.params.poly_degree
+    product = evaluator.multiply(
+        CompactCiphertext(degree, coeffs1).to_ciphertext(),
+        CompactCiphertext(degree, coeffs2).to_ciphertext(),
+        keys.relin_key,
+    )
+    return CompactCiphertext.from_ciphertext(product).coeffs
+
+
+def add_coeffs(ciph_modulus: int, coeffs1: array, coeffs2: array) -> array:
+    """Adds two ciphertexts given as compact coefficients."""
+    return array(
+        COEFF_TYPECODE,
+        ((a + b) % ciph_modulus for a, b in zip(coeffs1, coeffs2)),
+    )
+
+
+def reduce_shard(
+    store_dir: str,
+    key_file: str,
+    column: str,
+    start: int,
+    stop: int,
+    operation: str,
+    row_ids: frozenset = None,
+) -> tuple[int, array]:
+    """
+    Reads one range of rows of a stored column and adds or multiplies them.
+
+        Args:
+            store_dir (str): Directory of the ciphertext store
+            key_file (str): Key file with the params and relin key
+            column (str): Column to aggregate
+            start (int): Index of the first row of the shard
+            stop (int): Index after the last row of the shard
+            operation (str): "sum" or "product"
+            row_ids (frozenset): Only aggregate rows with these IDs, or None for all
+
+        Returns:
+            (tuple[int, array]): Rows aggregated and the coefficients of the
+                result, None if no row of the shard matched
+    """
+    store = CiphertextStore(store_dir)
+    ids, ciphertexts = store.read(column, start, stop)
+    if row_ids is not None:
+        selected = CompactCiphertextArray(store.ring_degree)
+        for i, row_id in enumerate(ids):
+            if row_id in row_ids:
+                selected.append(ciphertexts[i])
+        ciphertexts = selected
+    if len(ciphertexts) == 0:
+        return 0, None
+    if operation == "sum":
+        return len(ciphertexts), sum_compact(ciphertexts, store.params.ciph_modulus)
+    return len(ciphertexts), tree_reduce(
+        [array(COEFF_TYPECODE, ciphertexts[i].coeffs) for i in range(len(ciphertexts))],
+        partial(multiply_coeffs, key_file),
+    )
+
+
+def aggregate(
+    store_dir: str,
+    column: str,
+    operation: str = "sum",
+    row_ids: list[int] = None,
+    key_file: str = os.path.join("HE_data", PUBLIC_KEY_FILE),
+    shard_rows: int = SHARD_ROWS,
+    executor: Executor = None,
+) -> tuple[Ciphertext, int]:
+    """
+    Adds or multiplies the ciphertexts of a stored column, or of its rows with
+    given IDs, without any of them passing through the caller. The column is
+    split into shards that are read and reduced in the executor's processes,
+    and the partial results are combined with a tree. Aggregations of more rows
+    than max_rows allows are rejected before any ciphertext is read.
+
+        Args:
+            store_dir (str): Directory of the ciphertext store
+            column (str): Column to aggregate
+            operation (str): "sum" or "product"
+            row_ids (list[int]): Only aggregate rows with these IDs, or None for all
+            key_file (str): Key file with the params, public key and relin key
+            shard_rows (int): Rows reduced by one task
+            executor (Executor): Process pool to reduce the shards in, a single
+                shard is reduced in this process if None
+
+        Returns:
+            (tuple[Ciphertext, int]): Result and the number of rows aggregated,
+                an encryption of 0 or 1 if no row matched
+
+        Raises:
+            ResultOverflowError: More rows match than max_rows allows
+    """
+    if operation not in OPERATIONS:
+        raise ValueError(f"Unknown operation {operation}, expected one of {OPERATIONS}")
+    keys = open_key_file(key_file)
+    store = CiphertextStore(store_dir, keys)
+    count = store.count(column)
+    wanted = None if row_ids is None else frozenset(row_ids)
+    matching = count
+    if wanted is not None:
+        matching = sum(row_id in wanted for row_id in store.read_ids(column))
+    limit = max_rows(keys.params, operation)
+    if matching > limit:
+        raise ResultOverflowError(operation, matching, limit)
+    shards = [
+        (store_dir, key_file, column, start, start + shard_rows, operation, wanted)
+        for start in range(0, count, shard_rows)
+    ]
+    if executor is None or len(shards) <= 1:
+        partials = [reduce_shard(*shard) for shard in shards]
+    else:
+        partials = list(executor.map(reduce_shard, *zip(*shards)))
+    rows = sum(matched for matched, _ in partials)
+    partials = [coeffs for _, coeffs in partials if coeffs is not None]
+    if not partials:
+        # Matches add_encrypted_numbers and multiply_encrypted_numbers of no numbers
+        encoder = IntegerEncoder(keys.params, ENCODER_BASE)
+        encryptor = get_zero_pool(keys.params, keys.public_key, keys.ntt_context)
+        return encryptor.encrypt(encoder.encode(0 if operation == "sum" else 1)), 0
+    if operation == "sum":
+        # Additions are cheaper than sending their operands to the pool
+        result = tree_reduce(partials, partial(add_coeffs, keys.params.ciph_modulus))
+    else:
+        result = tree_reduce(partials, partial(multiply_coeffs, key_file), executor)
+    return CompactCiphertext(store.ring_degree, result).to_ciphertext(), rows
+
+
+def main(args):
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        try:
+            result, rows = aggregate(
+                args.store,
+                args.column,
+                args.operation,
+                args.row_ids,
+                args.key_file,
+                args.shard_rows,
+                executor,
+            )
+        except ResultOverflowError as e:
+            raise SystemExit(str(e))
+    seconds = time.perf_counter() - start
+    print(serialize_ciphertext(result))
+    print(
+        f"{args.operation.capitalize()} of {rows} ciphertexts of {args.column} "
+        f"in {seconds:.2f} s"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("store", help="Ciphertext store directory")
+    parser.add_argument("column", help="Column to aggregate")
+    parser.add_argument("--operation", choices=OPERATIONS, default="sum")
+    parser.add_argument(
+        "--row_ids",
+        nargs="+",
+        type=int,
+        default=None,
+        help="Only aggregate the rows with these IDs",
+    )
+    parser.add_argument(
+        "--key_file",
+        default=os.path.join("HE_data", PUBLIC_KEY_FILE),
+        help="Key file with the params, public key and relin key",
+    )
+    parser.add_argument(
+        "--shard_rows", type=int, default=SHARD_ROWS, help="Rows reduced by one task"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Worker processes, defaults to the CPU count",
+    )
+
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,195 @@
+from array import array
+import struct
+import sys
+from typing import BinaryIO
+
+from HE_data.HE_data import (
+    CiphertextFormatError,
+    SeededCiphertext,
+    ciphertext_checksum,
+    expand_seed,
+    validate_ciphertext,
+)
+from bfv.bfv_parameters import BFVParameters
+from util.ciphertext import Ciphertext
+from util.polynomial import Polynomial
+
+# Coefficients are stored as unsigned 64-bit integers, which holds every
+# coefficient as long as ciph_modulus <= MAX_CIPH_MODULUS
+COEFF_TYPECODE = "Q"
+MAX_CIPH_MODULUS = 2**64
+# Header of a binary ciphertext file: <ring_degree> <number of ciphertexts>
+HEADER = struct.Struct("<QQ")
+
+
+class CompactCiphertext:
+    """
+    Ciphertext whose two polynomials are stored in one flat buffer of unsigned
+    64-bit coefficients, c0 followed by c1.
+
+    The buffer can be an array owned by the ciphertext or a view into a
+    CompactCiphertextArray. py-fhe objects are only built by to_ciphertext.
+    A ciphertext made from a SeededCiphertext keeps its seed, c1 is expanded
+    into the buffer but serialize still writes the seed.
+    """
+
+    __slots__ = ("ring_degree", "coeffs", "seed")
+
+    def __init__(self, ring_degree: int, coeffs, seed: tuple[int, bytes] = None):
+        if len(coeffs) != 2 * ring_degree:
+            raise ValueError(
+                f"Expected {2 * ring_degree} coefficients, got {len(coeffs)}"
+            )
+        self.ring_degree = ring_degree
+        self.coeffs = coeffs
+        # (ciph_modulus, seed) that c1 was expanded from, or None
+        self.seed = seed
+
+    @classmethod
+    def from_ciphertext(cls, ciphertext: Ciphertext) -> "CompactCiphertext":
+        """Copies the coefficients of a py-fhe ciphertext into a compact one."""
+        try:
+            coeffs = array(COEFF_TYPECODE, ciphertext.c0.coeffs)
+            coeffs.extend(ciphertext.c1.coeffs)
+        except OverflowError:
+            raise ValueError("Ciphertext coefficients do not fit in 64 bits")
+        seed = None
+        if isinstance(ciphertext, SeededCiphertext):
+            seed = (ciphertext.ciph_modulus, ciphertext.seed)
+        return cls(ciphertext.c0.ring_degree, coeffs, seed)
+
+    @classmethod
+    def from_serialization(
+        cls, serialization: str, params: BFVParameters = None
+    ) -> "CompactCiphertext":
+        """
+        Parses serialize_ciphertext's output without building polynomials.
+        Raises CiphertextFormatError if the serialization is invalid or its
+        coefficients don't fit in 64 bits.
+
+            Args:
+                serialization (str): Output of serialize_ciphertext
+                params (BFVParameters): Parameters the ciphertext should be
+                    encrypted under, to check them before parsing
+        """
+        if params is not None and params.ciph_modulus > MAX_CIPH_MODULUS:
+            raise CiphertextFormatError(
+                "Compact ciphertexts need a ciph_modulus of at most 2^64"
+            )
+        coeffs = array(COEFF_TYPECODE)
+        ring_degree = None
+        body = validate_ciphertext(serialization, params)
+        try:
+            if "s" in body:
+                c0, seed = body.split("s")
+                ciph_modulus, seed = seed.split(" ")
+                if int(ciph_modulus) > MAX_CIPH_MODULUS:
+                    raise OverflowError
+                tokens = c0.split(" ")
+                ring_degree = int(tokens[0])
+                coeffs.extend(map(int, tokens[1:]))
+                seed = (int(ciph_modulus), bytes.fromhex(seed))
+                coeffs.extend(expand_seed(seed[1], ring_degree, seed[0]).coeffs)
+                return cls(ring_degree, coeffs, seed)
+            for polynomial in body.split("w"):
+                tokens = polynomial.split(" ")
+                ring_degree = int(tokens[0])
+                coeffs.extend(map(int, tokens[1:]))
+        except OverflowError:
+            raise CiphertextFormatError(
+                "Ciphertext coefficients do not fit in 64 bits, load it with "
+                "load_ciphertext instead"
+            )
+        return cls(ring_degree, coeffs)
+
+    @property
+    def c0(self) -> memoryview:
+        """Zero-copy view of the coefficients of c0."""
+        return memoryview(self.coeffs)[: self.ring_degree]
+
+    @property
+    def c1(self) -> memoryview:
+        """Zero-copy view of the coefficients of c1."""
+        return memoryview(self.coeffs)[self.ring_degree :]
+
+    def to_ciphertext(self) -> Ciphertext:
+        """Builds the equivalent py-fhe ciphertext."""
+        c1 = Polynomial(self.ring_degree, list(self.c1))
+        if self.seed is None:
+            return Ciphertext(Polynomial(self.ring_degree, list(self.c0)), c1)
+        ciphertext = SeededCiphertext(
+            Polynomial(self.ring_degree, list(self.c0)), self.seed[1], self.seed[0]
+        )
+        ciphertext.c1 = c1
+        return ciphertext
+
+    def serialize(self) -> str:
+        """Serializes into the same format as HE_data.serialize_ciphertext."""
+        if self.seed is None:
+            body = "w".join(
+                f"{self.ring_degree} " + " ".join(map(str, view))
+                for view in (self.c0, self.c1)
+            )
+        else:
+            body = (
+                f"{self.ring_degree} "
+                + " ".join(map(str, self.c0))
+                + f"s{self.seed[0]} {self.seed[1].hex()}"
+            )
+        return f"{len(body)}:{ciphertext_checksum(body)}:{body}"
+
+
+class CompactCiphertextArray:
+    """
+    Ciphertexts of one ring degree stored back to back in a single contiguous
+    array. Indexing returns a CompactCiphertext that views the array without
+    copying. The array cannot be appended to while such views are alive.
+    """
+
+    __slots__ = ("ring_degree", "coeffs")
+
+    def __init__(self, ring_degree: int, coeffs: array = None):
+        self.ring_degree = ring_degree
+        self.coeffs = array(COEFF_TYPECODE) if coeffs is None else coeffs
+
+    def __len__(self) -> int:
+        return len(self.coeffs) // (2 * self.ring_degree)
+
+    def __getitem__(self, index: int) -> CompactCiphertext:
+        if not -len(self) <= index < len(self):
+            raise IndexError(f"Ciphertext index {index} out of range")
+        start = (index % len(self)) * 2 * self.ring_degree
+        return CompactCiphertext(
+            self.ring_degree,
+            memoryview(self.coeffs)[start : start + 2 * self.ring_degree],
+        )
+
+    def append(self, ciphertext):
+        """Appends a py-fhe or compact ciphertext."""
+        if isinstance(ciphertext, Ciphertext):
+            ciphertext = CompactCiphertext.from_ciphertext(ciphertext)
+        if ciphertext.ring_degree != self.ring_degree:
+            raise ValueError(
+                f"Expected ring degree {self.ring_degree}, got {ciphertext.ring_degree}"
+            )
+        self.coeffs.extend(ciphertext.coeffs)
+
+    def tofile(self, f: BinaryIO):
+        """Writes the ciphertexts to a binary file without building strings."""
+        f.write(HEADER.pack(self.ring_degree, len(self)))
+        if sys.byteorder == "big":
+            coeffs = array(COEFF_TYPECODE, self.coeffs)
+            coeffs.byteswap()
+            coeffs.tofile(f)
+        else:
+            self.coeffs.tofile(f)
+
+    @classmethod
+    def fromfile(cls, f: BinaryIO) -> "CompactCiphertextArray":
+        """Reads ciphertexts written by tofile."""
+        ring_degree, count = HEADER.unpack(f.read(HEADER.size))
+        coeffs = array(COEFF_TYPECODE)
+        coeffs.fromfile(f, 2 * ring_degree * count)
+        if sys.byteorder == "big":
+            coeffs.byteswap()
+        return cls(ring_degree, coeffs)
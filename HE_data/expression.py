@@ -0,0 +1,223 @@
+import ast
+from collections import Counter
+import heapq
+import re
+
+from bfv.bfv_relin_key import BFVRelinKey
+from bfv.int_encoder import IntegerEncoder
+from HE_data.HE_data import NTTBFVEvaluator
+from util.ciphertext import Ciphertext
+
+# Operand references look like x0, x1, ... and index into the operand list
+OPERAND_REGEX = r"x([0-9]+)"
+
+
+class ExpressionError(ValueError):
+    """Raised when an expression can't be evaluated over the given operands."""
+
+
+def parse_expression(expression: str) -> tuple:
+    """
+    Parses an arithmetic expression over operand references into a canonical DAG.
+
+    Nodes are nested tuples: ("operand", i), ("const", k), ("add", children) and
+    ("mul", children). Sums and products are flattened and their children sorted,
+    so equal subexpressions such as x0 * x1 and x1 * x0 become the same node and
+    are only evaluated once.
+
+        Args:
+            expression (str): Expression using +, *, parentheses, operand
+                references x0, x1, ... and non-negative integer constants
+
+        Returns:
+            (tuple): Root node of the expression DAG
+    """
+    try:
+        tree = ast.parse(expression, mode="eval")
+    except SyntaxError:
+        raise ExpressionError(f"Expression {expression!r} is not valid")
+    return _canonicalize(tree.body)
+
+
+def _canonicalize(node: ast.AST) -> tuple:
+    """Converts a Python AST node into a canonical DAG node."""
+    if isinstance(node, ast.Name):
+        match = re.fullmatch(OPERAND_REGEX, node.id)
+        if not match:
+            raise ExpressionError(f"{node.id} is not an operand reference like x0")
+        return ("operand", int(match[1]))
+    if isinstance(node, ast.Constant):
+        if type(node.value) is not int or node.value < 0:
+            raise ExpressionError(f"{node.value!r} is not a non-negative integer")
+        return ("const", node.value)
+    if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.Add, ast.Mult)):
+        op = "add" if isinstance(node.op, ast.Add) else "mul"
+        children = []
+        for child in (_canonicalize(node.left), _canonicalize(node.right)):
+            if child[0] == op:
+                children.extend(child[1])
+            else:
+                children.append(child)
+
+        # Fold constants into a single constant child
+        consts = [child[1] for child in children if child[0] == "const"]
+        children = [child for child in children if child[0] != "const"]
+        if consts:
+            folded = 0 if op == "add" else 1
+            for const in consts:
+                folded = folded + const if op == "add" else folded * const
+            if not children:
+                return ("const", folded)
+            if folded != (0 if op == "add" else 1):
+                children.append(("const", folded))
+        if len(children) == 1:
+            return children[0]
+        return (op, tuple(sorted(children, key=repr)))
+    raise ExpressionError(f"Unsupported expression element {ast.dump(node)}")
+
+
+def multiplicative_depth(node: tuple) -> int:
+    """Returns the multiplicative depth a node is evaluated at by evaluate_expression."""
+    if node[0] in ("operand", "const"):
+        return 0
+    depths = [multiplicative_depth(child) for child in node[1] if child[0] != "const"]
+    if node[0] == "add":
+        return max(depths)
+    # Products are evaluated as a Huffman tree over the children's depths
+    heapq.heapify(depths)
+    while len(depths) > 1:
+        heapq.heappush(depths, max(heapq.heappop(depths), heapq.heappop(depths)) + 1)
+    return depths[0]
+
+
+def evaluate_expression(
+    expression: str,
+    operands: list[Ciphertext],
+    evaluator: NTTBFVEvaluator,
+    relin_key: BFVRelinKey,
+    encoder: IntegerEncoder,
+) -> Ciphertext:
+    """
+    Evaluates an arithmetic expression over ciphertexts in one pass.
+
+    Common subexpressions are evaluated once, products are multiplied shallowest
+    operands first to minimize multiplicative depth, the products of a sum are
+    relinearized once after adding them up, and constants are applied with
+    plaintext operations instead of being encrypted.
+
+        Args:
+            expression (str): Expression using +, *, parentheses, operand
+                references x0, x1, ... and non-negative integer constants
+            operands (list[Ciphertext]): Ciphertexts referenced by the expression
+            evaluator (NTTBFVEvaluator): Evaluator for the ciphertexts' parameters
+            relin_key (BFVRelinKey): Relinearization key of the key set
+            encoder (IntegerEncoder): Encoder used for constants
+
+        Returns:
+            (Ciphertext): Ciphertext of the expression's value
+    """
+    root = parse_expression(expression)
+    if root[0] == "const":
+        raise ExpressionError(
+            f"Expression {expression!r} does not reference an operand"
+        )
+    # Maps node to (ciphertext, multiplicative depth)
+    memo = {}
+    modulus = evaluator.params.ciph_modulus
+    # Number of times each node is used in the expression
+    references = Counter()
+
+    def count_references(node: tuple):
+        if node[0] in ("add", "mul"):
+            for child in node[1]:
+                references[child] += 1
+                if references[child] == 1:
+                    count_references(child)
+
+    count_references(root)
+
+    def multiply(node: tuple, relinearize: bool = True) -> tuple[Ciphertext, int]:
+        """
+        Multiplies the children of a product node. Without relinearize, the last
+        multiplication is left unrelinearized and its three components are
+        returned in place of the ciphertext.
+        """
+        const = None
+        values = []
+        for child in node[1]:
+            if child[0] == "const":
+                const = encoder.encode(child[1])
+            else:
+                values.append(evaluate(child))
+        # Entries are (depth, tiebreaker, ciphertext) so ciphertexts are
+        # never compared
+        heap = [(value[1], i, value[0]) for i, value in enumerate(values)]
+        heapq.heapify(heap)
+        count = len(heap)
+        while len(heap) > 1:
+            depth1, _, ciphertext1 = heapq.heappop(heap)
+            depth2, _, ciphertext2 = heapq.heappop(heap)
+            if heap or relinearize:
+                product = evaluator.multiply(ciphertext1, ciphertext2, relin_key)
+            else:
+                # The constant is applied to a factor, since the product has
+                # three components
+                if const is not None:
+                    ciphertext1 = evaluator.multiply_plain(ciphertext1, const)
+                    const = None
+                product = evaluator.multiply_unrelinearized(ciphertext1, ciphertext2)
+            heapq.heappush(heap, (max(depth1, depth2) + 1, count, product))
+            count += 1
+        depth, _, ciphertext = heap[0]
+        if const is not None:
+            ciphertext = evaluator.multiply_plain(ciphertext, const)
+        return ciphertext, depth
+
+    def evaluate(node: tuple) -> tuple[Ciphertext, int]:
+        if node in memo:
+            return memo[node]
+        if node[0] == "operand":
+            if node[1] >= len(operands):
+                raise ExpressionError(
+                    f"x{node[1]} does not exist, there are {len(operands)} operands"
+                )
+            result = (operands[node[1]], 0)
+        elif node[0] == "mul":
+            result = multiply(node)
+        else:
+            const = None
+            values = []
+            # Products only used by this sum are added up unrelinearized and
+            # relinearized once, saving a key switch per extra product
+            unrelinearized = []
+            for child in node[1]:
+                if child[0] == "const":
+                    const = encoder.encode(child[1])
+                elif child[0] == "mul" and references[child] == 1:
+                    value = multiply(child, relinearize=False)
+                    if isinstance(value[0], tuple):
+                        unrelinearized.append(value)
+                    else:
+                        values.append(value)
+                else:
+                    values.append(evaluate(child))
+            if unrelinearized:
+                components, depth = unrelinearized[0]
+                for value in unrelinearized[1:]:
+                    components = [
+                        poly1.add(poly2, modulus)
+                        for poly1, poly2 in zip(components, value[0])
+                    ]
+                    depth = max(depth, value[1])
+                values.append((evaluator.relinearize(relin_key, *components), depth))
+            ciphertext, depth = values[0]
+            for value in values[1:]:
+                ciphertext = evaluator.add(ciphertext, value[0])
+                depth = max(depth, value[1])
+            if const is not None:
+                ciphertext = evaluator.add_plain(ciphertext, const)
+            result = (ciphertext, depth)
+        memo[node] = result
+        return result
+
+    return evaluate(root)[0]
@@ -0,0 +1,290 @@
+import argparse
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import os
+import time
+from typing import Iterator
+
+from bfv.int_encoder import IntegerEncoder
+
+from HE_data.compact import COEFF_TYPECODE, CompactCiphertextArray
+from HE_data.HE_data import NTTBFVEncryptor, PUBLIC_KEY_FILE, open_key_file
+from HE_data.store import CiphertextStore
+
+# Encryptor and encoder of the worker processes, set by initialize_worker
+_worker = {}
+
+
+def initialize_worker(key_file: str):
+    """Loads the public key once per worker process."""
+    keys = open_key_file(key_file)
+    _worker["encoder"] = IntegerEncoder(keys.params, 10)
+    _worker["encryptor"] = NTTBFVEncryptor(
+        keys.params, keys.public_key, keys.ntt_context
+    )
+
+
+def encrypt_batch(values: list[int]) -> array:
+    """
+    Encrypts a batch of numbers in a worker process.
+
+        Args:
+            values (list[int]): Numbers between 0 and plain_modulus - 1
+
+        Returns:
+            (array): Coefficients of the ciphertexts, c0 and c1 of each in turn
+    """
+    encoder = _worker["encoder"]
+    encryptor = _worker["encryptor"]
+    coeffs = array(COEFF_TYPECODE)
+    for value in values:
+        ciphertext = encryptor.encrypt(encoder.encode(value))
+        coeffs.extend(ciphertext.c0.coeffs)
+        coeffs.extend(ciphertext.c1.coeffs)
+    return coeffs
+
+
+def check_values(values, plain_modulus: int, column: str, first_row: int) -> list[int]:
+    """
+    Converts a chunk of a column to integers the keys can encrypt.
+
+        Args:
+            values (Iterable): Cells of the column, strings or numbers
+            plain_modulus (int): Numbers must be between 0 and plain_modulus - 1
+            column (str): Column name, for error messages
+            first_row (int): Row number of the first cell, for error messages
+
+        Returns:
+            (list[int]): Cells as integers
+
+        Raises:
+            ValueError: A cell is not an integer or is out of range
+    """
+    numbers = []
+    for row, value in enumerate(values, first_row):
+        try:
+            number = int(value.strip()) if isinstance(value, str) else int(value)
+            if number != value and not isinstance(value, str):
+                raise ValueError
+        except (TypeError, ValueError):
+            raise ValueError(
+                f"Row {row} of column {column} is {value!r}, not an integer"
+            ) from None
+        if not 0 <= number < plain_modulus:
+            raise ValueError(
+                f"Row {row} of column {column} is {number}, outside the plaintext "
+                f"range 0 to {plain_modulus - 1}"
+            )
+        numbers.append(number)
+    return numbers
+
+
+def read_csv_columns(
+    path: str, columns: list[str], id_column: str, chunk_rows: int
+) -> Iterator[tuple[list, dict[str, list]]]:
+    """Streams columns of a CSV file with a header row, and its row IDs if any."""
+    with open(path, "r", newline="") as f:
+        reader = csv.DictReader(f)
+        missing = set(columns + ([id_column] if id_column else [])) - set(
+            reader.fieldnames or []
+        )
+        if missing:
+            raise ValueError(f"{path} has no column {', '.join(sorted(missing))}")
+        rows = []
+        for row in reader:
+            rows.append(row)
+            if len(rows) == chunk_rows:
+                yield _split_rows(rows, columns, id_column)
+                rows = []
+        if rows:
+            yield _split_rows(rows, columns, id_column)
+
+
+def _split_rows(rows: list[dict], columns: list[str], id_column: str):
+    row_ids = [row[id_column] for row in rows] if id_column else None
+    return row_ids, {column: [row[column] for row in rows] for column in columns}
+
+
+def read_npy_columns(
+    path: str, columns: list[str], id_column: str, chunk_rows: int
+) -> Iterator[tuple[list, dict[str, list]]]:
+    """
+    Streams columns of a .npy file, which is memory-mapped rather than loaded.
+    Columns of a structured array are its field names, columns of a 2D array
+    are their indices and a 1D array is column 0.
+    """
+    import numpy as np
+
+    data = np.load(path, mmap_mode="r")
+    if data.dtype.names is not None:
+        get_column = lambda chunk, name: chunk[name]
+        names = data.dtype.names
+    elif data.ndim == 2:
+        get_column = lambda chunk, name: chunk[:, int(name)]
+        names = [str(i) for i in range(data.shape[1])]
+    elif data.ndim == 1:
+        get_column = lambda chunk, name: chunk
+        names = ["0"]
+    else:
+        raise ValueError(f"{path} has {data.ndim} dimensions, expected 1 or 2")
+    missing = set(columns + ([id_column] if id_column else [])) - set(names)
+    if missing:
+        raise ValueError(f"{path} has no column {', '.join(sorted(missing))}")
+    for start in range(0, len(data), chunk_rows):
+        chunk = data[start : start + chunk_rows]
+        row_ids = get_column(chunk, id_column).tolist() if id_column else None
+        yield row_ids, {name: get_column(chunk, name).tolist() for name in columns}
+
+
+def ingest(
+    input_path: str,
+    store_dir: str,
+    key_file: str,
+    columns: list[str],
+    id_column: str = None,
+    chunk_rows: int = 1000,
+    workers: int = None,
+    report_interval: float = 10,
+) -> dict:
+    """
+    Streams numeric columns of a CSV or .npy file into a ciphertext store. Chunks
+    are range-checked, encrypted in a process pool and appended in order, with at
+    most two chunks per worker in memory, so files larger than memory can be
+    ingested. Only the given columns become columns of the store, other columns
+    of the file are skipped apart from id_column.
+
+        Args:
+            input_path (str): CSV file with a header row or .npy file
+            store_dir (str): Directory of the store, created if needed
+            key_file (str): Key file with the params and public key
+            columns (list[str]): Columns to encrypt
+            id_column (str): Column of non-negative integer row IDs, or None to
+                number rows on from the store's next row ID
+            chunk_rows (int): Rows encrypted per task
+            workers (int): Worker processes, defaults to the CPU count
+            report_interval (float): Seconds between progress reports
+
+        Returns:
+            (dict): Rows, ciphertexts, seconds and ciphertexts per second of the run
+    """
+    keys = open_key_file(key_file)
+    store = CiphertextStore(store_dir, keys)
+    plain_modulus = store.params.plain_modulus
+    read_columns = read_npy_columns if input_path.endswith(".npy") else read_csv_columns
+    workers = workers or os.cpu_count()
+    next_row_id = store.next_row_id
+    start = time.perf_counter()
+    last_report = start
+    rows = 0
+    ciphertexts = 0
+
+    def write(row_ids, futures):
+        nonlocal ciphertexts
+        for column, future in futures.items():
+            store.append(
+                column,
+                row_ids,
+                CompactCiphertextArray(store.ring_degree, future.result()),
+            )
+            ciphertexts += len(row_ids)
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=initialize_worker, initargs=(key_file,)
+    ) as executor:
+        pending = deque()
+        try:
+            for row_ids, chunk in read_columns(
+                input_path, columns, id_column, chunk_rows
+            ):
+                size = len(next(iter(chunk.values())))
+                if row_ids is None:
+                    row_ids = range(next_row_id, next_row_id + size)
+                    next_row_id += size
+                else:
+                    row_ids = check_values(row_ids, 2**64, id_column, rows)
+                # Check every column before encrypting any of the chunk
+                numbers = {
+                    column: check_values(values, plain_modulus, column, rows)
+                    for column, values in chunk.items()
+                }
+                futures = {
+                    column: executor.submit(encrypt_batch, values)
+                    for column, values in numbers.items()
+                }
+                pending.append((array("Q", row_ids), futures))
+                rows += size
+                # Wait for the oldest chunk before reading more
+                while len(pending) >= 2 * workers:
+                    write(*pending.popleft())
+                if time.perf_counter() - last_report >= report_interval:
+                    last_report = time.perf_counter()
+                    print(
+                        f"{rows} rows read, {ciphertexts / (last_report - start):.0f} "
+                        "ciphertexts/s"
+                    )
+            while pending:
+                write(*pending.popleft())
+        finally:
+            for _, futures in pending:
+                for future in futures.values():
+                    future.cancel()
+    seconds = time.perf_counter() - start
+    return {
+        "rows": rows,
+        "ciphertexts": ciphertexts,
+        "seconds": seconds,
+        "ciphertexts_per_second": ciphertexts / seconds if seconds else None,
+    }
+
+
+def main(args):
+    stats = ingest(
+        args.input,
+        args.store,
+        args.key_file,
+        args.columns,
+        args.id_column,
+        args.chunk_rows,
+        args.workers,
+    )
+    print(
+        f"Encrypted {stats['ciphertexts']} values of {stats['rows']} rows into "
+        f"{args.store} in {stats['seconds']:.1f} s, "
+        f"{stats['ciphertexts_per_second']:.0f} ciphertexts/s"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", help="CSV file with a header row or .npy file")
+    parser.add_argument("store", help="Ciphertext store directory to append to")
+    parser.add_argument(
+        "--columns",
+        nargs="+",
+        required=True,
+        help="Columns to encrypt, field names or indices for .npy files",
+    )
+    parser.add_argument(
+        "--id_column",
+        default=None,
+        help="Column of row IDs, rows are numbered on from the store otherwise",
+    )
+    parser.add_argument(
+        "--key_file",
+        default=os.path.join("HE_data", PUBLIC_KEY_FILE),
+        help="Key file with the params and public key",
+    )
+    parser.add_argument(
+        "--chunk_rows", type=int, default=1000, help="Rows encrypted per task"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Worker processes, defaults to the CPU count",
+    )
+
+    args = parser.parse_args()
+    main(args)
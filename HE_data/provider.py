@@ -0,0 +1,194 @@
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import os
+import re
+import threading
+import time
+import zlib
+
+from bfv.int_encoder import IntegerEncoder
+from util.ciphertext import Ciphertext
+
+from HE_data.HE_data import (
+    get_zero_pool,
+    load_ciphertext,
+    open_key_file,
+    serialize_ciphertext,
+)
+
+# Ciphertext files in a cache directory, named like the files HE_data.py writes
+CIPHERTEXT_FILE_REGEX = r"([0-9]+)\.txt"
+
+
+class CiphertextProvider:
+    """
+    Encrypts integers the first time they are requested instead of
+    pre-encrypting every number, so start-up cost scales with the numbers used.
+
+    Serialized ciphertexts are kept in a bounded cache in memory and in a cache
+    directory per public key, which later runs with the same keys reuse. Both
+    caches evict the least recently used numbers once they hold max_entries.
+    Prefetching encrypts numbers in a background thread, for example while the
+    LLM is answering, so they are ready when a tool asks for them.
+    """
+
+    def __init__(self, key_file: str, cache_dir: str, max_entries: int = 1024):
+        """
+        Args:
+            key_file (str): Key file with the params and public key
+            cache_dir (str): Directory the per-key cache directories are created in
+            max_entries (int): Most ciphertexts kept in memory and on disk
+        """
+        if max_entries < 1:
+            raise ValueError(f"max_entries must be positive, got {max_entries}")
+        keys = open_key_file(key_file)
+        self.params = keys.params
+        self.encoder = IntegerEncoder(self.params, 10)
+        self.encryptor = get_zero_pool(self.params, keys.public_key, keys.ntt_context)
+        # Ciphertexts of other keys must not be reused
+        fingerprint = f"{zlib.crc32(keys.read_section('public_key').encode()):08x}"
+        self.directory = os.path.join(cache_dir, fingerprint)
+        os.makedirs(self.directory, exist_ok=True)
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        # Number to serialization, least recently used first
+        self.memory = OrderedDict()
+        # Number to last use of its file, only scanned once
+        self.disk = {}
+        for entry in os.scandir(self.directory):
+            match = re.fullmatch(CIPHERTEXT_FILE_REGEX, entry.name)
+            if match:
+                self.disk[int(match[1])] = entry.stat().st_mtime_ns
+        # Numbers being encrypted in the background
+        self.pending = {}
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        # Where requested ciphertexts came from
+        self.stats = {"memory": 0, "disk": 0, "encrypted": 0}
+
+    def _path(self, value: int) -> str:
+        return os.path.join(self.directory, f"{value}.txt")
+
+    def _check(self, value: int):
+        if not 0 <= value < self.params.plain_modulus:
+            raise ValueError(
+                f"{value} is outside the plaintext range 0 to {self.params.plain_modulus - 1}"
+            )
+
+    def _store(self, value: int, serialization: str):
+        """Adds a ciphertext to both caches and evicts the least recently used."""
+        with self.lock:
+            self.memory[value] = serialization
+            self.memory.move_to_end(value)
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+        if value not in self.disk:
+            with open(self._path(value), "w") as f:
+                f.write(serialization)
+        with self.lock:
+            self.disk[value] = os.stat(self._path(value)).st_mtime_ns
+            while len(self.disk) > self.max_entries:
+                oldest = min(self.disk, key=self.disk.get)
+                del self.disk[oldest]
+                try:
+                    os.remove(self._path(oldest))
+                except FileNotFoundError:
+                    pass
+
+    def _encrypt(self, value: int) -> str:
+        serialization = serialize_ciphertext(
+            self.encryptor.encrypt(self.encoder.encode(value))
+        )
+        self._store(value, serialization)
+        return serialization
+
+    def serialize(self, value: int) -> str:
+        """
+        Returns the serialized ciphertext of a number, encrypting it if no cache
+        has it yet.
+
+            Args:
+                value (int): Number between 0 and plain_modulus - 1
+
+            Returns:
+                (str): Serialized ciphertext, as written by serialize_ciphertext
+        """
+        self._check(value)
+        with self.lock:
+            if value in self.memory:
+                self.memory.move_to_end(value)
+                if value in self.disk:
+                    # Keeps the file from being evicted while it is in use
+                    self.disk[value] = time.time_ns()
+                self.stats["memory"] += 1
+                return self.memory[value]
+            future = self.pending.get(value)
+        if future is not None:
+            # Wait for the prefetch instead of encrypting the number twice
+            return future.result()
+        if value in self.disk:
+            try:
+                with open(self._path(value), "r") as f:
+                    serialization = f.readline()
+                # Marks the file as recently used
+                os.utime(self._path(value))
+                self._store(value, serialization)
+                self.stats["disk"] += 1
+                return serialization
+            except FileNotFoundError:
+                # Evicted by another provider sharing the directory
+                with self.lock:
+                    self.disk.pop(value, None)
+        self.stats["encrypted"] += 1
+        return self._encrypt(value)
+
+    def get(self, value: int) -> Ciphertext:
+        """Returns the ciphertext of a number, see serialize."""
+        return load_ciphertext(self.serialize(value), params=self.params)
+
+    def __getitem__(self, value: int) -> Ciphertext:
+        return self.get(value)
+
+    def __contains__(self, value: int) -> bool:
+        """Whether a number is cached, so requesting it does not encrypt."""
+        return value in self.memory or value in self.disk
+
+    def prefetch(self, values: list[int]) -> list[Future]:
+        """
+        Starts encrypting uncached numbers in a background thread.
+
+            Args:
+                values (list[int]): Numbers that will likely be requested soon
+
+            Returns:
+                (list[Future]): Pending encryptions, whose results are serializations
+        """
+        futures = []
+        for value in dict.fromkeys(values):
+            self._check(value)
+            with self.lock:
+                if value in self.memory or value in self.disk:
+                    continue
+                if value not in self.pending:
+                    self.pending[value] = self.executor.submit(
+                        self._prefetch_one, value
+                    )
+                futures.append(self.pending[value])
+        return futures
+
+    def _prefetch_one(self, value: int) -> str:
+        try:
+            self.stats["encrypted"] += 1
+            return self._encrypt(value)
+        finally:
+            with self.lock:
+                del self.pending[value]
+
+    def close(self):
+        """Waits for prefetches to finish and stops the background thread."""
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self) -> "CiphertextProvider":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
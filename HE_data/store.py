@@ -0,0 +1,199 @@
+from array import array
+import json
+import os
+import sys
+from typing import Iterator
+import zlib
+
+from bfv.bfv_parameters import BFVParameters
+
+from HE_data.compact import COEFF_TYPECODE, CompactCiphertextArray
+from HE_data.HE_data import KeyFile, load_params, serialize_params
+
+# Metadata of a store: params, public key checksum, columns and next row ID
+METADATA_FILE = "store.json"
+# Row IDs are stored as unsigned 64-bit integers like the coefficients
+ROW_ID_TYPECODE = "Q"
+
+
+def key_fingerprint(key_file: KeyFile) -> str:
+    """Returns the CRC32 of a key file's public key, which names its ciphertexts."""
+    return f"{zlib.crc32(key_file.read_section('public_key').encode()):08x}"
+
+
+def _read_array(path: str, typecode: str, start: int, count: int) -> array:
+    values = array(typecode)
+    with open(path, "rb") as f:
+        f.seek(start * values.itemsize)
+        values.fromfile(f, count)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def _append_array(path: str, values: array):
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    with open(path, "ab") as f:
+        values.tofile(f)
+
+
+class CiphertextStore:
+    """
+    Directory of encrypted columns that can be appended to and read in ranges.
+
+    Every column is two flat files of unsigned 64-bit integers: <column>.ids
+    holds the row IDs and <column>.ciphertexts the ciphertexts, c0 and c1 back
+    to back like CompactCiphertextArray. Records have a fixed size, so any range
+    of rows is read with one seek and no index, and rows written by an
+    interrupted append past the shorter of the two files are ignored.
+    """
+
+    def __init__(self, directory: str, key_file: KeyFile = None):
+        """
+        Opens the store in a directory, creating it if it does not exist yet.
+
+            Args:
+                directory (str): Directory of the store
+                key_file (KeyFile): Keys the ciphertexts are encrypted under,
+                    needed to create a store and checked against an existing one
+        """
+        self.directory = directory
+        metadata_path = os.path.join(directory, METADATA_FILE)
+        if os.path.exists(metadata_path):
+            with open(metadata_path, "r") as f:
+                self.metadata = json.load(f)
+            if (
+                key_file is not None
+                and key_fingerprint(key_file) != self.metadata["fingerprint"]
+            ):
+                raise ValueError(
+                    f"{directory} holds ciphertexts of other keys than {key_file.filename}"
+                )
+        else:
+            if key_file is None:
+                raise ValueError(f"{directory} is not a store, pass keys to create it")
+            os.makedirs(directory, exist_ok=True)
+            self.metadata = {
+                "params": serialize_params(key_file.params),
+                "fingerprint": key_fingerprint(key_file),
+                "columns": [],
+                "next_row_id": 0,
+            }
+            self._save_metadata()
+        self.params: BFVParameters = load_params(self.metadata["params"])
+        if self.params.ciph_modulus > 2**64:
+            raise ValueError("Stores need a ciph_modulus of at most 2^64")
+        self.ring_degree = self.params.poly_degree
+
+    def _save_metadata(self):
+        path = os.path.join(self.directory, METADATA_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.metadata, f, indent=4)
+        os.replace(path + ".tmp", path)
+
+    def _paths(self, column: str) -> tuple[str, str]:
+        if column not in self.metadata["columns"]:
+            raise KeyError(f"{self.directory} has no column {column}")
+        return (
+            os.path.join(self.directory, f"{column}.ids"),
+            os.path.join(self.directory, f"{column}.ciphertexts"),
+        )
+
+    @property
+    def columns(self) -> list[str]:
+        return list(self.metadata["columns"])
+
+    @property
+    def next_row_id(self) -> int:
+        """Row ID after the largest one appended, where new rows start by default."""
+        return self.metadata["next_row_id"]
+
+    def count(self, column: str) -> int:
+        """Returns the number of ciphertexts in a column."""
+        ids_path, ciphertexts_path = self._paths(column)
+        itemsize = array(COEFF_TYPECODE).itemsize
+        return min(
+            os.path.getsize(ids_path) // itemsize,
+            os.path.getsize(ciphertexts_path) // (itemsize * 2 * self.ring_degree),
+        )
+
+    def append(self, column: str, row_ids: array, ciphertexts: CompactCiphertextArray):
+        """
+        Appends ciphertexts and their row IDs to a column, creating the column
+        on first use.
+
+            Args:
+                column (str): Column name
+                row_ids (array): Row ID of every ciphertext
+                ciphertexts (CompactCiphertextArray): Ciphertexts to append
+        """
+        if len(row_ids) != len(ciphertexts):
+            raise ValueError(
+                f"Got {len(row_ids)} row IDs for {len(ciphertexts)} ciphertexts"
+            )
+        if ciphertexts.ring_degree != self.ring_degree:
+            raise ValueError(
+                f"Expected ring degree {self.ring_degree}, got {ciphertexts.ring_degree}"
+            )
+        if os.sep in column or column in ("", ".", ".."):
+            raise ValueError(f"Invalid column name {column!r}")
+        if column not in self.metadata["columns"]:
+            self.metadata["columns"].append(column)
+            self._save_metadata()
+            for path in self._paths(column):
+                open(path, "ab").close()
+        ids_path, ciphertexts_path = self._paths(column)
+        # Drop rows of an interrupted append so both files stay aligned
+        count = self.count(column)
+        itemsize = array(COEFF_TYPECODE).itemsize
+        for path, size in (
+            (ids_path, count * itemsize),
+            (ciphertexts_path, count * itemsize * 2 * self.ring_degree),
+        ):
+            if os.path.getsize(path) != size:
+                os.truncate(path, size)
+        _append_array(ciphertexts_path, ciphertexts.coeffs)
+        _append_array(ids_path, array(ROW_ID_TYPECODE, row_ids))
+        if len(row_ids) and max(row_ids) >= self.metadata["next_row_id"]:
+            self.metadata["next_row_id"] = max(row_ids) + 1
+            self._save_metadata()
+
+    def read(
+        self, column: str, start: int = 0, stop: int = None
+    ) -> tuple[array, CompactCiphertextArray]:
+        """
+        Reads a range of rows of a column.
+
+            Args:
+                column (str): Column name
+                start (int): Index of the first row
+                stop (int): Index after the last row, defaults to the end
+
+            Returns:
+                (tuple[array, CompactCiphertextArray]): Row IDs and ciphertexts
+        """
+        ids_path, ciphertexts_path = self._paths(column)
+        count = self.count(column)
+        stop = count if stop is None else min(stop, count)
+        start = min(start, stop)
+        size = 2 * self.ring_degree
+        row_ids = _read_array(ids_path, ROW_ID_TYPECODE, start, stop - start)
+        coeffs = _read_array(
+            ciphertexts_path, COEFF_TYPECODE, start * size, (stop - start) * size
+        )
+        return row_ids, CompactCiphertextArray(self.ring_degree, coeffs)
+
+    def read_ids(self, column: str) -> array:
+        """Reads the row IDs of a column without its ciphertexts."""
+        ids_path, _ = self._paths(column)
+        return _read_array(ids_path, ROW_ID_TYPECODE, 0, self.count(column))
+
+    def iter_chunks(
+        self, column: str, chunk_rows: int
+    ) -> Iterator[tuple[array, CompactCiphertextArray]]:
+        """Streams a column as chunks of row IDs and ciphertexts, see read."""
+        count = self.count(column)
+        for start in range(0, count, chunk_rows):
+            yield self.read(column, start, start + chunk_rows)
@@ -0,0 +1,336 @@
+import argparse
+import json
+import math
+import random
+import statistics
+import time
+
+from bfv.bfv_key_generator import BFVKeyGenerator
+from bfv.bfv_parameters import BFVParameters
+from bfv.int_encoder import IntegerEncoder
+from util.ntt import NTTContext
+from util.number_theory import is_prime
+
+from HE_data.HE_data import (
+    NTTBFVDecryptor,
+    NTTBFVEncryptor,
+    NTTBFVEvaluator,
+    find_ntt_modulus,
+    find_ntt_root,
+    serialize_ciphertext,
+    validate_preset,
+)
+
+# Polynomial degrees searched by default
+DEGREES = [8, 16, 32, 64]
+# Bit sizes of the ciphertext moduli searched by default
+MODULUS_BITS = list(range(20, 63, 2))
+# Noise budget in bits every checked result must keep, so that operands whose
+# noise is larger than that of the checked ones still decrypt correctly
+MARGIN_BITS = 10
+
+
+def find_plain_modulus(max_value: int) -> int:
+    """Returns the smallest prime congruent to 1 modulo 16 above max_value."""
+    modulus = max_value + 1 + (1 - max_value - 1) % 16
+    while not is_prime(modulus):
+        modulus += 16
+    return modulus
+
+
+class Candidate:
+    """Parameter set with the keys and operators used to check and time it."""
+
+    def __init__(self, preset: dict):
+        self.preset = preset
+        self.params = BFVParameters(
+            poly_degree=preset["degree"],
+            plain_modulus=preset["plain_modulus"],
+            ciph_modulus=preset["ciph_modulus"],
+        )
+        self.ntt_context = NTTContext(
+            self.params.poly_degree,
+            self.params.ciph_modulus,
+            find_ntt_root(self.params),
+        )
+        self.key_generator = BFVKeyGenerator(self.params)
+        self.encoder = IntegerEncoder(self.params, 10)
+        self.encryptor = NTTBFVEncryptor(
+            self.params, self.key_generator.public_key, self.ntt_context
+        )
+        self.decryptor = NTTBFVDecryptor(
+            self.params, self.key_generator.secret_key, self.ntt_context
+        )
+        self.evaluator = NTTBFVEvaluator(self.params, self.ntt_context)
+
+    def encrypt(self, value: int):
+        return self.encryptor.encrypt(self.encoder.encode(value))
+
+    def decrypt(self, ciphertext) -> int:
+        return self.encoder.decode(self.decryptor.decrypt(ciphertext))
+
+    def multiply(self, ciph1, ciph2):
+        return self.evaluator.multiply(ciph1, ciph2, self.key_generator.relin_key)
+
+    def noise_budget(self, ciphertext) -> float:
+        """
+        Returns how many bits the noise of a ciphertext can still grow by before
+        it decrypts incorrectly. Decryption rounds t * (c0 + c1 * s) / q to the
+        nearest integer, so it is correct while every coefficient is less than
+        1/2 away from it.
+        """
+        q = self.params.ciph_modulus
+        t = self.params.plain_modulus
+        phase = ciphertext.c0.add(
+            ciphertext.c1.multiply(
+                self.key_generator.secret_key.s, q, ntt=self.ntt_context
+            ),
+            q,
+        )
+        # Distance of t * coeff / q to the nearest integer, times q
+        noise = max(abs((t * coeff + q // 2) % q - q // 2) for coeff in phase.coeffs)
+        return math.log2(q / (2 * noise)) if noise else math.inf
+
+
+def check_correctness(
+    candidate: Candidate,
+    max_value: int,
+    depth: int,
+    trials: int,
+    margin_bits: float = 0,
+) -> bool:
+    """
+    Checks that sums and products of depth multiplications decrypt correctly,
+    including the largest operands whose results stay within max_value.
+
+        Args:
+            candidate (Candidate): Parameter set to check
+            max_value (int): Largest result that must decrypt correctly
+            depth (int): Multiplications chained on one ciphertext
+            trials (int): Random operands checked besides the largest ones
+            margin_bits (float): Noise budget every result must have left
+
+        Returns:
+            (bool): Whether every result decrypted correctly with the margin
+    """
+    # depth multiplications chain depth + 1 operands
+    max_operand = int(round(max_value ** (1 / (depth + 1))))
+    while max_operand ** (depth + 1) > max_value:
+        max_operand -= 1
+    operand_lists = [[max_operand] * (depth + 1)] + [
+        [random.randint(0, max_operand) for _ in range(depth + 1)]
+        for _ in range(trials)
+    ]
+    for operands in operand_lists:
+        result = candidate.encrypt(operands[0])
+        expected = operands[0]
+        for operand in operands[1:]:
+            result = candidate.multiply(result, candidate.encrypt(operand))
+            expected *= operand
+        if (
+            candidate.decrypt(result) != expected
+            or candidate.noise_budget(result) < margin_bits
+        ):
+            return False
+
+    for _ in range(trials + 1):
+        num1 = random.randint(0, max_value)
+        num2 = random.randint(0, max_value - num1)
+        result = candidate.evaluator.add(
+            candidate.encrypt(num1), candidate.encrypt(num2)
+        )
+        if (
+            candidate.decrypt(result) != num1 + num2
+            or candidate.noise_budget(result) < margin_bits
+        ):
+            return False
+    return True
+
+
+def median_time(operation, repeats: int) -> float:
+    """Returns the median seconds operation takes over repeats calls."""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        operation()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def benchmark(candidate: Candidate, repeats: int) -> dict:
+    """
+    Times the operations of a parameter set and measures its ciphertext size.
+
+        Args:
+            candidate (Candidate): Parameter set to benchmark
+            repeats (int): Runs of each operation, the median is reported
+
+        Returns:
+            (dict): Seconds of keygen, encrypt, add and multiply, and the
+                characters of a serialized ciphertext
+    """
+    ciph1 = candidate.encrypt(1)
+    ciph2 = candidate.encrypt(1)
+    return {
+        "keygen": median_time(lambda: BFVKeyGenerator(candidate.params), repeats),
+        "encrypt": median_time(lambda: candidate.encrypt(1), repeats),
+        "add": median_time(lambda: candidate.evaluator.add(ciph1, ciph2), repeats),
+        "multiply": median_time(lambda: candidate.multiply(ciph1, ciph2), repeats),
+        "size": len(serialize_ciphertext(ciph1)),
+    }
+
+
+def tune(
+    max_value: int,
+    depth: int,
+    degrees: list[int] = DEGREES,
+    modulus_bits: list[int] = MODULUS_BITS,
+    trials: int = 5,
+    repeats: int = 5,
+    margin_bits: float = MARGIN_BITS,
+) -> list[dict]:
+    """
+    Searches NTT-friendly parameter sets for the smallest ciphertext modulus of
+    every degree that computes correctly with margin_bits of noise budget left,
+    and benchmarks it. A larger modulus of the same degree only makes
+    ciphertexts bigger, so it is not tried. Without a margin, the smallest
+    passing modulus sits at the noise limit and fails on unchecked operands.
+
+        Args:
+            max_value (int): Largest result that must decrypt correctly
+            depth (int): Multiplicative depth that must decrypt correctly
+            degrees (list[int]): Polynomial degrees to search, powers of 2
+            modulus_bits (list[int]): Bit sizes of ciphertext moduli to search
+            trials (int): Random operands checked per parameter set
+            repeats (int): Runs of each benchmarked operation
+            margin_bits (float): Noise budget every checked result must keep
+
+        Returns:
+            (list[dict]): Presets that passed, with their benchmark under "metrics"
+    """
+    plain_modulus = find_plain_modulus(max_value)
+    results = []
+    for degree in degrees:
+        for bits in sorted(modulus_bits):
+            preset = {
+                "degree": degree,
+                "plain_modulus": plain_modulus,
+                "ciph_modulus": find_ntt_modulus(degree, 2**bits),
+            }
+            validate_preset(preset)
+            # A modulus not above the plaintext modulus leaves no room for noise
+            if preset["ciph_modulus"] <= plain_modulus:
+                continue
+            candidate = Candidate(preset)
+            if check_correctness(candidate, max_value, depth, trials, margin_bits):
+                results.append({**preset, "metrics": benchmark(candidate, repeats)})
+                break
+    return results
+
+
+def fastest(results: list[dict]) -> dict:
+    """Returns the result with the fastest encrypt and multiply, then the smallest."""
+    return min(
+        results,
+        key=lambda result: (
+            result["metrics"]["encrypt"] + result["metrics"]["multiply"],
+            result["metrics"]["size"],
+        ),
+    )
+
+
+def smallest(results: list[dict]) -> dict:
+    """Returns the result with the smallest ciphertexts, then the fastest."""
+    return min(
+        results,
+        key=lambda result: (
+            result["metrics"]["size"],
+            result["metrics"]["encrypt"] + result["metrics"]["multiply"],
+        ),
+    )
+
+
+def main(args):
+    random.seed(args.seed)
+    results = tune(
+        args.max_value,
+        args.depth,
+        args.degrees,
+        args.modulus_bits,
+        args.trials,
+        args.repeats,
+        args.margin_bits,
+    )
+    if not results:
+        raise SystemExit(
+            f"No parameter set computes depth {args.depth} up to {args.max_value} "
+            f"with {args.margin_bits} bits of noise budget left, try larger "
+            "--degrees or --modulus_bits, or a smaller --margin_bits"
+        )
+    print("degree plain_modulus ciph_modulus keygen encrypt add multiply size")
+    for result in results:
+        metrics = result["metrics"]
+        print(
+            f"{result['degree']} {result['plain_modulus']} {result['ciph_modulus']} "
+            f"{metrics['keygen'] * 1000:.2f}ms {metrics['encrypt'] * 1000:.2f}ms "
+            f"{metrics['add'] * 1000:.2f}ms {metrics['multiply'] * 1000:.2f}ms "
+            f"{metrics['size']}"
+        )
+
+    best = fastest(results) if args.objective == "fast" else smallest(results)
+    with open(args.output, "w") as f:
+        f.write(json.dumps(best, indent=4))
+    print(
+        f"Wrote {args.objective}est preset to {args.output}, "
+        f"use it with python -m HE_data.HE_data --preset_file {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--max_value",
+        type=int,
+        default=1600,
+        help="Largest result that must decrypt correctly",
+    )
+    parser.add_argument(
+        "--depth", type=int, default=1, help="Multiplicative depth to support"
+    )
+    parser.add_argument(
+        "--degrees",
+        nargs="+",
+        type=int,
+        default=DEGREES,
+        help="Polynomial degrees to search",
+    )
+    parser.add_argument(
+        "--modulus_bits",
+        nargs="+",
+        type=int,
+        default=MODULUS_BITS,
+        help="Bit sizes of ciphertext moduli to search",
+    )
+    parser.add_argument(
+        "--trials", type=int, default=5, help="Random operands checked per set"
+    )
+    parser.add_argument(
+        "--repeats", type=int, default=5, help="Runs of each benchmarked operation"
+    )
+    parser.add_argument(
+        "--margin_bits",
+        type=float,
+        default=MARGIN_BITS,
+        help="Noise budget in bits every checked result must keep",
+    )
+    parser.add_argument(
+        "--objective",
+        choices=["fast", "small"],
+        default="fast",
+        help="Whether to emit the fastest or the smallest passing preset",
+    )
+    parser.add_argument("--seed", type=int, default=9172)
+    parser.add_argument("--output", default="preset.json", help="Preset file to write")
+
+    args = parser.parse_args()
+    main(args)
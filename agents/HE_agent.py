@@ -1,127 +1,185 @@
 import argparse
-from langchain.agents import AgentExecutor
-from langchain.agents.format_scratchpad.openai_tools import (
-    format_to_openai_tool_messages,
-)
-from langchain.agents.output_parsers.openai_tools import OpenAIToolsAgentOutputParser
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.runnables.base import Runnable
-from langchain_core.tools import StructuredTool
-from langchain_openai import ChatOpenAI
-from langchain.pydantic_v1 import BaseModel, Field
-import os
+import asyncio
+from concurrent.futures import Executor
+from functools import cache, partial
 import re
+from typing import TYPE_CHECKING, Callable, Optional
+
+from agents.HE_tools import (
+    add_encrypted_numbers,
+    aggregate_encrypted_column,
+    add_plain,
+    create_tool_pool,
+    evaluate_encrypted_expression,
+    initialize_ciphertexts,
+    multiply_encrypted_numbers,
+    multiply_plain,
+    post_process,
+)
+from profiling import add_profile_arguments, run_profiled
+from HE_data.HE_data import PUBLIC_KEY_FILE
+from HE_data.provider import CiphertextProvider
 
-from HE_data.HE_data import load_encoder, load_ciphertext, serialize_ciphertext
-from bfv.bfv_evaluator import BFVEvaluator
-from bfv.int_encoder import IntegerEncoder
-from bfv.bfv_decryptor import BFVDecryptor
-from bfv.bfv_encryptor import BFVEncryptor
-from util.ciphertext import Ciphertext
+if TYPE_CHECKING:
+    from langchain_core.runnables.base import Runnable
 
 
-def initialize_ciphertexts(dir: str) -> dict[int, Ciphertext]:
+def run_in_pool(pool: Executor, func: Callable) -> Callable:
     """
-    Load ciphertext files from a directory into a dictionary mapping number
-    to ciphertext object.
+    Wraps a tool function in a coroutine that runs it in a pool. AgentExecutor's
+    async methods gather the tool calls of one step, so independent calls run in
+    parallel and their results are collected in the order they were made.
     """
-    ctxts = {}
-    ciphertext_regex = r"([0-9]+)\.txt"
-    for file in os.listdir(f"./{dir}"):
-        match = re.match(ciphertext_regex, file)
-        if match:
-            ctxts[int(match[1])] = load_ciphertext(filename=f"{dir}/{file}")
-    return ctxts
 
+    async def coroutine(**kwargs) -> str:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(pool, partial(func, **kwargs))
+
+    return coroutine
 
-### Tools ###
-def add_encrypted_numbers(nums: list[str]) -> str:
+
+@cache
+def create_tools(pool: Executor = None) -> list:
     """
-    Adds py_fhe ciphertexts and returns the sum.
+    Creates the langchain tools wrapping the functions in agents.HE_tools.
+    Langchain is only imported here so that the crypto functions load quickly.
 
         Args:
-            nums (list[str]): List of ciphertext serializations to add
+            pool (Executor): Pool, usually from create_tool_pool, that runs tool
+                calls when the agent is run with ainvoke or astream
 
         Returns:
-            (str): Ciphertext serialization of the sum
+            (list[StructuredTool]): add_numbers, multiply_numbers,
+            add_plain_numbers, multiply_plain_numbers, evaluate_expression_tool
+            and aggregate_column
     """
-    params, key_generator = load_encoder("HE_data/HE.txt")
-    encoder = IntegerEncoder(params, 10)
-    encryptor = BFVEncryptor(params, key_generator.public_key)
-    evaluator = BFVEvaluator(params)
-    # For some reason the library doesn't work if I initialize sum to 0
-    if not nums:
-        return serialize_ciphertext(encryptor.encrypt(encoder.encode(0)))
-    sum = load_ciphertext(nums[0])
-    for i in range(1, len(nums)):
-        sum = evaluator.add(sum, load_ciphertext(serialization=nums[i]))
-    return serialize_ciphertext(sum)
-
-
-class AddEncryptedNumbersInput(BaseModel):
-    nums: list[str] = Field(
-        description="List of homomorphically-encrypted ciphertexts to add together."
-    )
-
-
-add_numbers = StructuredTool.from_function(
-    func=add_encrypted_numbers,
-    name="add_encrypted_numbers",
-    description="""
-    Returns a ciphertext representing the sum of the homomorphically-encrypted ciphertexts of the input list.
-    The whole string that is returned is the result, not just part of it.
-    """,
-    args_schema=AddEncryptedNumbersInput,
-)
-
+    from langchain_core.tools import StructuredTool
+    from langchain.pydantic_v1 import BaseModel, Field
 
-def multiply_encrypted_numbers(nums: list[str]) -> str:
-    """
-    Multiplies py_fhe ciphertexts and returns the sum.
+    class AddEncryptedNumbersInput(BaseModel):
+        nums: list[str] = Field(
+            description="List of homomorphically-encrypted ciphertexts to add together."
+        )
 
-        Args:
-            nums (list[str]): List of ciphertext serializations to add
+    add_numbers = StructuredTool.from_function(
+        func=add_encrypted_numbers,
+        coroutine=run_in_pool(pool, add_encrypted_numbers) if pool else None,
+        name="add_encrypted_numbers",
+        description="""
+        Returns a ciphertext representing the sum of the homomorphically-encrypted ciphertexts of the input list.
+        The whole string that is returned is the result, not just part of it.
+        """,
+        args_schema=AddEncryptedNumbersInput,
+    )
 
-        Returns:
-            (str): Ciphertext serialization of the product
-    """
-    params, key_generator = load_encoder("HE_data/HE.txt")
-    encoder = IntegerEncoder(params, 10)
-    encryptor = BFVEncryptor(params, key_generator.public_key)
-    evaluator = BFVEvaluator(params)
-    # For some reason the library doesn't work if I initialize prod to 1
-    if not nums:
-        return serialize_ciphertext(encryptor.encrypt(encoder.encode(1)))
-    prod = load_ciphertext(nums[0])
-    for i in range(1, len(nums)):
-        prod = evaluator.multiply(
-            prod, load_ciphertext(serialization=nums[i]), key_generator.relin_key
+    class MultiplyEncryptedNumbersInput(BaseModel):
+        nums: list[str] = Field(
+            description="List of homomorphically-encrypted ciphertexts to multiply together."
         )
-    return serialize_ciphertext(prod)
 
+    multiply_numbers = StructuredTool.from_function(
+        func=multiply_encrypted_numbers,
+        coroutine=run_in_pool(pool, multiply_encrypted_numbers) if pool else None,
+        name="multiply_encrypted_numbers",
+        description="""
+        Returns the ciphertext representing the product of the homomorphically-encrypted
+        ciphertexts of the input list.
+        The whole string that is returned is the result, not just part of it.
+        """,
+        args_schema=MultiplyEncryptedNumbersInput,
+    )
 
-class MultiplyEncryptedNumbersInput(BaseModel):
-    nums: list[str] = Field(
-        description="List of homomorphically-encrypted ciphertexts to multiply together."
+    class AddPlainInput(BaseModel):
+        num: str = Field(description="Homomorphically-encrypted ciphertext.")
+        plain: int = Field(description="Non-negative plaintext integer to add.")
+
+    add_plain_numbers = StructuredTool.from_function(
+        func=add_plain,
+        coroutine=run_in_pool(pool, add_plain) if pool else None,
+        name="add_plain",
+        description="""
+        Returns a ciphertext representing the sum of a homomorphically-encrypted
+        ciphertext and a plaintext integer that is not in the list of numbers.
+        The whole string that is returned is the result, not just part of it.
+        """,
+        args_schema=AddPlainInput,
     )
 
+    class MultiplyPlainInput(BaseModel):
+        num: str = Field(description="Homomorphically-encrypted ciphertext.")
+        plain: int = Field(description="Non-negative plaintext integer to multiply by.")
+
+    multiply_plain_numbers = StructuredTool.from_function(
+        func=multiply_plain,
+        coroutine=run_in_pool(pool, multiply_plain) if pool else None,
+        name="multiply_plain",
+        description="""
+        Returns a ciphertext representing the product of a homomorphically-encrypted
+        ciphertext and a plaintext integer that is not in the list of numbers.
+        The whole string that is returned is the result, not just part of it.
+        """,
+        args_schema=MultiplyPlainInput,
+    )
 
-multiply_numbers = StructuredTool.from_function(
-    func=multiply_encrypted_numbers,
-    name="multiply_encrypted_numbers",
-    description="""
-    Returns the ciphertext representing the product of the homomorphically-encrypted
-    ciphertexts of the input list.
-    The whole string that is returned is the result, not just part of it.
-    """,
-    args_schema=MultiplyEncryptedNumbersInput,
-)
+    class EvaluateEncryptedExpressionInput(BaseModel):
+        expression: str = Field(description="""
+            Arithmetic expression using +, *, parentheses, operand references x0, x1, ...
+            and non-negative integer constants, for example (x0 + x1) * x2 + 3.
+            """)
+        operands: list[str] = Field(description="""
+            Homomorphically-encrypted ciphertexts used in the expression, x0 refers to
+            the first one. Each ciphertext only needs to be listed once.
+            """)
+
+    evaluate_expression_tool = StructuredTool.from_function(
+        func=evaluate_encrypted_expression,
+        coroutine=run_in_pool(pool, evaluate_encrypted_expression) if pool else None,
+        name="evaluate_encrypted_expression",
+        description="""
+        Returns the ciphertext representing the value of an arithmetic expression over
+        homomorphically-encrypted ciphertexts. Use it to compute calculations with more
+        than one operation in a single call.
+        The whole string that is returned is the result, not just part of it.
+        """,
+        args_schema=EvaluateEncryptedExpressionInput,
+    )
+
+    class AggregateEncryptedColumnInput(BaseModel):
+        column: str = Field(description="Name of the stored column to aggregate.")
+        operation: str = Field(
+            default="sum", description='"sum" or "product" of the column.'
+        )
+        row_ids: Optional[list[int]] = Field(
+            default=None,
+            description="IDs of the rows to aggregate, leave empty for every row.",
+        )
+
+    aggregate_column = StructuredTool.from_function(
+        func=aggregate_encrypted_column,
+        coroutine=run_in_pool(pool, aggregate_encrypted_column) if pool else None,
+        name="aggregate_encrypted_column",
+        description="""
+        Returns the ciphertext representing the sum or product of a whole stored column
+        of homomorphically-encrypted data, or of its rows with the given IDs. Use it
+        when the question names a column instead of listing numbers.
+        The whole string that is returned is the result, not just part of it.
+        """,
+        args_schema=AggregateEncryptedColumnInput,
+    )
 
+    return [
+        add_numbers,
+        multiply_numbers,
+        add_plain_numbers,
+        multiply_plain_numbers,
+        evaluate_expression_tool,
+        aggregate_column,
+    ]
 
-def create_agent(model_name: str = "gpt-3.5-turbo") -> Runnable:
+
+def create_agent(model_name: str = "gpt-3.5-turbo") -> "Runnable":
     """
-    Creates an agent runnable with access to the tools add_numbers and
-    multiply_numbers.
+    Creates an agent runnable with access to the tools from create_tools.
 
         Args:
             model_name (str): OpenAI LLM name for agent reasoning
@@ -129,9 +187,18 @@ def create_agent(model_name: str = "gpt-3.5-turbo") -> Runnable:
         Returns:
             (Runnable): Langchain runnable representing agent
     """
+    from langchain.agents.format_scratchpad.openai_tools import (
+        format_to_openai_tool_messages,
+    )
+    from langchain.agents.output_parsers.openai_tools import (
+        OpenAIToolsAgentOutputParser,
+    )
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+    from langchain_openai import ChatOpenAI
+
     # Need to set OPENAI_API_KEY environment variable: export OPENAI_API_KEY="<key>"
     llm = ChatOpenAI(model=model_name, temperature=0)
-    llm_with_tools = llm.bind_tools([add_numbers, multiply_numbers])
+    llm_with_tools = llm.bind_tools(create_tools())
 
     template_query = """Based on the numbers below, return a response to the user's question without preamble:
     Numbers: {numbers}
@@ -149,6 +216,14 @@ def create_agent(model_name: str = "gpt-3.5-turbo") -> Runnable:
                 will specify the indices of the numbers to use using 0-based indexing.
                 For example, 0 would be the first element of the list and 4 would be
                 the fifth element of the list.
+                Numbers in the question that are not indices are plaintext constants.
+                Use add_plain or multiply_plain for them instead of encrypting them.
+                If the calculation has more than one operation, compute it with a
+                single call to evaluate_encrypted_expression.
+                Sums and products over a stored column, or over its rows with
+                given IDs, are computed by aggregate_encrypted_column.
+                If a tool returns an invalid_ciphertext error, call it again with
+                the ciphertext named in the error copied exactly.
 
                 Format your response as:
                 <calculation result>
@@ -174,50 +249,62 @@ def create_agent(model_name: str = "gpt-3.5-turbo") -> Runnable:
     return agent
 
 
-def post_process(response: str) -> str:
-    """Replaces ciphertext in LLM-generated response with decrypted number."""
-    params, key_generator = load_encoder("HE_data/HE.txt")
-    encoder = IntegerEncoder(params, 10)
-    decryptor = BFVDecryptor(params, key_generator.secret_key)
-    return str(
-        encoder.decode(decryptor.decrypt(load_ciphertext(serialization=response)))
-    )
-
-
 def main(args):
-    # Load ciphertext objects
-    ctxts = initialize_ciphertexts("HE_data")
+    from langchain.agents import AgentExecutor
 
-    user_query = input("What would you like to do today?\n>>> ")
+    if args.numbers is not None:
+        # Only the listed numbers are encrypted, in the background while the user
+        # types the query
+        provider = CiphertextProvider(
+            f"HE_data/{PUBLIC_KEY_FILE}", "HE_data/cache", args.cache_size
+        )
+        provider.prefetch(args.numbers)
+    else:
+        # Load ciphertext objects
+        ctxts = initialize_ciphertexts("HE_data", compact=True)
 
+    user_query = input("What would you like to do today?\n>>> ")
+    if args.numbers is not None:
+        # Repeated numbers stay separate operands, so indices match the list
+        values = list(args.numbers)
+        numbers = [provider.serialize(number) for number in values]
+        provider.close()
+    else:
+        values = list(ctxts.keys())
+        numbers = [x.serialize() for x in ctxts.values()]
+
+    pool = create_tool_pool(args.tool_workers) if args.parallel_tools else None
     agent_executor = AgentExecutor(
         agent=create_agent(args.model),
-        tools=[add_numbers, multiply_numbers],
+        tools=create_tools(pool),
         verbose=True,
     )
-    result = agent_executor.invoke(
-        {
-            "question": user_query,
-            "numbers": [serialize_ciphertext(x) for x in ctxts.values()],
-        }
-    )
+    agent_input = {
+        "question": user_query,
+        "numbers": numbers,
+    }
+    if pool:
+        # Tool calls from the same step run in parallel in the pool
+        with pool:
+            result = asyncio.run(agent_executor.ainvoke(agent_input))
+    else:
+        result = agent_executor.invoke(agent_input)
     print(f"Agent output: " + result["output"])
     print("Postprocessed output: " + post_process(result["output"]))
 
-    keys = list(ctxts.keys())
     indices = [int(x) for x in re.findall(r"\d+", user_query)]
     print("Numbers:", end=" ")
     if "sum" in user_query:
         check = 0
         for idx in indices:
-            print(keys[idx], end=" ")
-            check += keys[idx]
+            print(values[idx], end=" ")
+            check += values[idx]
         print(f"\nSum: {check}")
     if "product" in user_query:
         check = 1
         for idx in indices:
-            print(keys[idx], end=" ")
-            check *= keys[idx]
+            print(values[idx], end=" ")
+            check *= values[idx]
         print(f"\nProduct: {check}")
 
 
@@ -229,6 +316,31 @@ if __name__ == "__main__":
         default="gpt-3.5-turbo",
         help="LLM for agent reasoning",
     )
+    parser.add_argument(
+        "--parallel_tools",
+        action="store_true",
+        help="Run independent tool calls from one step in parallel processes",
+    )
+    parser.add_argument(
+        "--tool_workers",
+        type=int,
+        default=None,
+        help="Number of tool processes, defaults to the CPU count",
+    )
+    parser.add_argument(
+        "--numbers",
+        nargs="+",
+        type=int,
+        default=None,
+        help="Numbers to give the agent, encrypted on demand instead of loaded from HE_data",
+    )
+    parser.add_argument(
+        "--cache_size",
+        type=int,
+        default=1024,
+        help="Most ciphertexts kept in the on-demand cache in HE_data/cache",
+    )
 
+    add_profile_arguments(parser)
     args = parser.parse_args()
-    main(args)
+    run_profiled(main, args)
@@ -0,0 +1,371 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import cache, wraps
+import json
+from multiprocessing import parent_process
+import os
+import re
+from typing import Union
+
+from HE_data.HE_data import (
+    CiphertextFormatError,
+    get_zero_pool,
+    load_ciphertext,
+    open_key_file,
+    serialize_ciphertext,
+    NTTBFVDecryptor,
+    NTTBFVEvaluator,
+    PUBLIC_KEY_FILE,
+    SECRET_KEY_FILE,
+)
+from HE_data.aggregate import (
+    OPERATIONS,
+    ResultOverflowError,
+    SHARD_ROWS,
+    aggregate,
+)
+from HE_data.compact import CompactCiphertext
+from HE_data.expression import evaluate_expression, ExpressionError
+from HE_data.store import CiphertextStore, METADATA_FILE
+from bfv.int_encoder import IntegerEncoder
+from bfv.bfv_parameters import BFVParameters
+from util.ciphertext import Ciphertext
+
+# Ciphertext store written by HE_data/ingest.py, aggregated by aggregate_encrypted_column
+STORE_DIR = "HE_data/store"
+
+
+def initialize_ciphertexts(
+    dir: str, compact: bool = False
+) -> dict[int, Union[Ciphertext, CompactCiphertext]]:
+    """
+    Load ciphertext files from a directory into a dictionary mapping number
+    to ciphertext object. If compact is set, the ciphertexts are loaded as
+    array-backed CompactCiphertexts instead of py-fhe objects, except for those
+    whose coefficients don't fit in 64 bits.
+    """
+    ctxts = {}
+    ciphertext_regex = r"([0-9]+)\.txt"
+    for file in os.listdir(f"./{dir}"):
+        match = re.match(ciphertext_regex, file)
+        if not match:
+            continue
+        if compact:
+            with open(f"{dir}/{file}", "r") as f:
+                serialization = f.readline()
+            try:
+                ctxts[int(match[1])] = CompactCiphertext.from_serialization(
+                    serialization
+                )
+                continue
+            except CiphertextFormatError:
+                # Invalid ciphertexts raise again below
+                pass
+        ctxts[int(match[1])] = load_ciphertext(filename=f"{dir}/{file}")
+    return ctxts
+
+
+def load_tool_keys():
+    """
+    Parses every section of the public key file used by the tools, so that later
+    tool calls in this process reuse the parsed keys until the file is rewritten.
+    """
+    key_file = open_key_file(f"HE_data/{PUBLIC_KEY_FILE}")
+    key_file.params, key_file.public_key, key_file.relin_key, key_file.ntt_context
+
+
+def create_tool_pool(max_workers: int = None) -> ProcessPoolExecutor:
+    """
+    Creates a process pool for running tool calls in parallel. Every worker loads
+    the key context once when it starts and keeps it for all the calls it runs.
+
+        Args:
+            max_workers (int): Number of worker processes, defaults to the CPU count
+
+        Returns:
+            (ProcessPoolExecutor): Pool to pass to agents.HE_agent.create_tools
+    """
+    return ProcessPoolExecutor(max_workers=max_workers, initializer=load_tool_keys)
+
+
+@cache
+def aggregate_pool() -> ProcessPoolExecutor:
+    """Process pool shared by the aggregate_encrypted_column calls of this process."""
+    return ProcessPoolExecutor()
+
+
+class ArgumentError(CiphertextFormatError):
+    """CiphertextFormatError of a named tool argument."""
+
+    def __init__(self, argument: str, error: CiphertextFormatError):
+        super().__init__(f"{argument}: {error}")
+        self.argument = argument
+        self.reason = str(error)
+
+
+def load_argument(
+    serialization: str, argument: str, params: BFVParameters
+) -> Ciphertext:
+    """
+    Loads a ciphertext argument of a tool, naming it in validation errors. The
+    argument must keep its header, so that the agent's copying mistakes are caught.
+    """
+    try:
+        return load_ciphertext(
+            serialization=serialization, params=params, require_header=True
+        )
+    except CiphertextFormatError as e:
+        raise ArgumentError(argument, e)
+
+
+def invalid_plain(plain: int, params: BFVParameters) -> Union[str, None]:
+    """
+    Returns a JSON error if a plaintext integer can't be encoded under params,
+    since negative integers are encoded as 0, or None if it can.
+    """
+    if 0 <= plain < params.plain_modulus:
+        return None
+    return json.dumps(
+        {
+            "error": "invalid_plain",
+            "reason": f"plain must be from 0 to {params.plain_modulus - 1}, got {plain}",
+            "fix": "Call the tool again with a plain in that range",
+        }
+    )
+
+
+def structured_errors(tool):
+    """
+    Makes a tool return its invalid ciphertext argument as a JSON error instead
+    of raising, so the agent can pass the ciphertext again in the same run.
+    """
+
+    @wraps(tool)
+    def wrapper(*args, **kwargs) -> str:
+        try:
+            return tool(*args, **kwargs)
+        except ArgumentError as e:
+            return json.dumps(
+                {
+                    "error": "invalid_ciphertext",
+                    "argument": e.argument,
+                    "reason": e.reason,
+                    "fix": "Call the tool again with the ciphertext copied exactly "
+                    "as given, including its <length>:<checksum>: prefix",
+                }
+            )
+
+    return wrapper
+
+
+### Tools ###
+@structured_errors
+def add_encrypted_numbers(nums: list[str]) -> str:
+    """
+    Adds py_fhe ciphertexts and returns the sum.
+
+        Args:
+            nums (list[str]): List of ciphertext serializations to add
+
+        Returns:
+            (str): Ciphertext serialization of the sum
+    """
+    key_file = open_key_file(f"HE_data/{PUBLIC_KEY_FILE}")
+    params = key_file.params
+    evaluator = NTTBFVEvaluator(params)
+    # For some reason the library doesn't work if I initialize sum to 0
+    if not nums:
+        encoder = IntegerEncoder(params, 10)
+        encryptor = get_zero_pool(params, key_file.public_key, key_file.ntt_context)
+        return serialize_ciphertext(encryptor.encrypt(encoder.encode(0)))
+    sum = load_argument(nums[0], "nums[0]", params)
+    for i in range(1, len(nums)):
+        sum = evaluator.add(sum, load_argument(nums[i], f"nums[{i}]", params))
+    return serialize_ciphertext(sum)
+
+
+@structured_errors
+def multiply_encrypted_numbers(nums: list[str]) -> str:
+    """
+    Multiplies py_fhe ciphertexts and returns the sum.
+
+        Args:
+            nums (list[str]): List of ciphertext serializations to add
+
+        Returns:
+            (str): Ciphertext serialization of the product
+    """
+    key_file = open_key_file(f"HE_data/{PUBLIC_KEY_FILE}")
+    params = key_file.params
+    # For some reason the library doesn't work if I initialize prod to 1
+    if not nums:
+        encoder = IntegerEncoder(params, 10)
+        encryptor = get_zero_pool(params, key_file.public_key, key_file.ntt_context)
+        return serialize_ciphertext(encryptor.encrypt(encoder.encode(1)))
+    evaluator = NTTBFVEvaluator(params, key_file.ntt_context)
+    prod = load_argument(nums[0], "nums[0]", params)
+    for i in range(1, len(nums)):
+        prod = evaluator.multiply(
+            prod, load_argument(nums[i], f"nums[{i}]", params), key_file.relin_key
+        )
+    return serialize_ciphertext(prod)
+
+
+@structured_errors
+def add_plain(num: str, plain: int) -> str:
+    """
+    Adds a plaintext integer to a py_fhe ciphertext without encrypting the integer.
+
+        Args:
+            num (str): Ciphertext serialization
+            plain (int): Plaintext integer to add, below the plaintext modulus
+
+        Returns:
+            (str): Ciphertext serialization of the sum
+    """
+    params = open_key_file(f"HE_data/{PUBLIC_KEY_FILE}").params
+    error = invalid_plain(plain, params)
+    if error:
+        return error
+    encoder = IntegerEncoder(params, 10)
+    evaluator = NTTBFVEvaluator(params)
+    result = evaluator.add_plain(
+        load_argument(num, "num", params), encoder.encode(plain)
+    )
+    return serialize_ciphertext(result)
+
+
+@structured_errors
+def multiply_plain(num: str, plain: int) -> str:
+    """
+    Multiplies a py_fhe ciphertext by a plaintext integer without encrypting the
+    integer or relinearizing.
+
+        Args:
+            num (str): Ciphertext serialization
+            plain (int): Plaintext integer to multiply by, below the plaintext modulus
+
+        Returns:
+            (str): Ciphertext serialization of the product
+    """
+    key_file = open_key_file(f"HE_data/{PUBLIC_KEY_FILE}")
+    error = invalid_plain(plain, key_file.params)
+    if error:
+        return error
+    encoder = IntegerEncoder(key_file.params, 10)
+    evaluator = NTTBFVEvaluator(key_file.params, key_file.ntt_context)
+    result = evaluator.multiply_plain(
+        load_argument(num, "num", key_file.params), encoder.encode(plain)
+    )
+    return serialize_ciphertext(result)
+
+
+@structured_errors
+def evaluate_encrypted_expression(expression: str, operands: list[str]) -> str:
+    """
+    Evaluates an arithmetic expression over py_fhe ciphertexts in a single call.
+
+        Args:
+            expression (str): Expression using +, *, parentheses, operand
+                references x0, x1, ... and non-negative integer constants
+            operands (list[str]): Ciphertext serializations, x<i> refers to operands[i]
+
+        Returns:
+            (str): Ciphertext serialization of the expression's value
+    """
+    key_file = open_key_file(f"HE_data/{PUBLIC_KEY_FILE}")
+    encoder = IntegerEncoder(key_file.params, 10)
+    evaluator = NTTBFVEvaluator(key_file.params, key_file.ntt_context)
+    operands = [
+        load_argument(operand, f"operands[{i}]", key_file.params)
+        for i, operand in enumerate(operands)
+    ]
+    try:
+        result = evaluate_expression(
+            expression, operands, evaluator, key_file.relin_key, encoder
+        )
+    except ExpressionError as e:
+        return json.dumps(
+            {
+                "error": "invalid_expression",
+                "reason": str(e),
+                "fix": "Call the tool again with an expression using only +, *, "
+                "parentheses, non-negative integers and x0, x1, ... for "
+                "operands[0], operands[1], ...",
+            }
+        )
+    return serialize_ciphertext(result)
+
+
+@structured_errors
+def aggregate_encrypted_column(
+    column: str, operation: str = "sum", row_ids: list[int] = None
+) -> str:
+    """
+    Adds or multiplies a whole column of the ciphertext store in HE_data/store,
+    or its rows with given IDs, without the ciphertexts passing through the LLM.
+
+        Args:
+            column (str): Name of the stored column
+            operation (str): "sum" or "product"
+            row_ids (list[int]): Only aggregate the rows with these IDs, or None for all
+
+        Returns:
+            (str): Ciphertext serialization of the result
+    """
+    if not os.path.exists(os.path.join(STORE_DIR, METADATA_FILE)):
+        return json.dumps(
+            {
+                "error": "no_store",
+                "fix": "No column has been ingested, tell the user to ingest one "
+                "with HE_data/ingest.py",
+            }
+        )
+    store = CiphertextStore(STORE_DIR)
+    if column not in store.columns or operation not in OPERATIONS:
+        return json.dumps(
+            {
+                "error": (
+                    "invalid_column" if operation in OPERATIONS else "invalid_operation"
+                ),
+                "columns": store.columns,
+                "operations": list(OPERATIONS),
+                "fix": "Call the tool again with one of the listed columns and operations",
+            }
+        )
+    # Columns of one shard are reduced in this process, and so are all columns in
+    # child processes like the workers of create_tool_pool, rather than nesting pools
+    executor = None
+    if store.count(column) > SHARD_ROWS and parent_process() is None:
+        executor = aggregate_pool()
+    try:
+        result, _ = aggregate(
+            STORE_DIR,
+            column,
+            operation,
+            row_ids,
+            f"HE_data/{PUBLIC_KEY_FILE}",
+            executor=executor,
+        )
+    except ResultOverflowError as e:
+        return json.dumps(
+            {
+                "error": "result_overflow",
+                "reason": str(e),
+                "rows": e.rows,
+                "max_rows": e.max_rows,
+                "fix": f"Call the tool again with at most {e.max_rows} row_ids",
+            }
+        )
+    return serialize_ciphertext(result)
+
+
+def post_process(response: str) -> str:
+    """Replaces ciphertext in LLM-generated response with decrypted number."""
+    key_file = open_key_file(f"HE_data/{SECRET_KEY_FILE}")
+    encoder = IntegerEncoder(key_file.params, 10)
+    decryptor = NTTBFVDecryptor(
+        key_file.params, key_file.secret_key, key_file.ntt_context
+    )
+    return str(
+        encoder.decode(decryptor.decrypt(load_ciphertext(serialization=response)))
+    )
@@ -0,0 +1,208 @@
+from contextlib import contextmanager
+import threading
+import time
+from typing import Any, Callable, Iterator
+import urllib.request
+
+
+class NoBackendAvailableError(Exception):
+    """Raised when every backend of a pool is unhealthy or has already failed."""
+
+
+class Backend:
+    """Model server endpoint with the client used to call it and its load."""
+
+    def __init__(self, url: str, client: Any):
+        self.url = url
+        self.client = client
+        # Requests currently running on the backend
+        self.outstanding = 0
+        # Requests started on the backend, used to break ties between backends
+        self.served = 0
+        self.healthy = True
+        # time.monotonic() of the last failure, None while healthy
+        self.failed_at = None
+
+
+class BackendPool:
+    """
+    Spreads requests over several model servers. Each request goes to the healthy
+    backend with the fewest outstanding requests, a backend never runs more than
+    max_concurrency requests at once, and a request that fails on one backend is
+    retried on the others.
+
+    A failed backend is skipped until retry_interval seconds have passed or a
+    health check finds it responding again.
+    """
+
+    def __init__(
+        self,
+        urls: list[str],
+        create_client: Callable[[str], Any],
+        max_concurrency: int = 1,
+        health_path: str = "/api/tags",
+        health_timeout: float = 2,
+        retry_interval: float = 30,
+        health_check_interval: float = None,
+    ):
+        """
+        Creates a client for every endpoint and checks their health.
+
+            Args:
+                urls (list[str]): Base URLs of the model servers
+                create_client (Callable[[str], Any]): Creates the client for a URL
+                max_concurrency (int): Most requests one backend runs at once
+                health_path (str): Path answered with status 200 by healthy servers
+                health_timeout (float): Seconds to wait for a health check
+                retry_interval (float): Seconds a failed backend is skipped for
+                health_check_interval (float): Seconds between health checks in a
+                    background thread, None to only check on creation
+        """
+        if not urls:
+            raise ValueError("BackendPool needs at least one URL")
+        if max_concurrency < 1:
+            raise ValueError(f"max_concurrency must be positive, got {max_concurrency}")
+        self.backends = [Backend(url.rstrip("/"), create_client(url)) for url in urls]
+        self.max_concurrency = max_concurrency
+        self.health_path = health_path
+        self.health_timeout = health_timeout
+        self.retry_interval = retry_interval
+        self.condition = threading.Condition()
+        self.check_health()
+        if health_check_interval is not None:
+            threading.Thread(
+                target=self._check_health_forever,
+                args=(health_check_interval,),
+                daemon=True,
+            ).start()
+
+    def check_health(self):
+        """Marks every backend healthy or failed depending on its health endpoint."""
+        for backend in self.backends:
+            try:
+                with urllib.request.urlopen(
+                    backend.url + self.health_path, timeout=self.health_timeout
+                ) as response:
+                    healthy = response.status == 200
+            except OSError:
+                healthy = False
+            if healthy:
+                self._mark_healthy(backend)
+            else:
+                self._mark_failed(backend)
+
+    def _check_health_forever(self, interval: float):
+        while True:
+            time.sleep(interval)
+            self.check_health()
+
+    def _mark_healthy(self, backend: Backend):
+        with self.condition:
+            backend.healthy = True
+            backend.failed_at = None
+            # Requests may be waiting for a backend to come back
+            self.condition.notify_all()
+
+    def _mark_failed(self, backend: Backend):
+        with self.condition:
+            backend.healthy = False
+            backend.failed_at = time.monotonic()
+
+    def _available(self, backend: Backend) -> bool:
+        """Whether a backend may be tried, failed backends are retried eventually."""
+        return (
+            backend.healthy
+            or time.monotonic() - backend.failed_at >= self.retry_interval
+        )
+
+    @contextmanager
+    def acquire(self, exclude: set = frozenset()) -> Iterator[Backend]:
+        """
+        Reserves the available backend with the fewest outstanding requests,
+        waiting while every available backend is at max_concurrency.
+
+            Args:
+                exclude (set[str]): URLs of backends not to use
+
+            Yields:
+                (Backend): Reserved backend, released when the context exits
+        """
+        with self.condition:
+            while True:
+                candidates = [
+                    backend
+                    for backend in self.backends
+                    if backend.url not in exclude and self._available(backend)
+                ]
+                if not candidates:
+                    raise NoBackendAvailableError(
+                        "No healthy backend left out of "
+                        + ", ".join(backend.url for backend in self.backends)
+                    )
+                backend = min(
+                    candidates,
+                    key=lambda backend: (backend.outstanding, backend.served),
+                )
+                if backend.outstanding < self.max_concurrency:
+                    break
+                self.condition.wait()
+            backend.outstanding += 1
+            backend.served += 1
+        try:
+            yield backend
+        finally:
+            with self.condition:
+                backend.outstanding -= 1
+                self.condition.notify()
+
+    def run(self, request: Callable[[Any], Any]) -> Any:
+        """
+        Runs a request on the least loaded backend, failing over to the others.
+
+            Args:
+                request (Callable[[Any], Any]): Called with a backend's client
+
+            Returns:
+                (Any): Result of the first request that succeeds
+        """
+        tried = set()
+        while True:
+            with self.acquire(tried) as backend:
+                try:
+                    result = request(backend.client)
+                except Exception:
+                    self._mark_failed(backend)
+                    tried.add(backend.url)
+                    if len(tried) == len(self.backends):
+                        raise
+                    continue
+            self._mark_healthy(backend)
+            return result
+
+    def stream(self, request: Callable[[Any], Iterator]) -> Iterator:
+        """
+        Streams a request from the least loaded backend. The request fails over to
+        the other backends as long as nothing has been yielded yet.
+
+            Args:
+                request (Callable[[Any], Iterator]): Called with a backend's client
+
+            Yields:
+                (Any): Chunks of the first request that starts successfully
+        """
+        tried = set()
+        while True:
+            with self.acquire(tried) as backend:
+                started = False
+                try:
+                    for chunk in request(backend.client):
+                        started = True
+                        yield chunk
+                except Exception:
+                    self._mark_failed(backend)
+                    tried.add(backend.url)
+                    if started or len(tried) == len(self.backends):
+                        raise
+                    continue
+            self._mark_healthy(backend)
+            return
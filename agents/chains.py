@@ -1,13 +1,79 @@
+from collections import Counter
+from functools import cache
+import math
+import re
+import time
+from typing import Any, Iterator, NamedTuple, Optional
+
+from agents.backend_pool import BackendPool
 from langchain_community.llms import Ollama
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import RunnablePassthrough
 from langchain_core.runnables.base import Runnable
 
 
-def create_tool_selection_chain() -> Runnable:
+class PooledOllama(LLM):
+    """Ollama LLM whose calls are spread over the servers of a BackendPool."""
+
+    pool: Any
+
+    @property
+    def _llm_type(self) -> str:
+        return "pooled-ollama"
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        return self.pool.run(lambda llm: llm.invoke(prompt, stop=stop, **kwargs))
+
+    def _stream(
+        self,
+        prompt: str,
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[GenerationChunk]:
+        for text in self.pool.stream(
+            lambda llm: llm.stream(prompt, stop=stop, **kwargs)
+        ):
+            if run_manager:
+                run_manager.on_llm_new_token(text)
+            yield GenerationChunk(text=text)
+
+
+def create_llm(base_urls: list[str] = None, max_concurrency: int = 1) -> LLM:
+    """
+    Returns the llama2 LLM used by the chains.
+
+        Args:
+            base_urls (list[str]): Ollama servers to spread requests over, the
+                default local server if None
+            max_concurrency (int): Most requests one server runs at once
+
+        Returns:
+            (LLM): Ollama LLM, pooled if base_urls is given
+    """
+    if not base_urls:
+        return Ollama(model="llama2", temperature=0)
+    pool = BackendPool(
+        base_urls,
+        lambda url: Ollama(model="llama2", temperature=0, base_url=url),
+        max_concurrency,
+    )
+    return PooledOllama(pool=pool)
+
+
+def create_tool_selection_chain(llm: LLM = None) -> Runnable:
     """Returns a chain for selecting a tool to fulfill the user's request."""
-    llm = Ollama(model="llama2", temperature=0)
+    llm = llm or create_llm()
     query_template = """
     You are a lab assistant that returns made-up numbers to lab workers.
     In this step, you decide what tool to use that can fulfill the user's request.
@@ -25,12 +91,12 @@ def create_tool_selection_chain() -> Runnable:
     return chain
 
 
-def create_request_handling_chain() -> Runnable:
+def create_request_handling_chain(llm: LLM = None) -> Runnable:
     """
     Returns a chain for generating a response to the user's request using the
     return value of the tool selected in the tool selection step.
     """
-    llm = Ollama(model="llama2", temperature=0)
+    llm = llm or create_llm()
     query_template = """
     You are a lab assistant that fulfills the user's request.
     Here is some possible relevant information for fulfilling the request:
@@ -52,3 +118,139 @@ def create_request_handling_chain() -> Runnable:
         | StrOutputParser()
     )
     return chain
+
+
+# Example requests for each tool the tool selection chain chooses from
+TOOL_EXAMPLES = {
+    "get_number": [
+        "What is my number?",
+        "What are the first three digits of my number?",
+        "What are the last four digits of my number?",
+        "What are the first 5 characters of my string?",
+        "What are the last 2 characters of my string?",
+        "Give me my number",
+        "Return the middle digits of my number",
+    ],
+    "brew_coffee": [
+        "Brew me a cup of coffee",
+        "Can you make some coffee?",
+        "I would like an espresso",
+        "Start the coffee machine",
+    ],
+    "add_numbers": [
+        "Add 3 and 4",
+        "What is the sum of 12 and 30?",
+        "What is 5 plus 7?",
+        "Add these two numbers together",
+    ],
+}
+
+
+class RoutingDecision(NamedTuple):
+    tool: str
+    # Similarity margin of the router, or None if the LLM picked the tool
+    confidence: float
+    # "router" or "llm"
+    source: str
+    # Seconds spent deciding, including the LLM call on fallback
+    latency: float
+
+
+class ToolRouter:
+    """
+    Picks a tool for a request without calling the LLM by comparing TF-IDF
+    vectors of the request's words with a small index of example requests.
+    """
+
+    def __init__(self, examples: dict = TOOL_EXAMPLES, threshold: float = 0.25):
+        """
+        Builds the vector index of the example requests.
+
+            Args:
+                examples (dict[str, list[str]]): Example requests for each tool
+                threshold (float): Smallest margin between the best and second
+                    best tool's similarity for the router to be confident
+        """
+        self.threshold = threshold
+        documents = [
+            (tool, self.tokenize(example))
+            for tool, tool_examples in examples.items()
+            for example in tool_examples
+        ]
+        document_frequency = Counter(
+            word for _, words in documents for word in set(words)
+        )
+        self.idf = {
+            word: math.log(len(documents) / count) + 1
+            for word, count in document_frequency.items()
+        }
+        self.index = [(tool, self.vectorize(words)) for tool, words in documents]
+
+    @staticmethod
+    def tokenize(text: str) -> list[str]:
+        """Splits text into lowercase words, ignoring numbers and punctuation."""
+        return re.findall(r"[a-z]+", text.lower())
+
+    def vectorize(self, words: list[str]) -> dict[str, float]:
+        """Returns the unit-length TF-IDF vector of words known to the index."""
+        vector = {
+            word: count * self.idf[word]
+            for word, count in Counter(words).items()
+            if word in self.idf
+        }
+        norm = math.sqrt(sum(weight**2 for weight in vector.values()))
+        return {word: weight / norm for word, weight in vector.items()}
+
+    def route(self, query: str) -> tuple[str, float]:
+        """
+        Finds the tool whose closest example is most similar to the query.
+
+            Args:
+                query (str): User request
+
+            Returns:
+                (tuple[str, float]): Best tool and its similarity margin over the
+                second best tool, the tool is None if the margin is below threshold
+        """
+        vector = self.vectorize(self.tokenize(query))
+        scores = {}
+        for tool, example in self.index:
+            similarity = sum(
+                weight * example.get(word, 0) for word, weight in vector.items()
+            )
+            scores[tool] = max(scores.get(tool, 0), similarity)
+        ranked = sorted(scores.values(), reverse=True) + [0]
+        best = max(scores, key=scores.get)
+        margin = ranked[0] - ranked[1]
+        return (best if margin >= self.threshold else None), margin
+
+
+def select_tool(
+    query: str, router: ToolRouter = None, fallback: Runnable = None, llm: LLM = None
+) -> RoutingDecision:
+    """
+    Selects a tool for the request with the router and only falls back to the
+    tool selection chain when the router is not confident.
+
+        Args:
+            query (str): User request
+            router (ToolRouter): Router to try first, defaults to TOOL_EXAMPLES
+            fallback (Runnable): Chain used when the router is not confident,
+                defaults to create_tool_selection_chain(llm)
+            llm (LLM): LLM of the default fallback chain
+
+        Returns:
+            (RoutingDecision): Selected tool, how it was selected and how long it took
+    """
+    start = time.perf_counter()
+    tool, confidence = (router or _default_router()).route(query)
+    if tool is not None:
+        return RoutingDecision(tool, confidence, "router", time.perf_counter() - start)
+    tool = (fallback or create_tool_selection_chain(llm)).invoke({"input": query})
+    return RoutingDecision(tool.strip(), None, "llm", time.perf_counter() - start)
+
+
+@cache
+def _default_router() -> ToolRouter:
+    """Returns a router over TOOL_EXAMPLES, built on first use."""
+    return ToolRouter()
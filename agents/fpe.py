@@ -0,0 +1,228 @@
+import argparse
+import hashlib
+import hmac
+import math
+import random
+import time
+from typing import Iterable, Union
+
+import pyffx
+
+# Feistel rounds of FF1
+ROUNDS = 10
+# Alphabet of the SSN agents
+ALPHABET = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+# Fewest values NIST SP 800-38G allows a domain to have, radix**minlen >= 10**6
+MIN_DOMAIN = 10**6
+
+
+class FF1:
+    """
+    Format-preserving cipher for whole strings over an alphabet. It follows the
+    FF1 construction of NIST SP 800-38G: a 10-round Feistel network over the two
+    halves of the string, read as numbers in base len(alphabet). HMAC-SHA256
+    replaces AES as the round function, so ciphertexts differ from AES-based FF1.
+
+    The keyed HMAC state and the round constants of every string length are
+    computed once per cipher, so encrypt_many pays for them once per batch
+    instead of once per value. Subclasses can swap the round function by
+    overriding _start_prf, _finish_prf and _extend.
+
+    Strings must have at least min_length characters, so that there are at
+    least MIN_DOMAIN of them, since small domains can be recovered by
+    enumerating them.
+    """
+
+    def __init__(self, key: bytes, alphabet: str = ALPHABET, tweak: bytes = b""):
+        """
+        Args:
+            key (bytes): Secret key
+            alphabet (str): Distinct characters of plaintexts and ciphertexts
+            tweak (bytes): Public value that changes the permutation, like a user ID
+        """
+        if len(alphabet) < 2 or len(set(alphabet)) != len(alphabet):
+            raise ValueError("Alphabet needs 2 or more distinct characters")
+        self.alphabet = alphabet
+        self.radix = len(alphabet)
+        self.index = {char: i for i, char in enumerate(alphabet)}
+        self.min_length = 2
+        while self.radix**self.min_length < MIN_DOMAIN:
+            self.min_length += 1
+        self.tweak = tweak
+        self.mac = hmac.new(key, digestmod=hashlib.sha256)
+        # String length to the round constants of that length
+        self.round_constants = {}
+
+    def _constants(self, length: int) -> tuple:
+        """
+        Returns the half lengths u and v, the byte lengths b and d of the round
+        input and output, radix**u, radix**v, and the HMAC state after the
+        rounds' common prefix P || T || 0^pad.
+        """
+        constants = self.round_constants.get(length)
+        if constants is None:
+            if length < self.min_length:
+                raise ValueError(
+                    f"FF1 over {self.radix} characters needs {self.min_length} or "
+                    f"more characters for a domain of at least {MIN_DOMAIN} values, "
+                    f"got {length}"
+                )
+            u = length // 2
+            v = length - u
+            b = math.ceil(math.ceil(v * math.log2(self.radix)) / 8)
+            d = 4 * math.ceil(b / 4) + 4
+            t = len(self.tweak)
+            p = (
+                bytes([1, 2, 1])
+                + self.radix.to_bytes(3, "big")
+                + bytes([ROUNDS, u % 256])
+                + length.to_bytes(4, "big")
+                + t.to_bytes(4, "big")
+            )
+            prefix = self._start_prf(p + self.tweak + bytes((-t - b - 1) % 16))
+            constants = (u, v, b, d, self.radix**u, self.radix**v, prefix)
+            self.round_constants[length] = constants
+        return constants
+
+    def _start_prf(self, data: bytes):
+        """Returns the round function's state after data, shared by all rounds."""
+        state = self.mac.copy()
+        state.update(data)
+        return state
+
+    def _finish_prf(self, state, data: bytes) -> bytes:
+        """Returns the round function of the data following a shared state."""
+        mac = state.copy()
+        mac.update(data)
+        return mac.digest()
+
+    def _extend(self, r: bytes, j: int) -> bytes:
+        """Returns the j-th block extending a round function output r."""
+        extension = self.mac.copy()
+        extension.update(r + j.to_bytes(16, "big"))
+        return extension.digest()
+
+    def _round(self, prefix, i: int, half: int, b: int, d: int) -> int:
+        """Returns the round function of round i applied to one half."""
+        r = self._finish_prf(prefix, bytes([i]) + half.to_bytes(b, "big"))
+        s = r
+        j = 1
+        while len(s) < d:
+            s += self._extend(r, j)
+            j += 1
+        return int.from_bytes(s[:d], "big")
+
+    def _number(self, string: str) -> int:
+        number = 0
+        try:
+            for char in string:
+                number = number * self.radix + self.index[char]
+        except KeyError as e:
+            raise ValueError(f"{e.args[0]!r} is not in the alphabet") from None
+        return number
+
+    def _string(self, number: int, length: int) -> str:
+        chars = []
+        for _ in range(length):
+            number, digit = divmod(number, self.radix)
+            chars.append(self.alphabet[digit])
+        return "".join(reversed(chars))
+
+    def encrypt(self, value: str) -> str:
+        """Encrypts a string of min_length or more alphabet characters."""
+        u, v, b, d, radix_u, radix_v, prefix = self._constants(len(value))
+        a, c = self._number(value[:u]), self._number(value[u:])
+        for i in range(ROUNDS):
+            modulus = radix_u if i % 2 == 0 else radix_v
+            a, c = c, (a + self._round(prefix, i, c, b, d)) % modulus
+        return self._string(a, u) + self._string(c, v)
+
+    def decrypt(self, ciphertext: str) -> str:
+        """Decrypts a string encrypted with encrypt."""
+        u, v, b, d, radix_u, radix_v, prefix = self._constants(len(ciphertext))
+        a, c = self._number(ciphertext[:u]), self._number(ciphertext[u:])
+        for i in reversed(range(ROUNDS)):
+            modulus = radix_u if i % 2 == 0 else radix_v
+            a, c = (c - self._round(prefix, i, a, b, d)) % modulus, a
+        return self._string(a, u) + self._string(c, v)
+
+    def encrypt_many(self, values: Iterable[str]) -> list[str]:
+        """Encrypts many strings, sharing the key and round setup between them."""
+        return [self.encrypt(value) for value in values]
+
+    def decrypt_many(self, ciphertexts: Iterable[str]) -> list[str]:
+        """Decrypts many strings, sharing the key and round setup between them."""
+        return [self.decrypt(ciphertext) for ciphertext in ciphertexts]
+
+
+def create_cipher(
+    secret_key: bytes, alphabet: str = ALPHABET, fpe_mode: str = "char"
+) -> Union[FF1, pyffx.String]:
+    """
+    Creates the cipher SSNAgent uses for a secret key
+
+        Args:
+            secret_key (bytes): Secret key
+            alphabet (str): Characters of plaintexts and ciphertexts
+            fpe_mode (str): "whole" for FF1 over whole values, "char" for pyffx
+                over one character at a time
+
+        Returns:
+            (FF1 | pyffx.String): Cipher with encrypt and decrypt methods
+    """
+    if fpe_mode == "whole":
+        return FF1(secret_key, alphabet)
+    if fpe_mode == "char":
+        return pyffx.String(secret_key, alphabet=alphabet, length=1)
+    raise ValueError(f"Unknown FPE mode {fpe_mode}")
+
+
+def main(args):
+    random.seed(args.seed)
+    key = b"benchmarkkey"
+    values = [
+        "".join(random.choices(args.alphabet, k=args.length))
+        for _ in range(args.num_values)
+    ]
+
+    # Current SSNAgent path, one pyffx encryption per character
+    start = time.perf_counter()
+    encryptor = pyffx.String(key, alphabet=args.alphabet, length=1)
+    per_char = ["".join(encryptor.encrypt(char) for char in value) for value in values]
+    per_char_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    cipher = FF1(key, args.alphabet)
+    ciphertexts = cipher.encrypt_many(values)
+    whole_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    assert cipher.decrypt_many(ciphertexts) == values
+    decrypt_seconds = time.perf_counter() - start
+    assert len(per_char) == len(ciphertexts)
+
+    print(f"{args.num_values} values of {args.length} characters")
+    for name, seconds in [
+        ("pyffx per character encrypt", per_char_seconds),
+        ("FF1 whole value encrypt_many", whole_seconds),
+        ("FF1 whole value decrypt_many", decrypt_seconds),
+    ]:
+        print(
+            f"{name}: {seconds:.3f}s, {args.num_values / seconds:.0f} values/s, "
+            f"{seconds / args.num_values * 1e6:.1f} us/value"
+        )
+    print(f"Speedup of encrypt: {per_char_seconds / whole_seconds:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--num_values", type=int, default=10000, help="Values to encrypt"
+    )
+    parser.add_argument("--length", type=int, default=9, help="Characters per value")
+    parser.add_argument(
+        "--alphabet", default=ALPHABET, help="Characters values are made of"
+    )
+    parser.add_argument("--seed", type=int, default=9172)
+
+    args = parser.parse_args()
+    main(args)
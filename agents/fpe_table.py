@@ -0,0 +1,377 @@
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import csv
+from functools import lru_cache
+import os
+import time
+from typing import Iterator
+
+from agents.fpe import ALPHABET, create_cipher
+
+# Ciphers kept per worker, enough for every tenant but bounded for per-row keys
+MAX_CIPHERS = 4096
+# Settings of the worker processes, set by initialize_worker
+_worker = {}
+
+
+def initialize_worker(
+    secretkeys: list[bytes],
+    fpe_mode: str,
+    decrypt: bool,
+    pass_short: bool = False,
+    alphabet: str = ALPHABET,
+):
+    """Stores the keys and settings every chunk of a worker process uses."""
+    _worker.update(
+        secretkeys=secretkeys,
+        fpe_mode=fpe_mode,
+        decrypt=decrypt,
+        pass_short=pass_short,
+        alphabet=alphabet,
+        alphabet_set=frozenset(alphabet),
+    )
+    get_cipher.cache_clear()
+
+
+@lru_cache(maxsize=MAX_CIPHERS)
+def get_cipher(secret_key: bytes):
+    """
+    Returns the cipher of a key with a dictionary caching the translation of
+    single characters, which is all char mode ever encrypts.
+    """
+    return create_cipher(secret_key, _worker["alphabet"], _worker["fpe_mode"]), {}
+
+
+def transform_value(value: str, secret_key: bytes) -> str:
+    """
+    Encrypts or decrypts the alphabet characters of a value and keeps the others,
+    such as the dashes of an SSN, in place.
+
+        Args:
+            value (str): Table cell
+            secret_key (bytes): Secret key of the row
+
+        Returns:
+            (str): Cell with its alphabet characters encrypted or decrypted, None
+                in whole mode if it has fewer alphabet characters than FF1 accepts
+    """
+    alphabet_set = _worker["alphabet_set"]
+    chars = [char for char in value if char in alphabet_set]
+    if not chars:
+        return value
+    cipher, translations = get_cipher(secret_key)
+    if _worker["fpe_mode"] == "whole":
+        if len(chars) < cipher.min_length:
+            return None
+        run = "".join(chars)
+        transformed = iter(
+            cipher.decrypt(run) if _worker["decrypt"] else cipher.encrypt(run)
+        )
+    else:
+        for char in chars:
+            if char not in translations:
+                translations[char] = (
+                    cipher.decrypt(char) if _worker["decrypt"] else cipher.encrypt(char)
+                )
+        transformed = (translations[char] for char in chars)
+    return "".join(
+        next(transformed) if char in alphabet_set else char for char in value
+    )
+
+
+def transform_chunk(
+    columns: dict[str, list], targets: list[str], key_column: str = None
+) -> tuple[dict[str, list], int]:
+    """
+    Encrypts or decrypts the target columns of a chunk in a worker process.
+    Cells too short for whole mode raise ValueError, so that they are never
+    written out in the clear, unless the worker was initialized with pass_short
+    to pass them through unchanged and count them.
+
+        Args:
+            columns (dict[str, list]): Chunk as column name to cell values
+            targets (list[str]): Names of the columns to transform
+            key_column (str): Column whose values index the row's secret key, like
+                SSNAgent's user IDs, or None to use the first key for every row
+
+        Returns:
+            (tuple[dict[str, list], int]): Chunk with the target columns
+                transformed to strings, and the number of cells passed through
+    """
+    secretkeys = _worker["secretkeys"]
+    rows = len(next(iter(columns.values()), []))
+    if key_column is None:
+        keys = [secretkeys[0]] * rows
+    else:
+        keys = [secretkeys[int(index)] for index in columns[key_column]]
+    result = dict(columns)
+    passed_through = 0
+    for name in targets:
+        cells = []
+        for value, key in zip(columns[name], keys):
+            if value is None:
+                cells.append(None)
+                continue
+            transformed = transform_value(str(value), key)
+            if transformed is None:
+                if not _worker["pass_short"]:
+                    raise ValueError(
+                        f"A cell of column {name} is too short for whole mode, "
+                        "use char mode or pass_short to leave such cells unchanged"
+                    )
+                transformed = str(value)
+                passed_through += 1
+            cells.append(transformed)
+        result[name] = cells
+    return result, passed_through
+
+
+def read_csv_chunks(path: str, chunk_rows: int) -> Iterator[dict[str, list]]:
+    """Streams a CSV file with a header row as chunks of columns."""
+    with open(path, "r", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        rows = []
+        for row in reader:
+            rows.append(row)
+            if len(rows) == chunk_rows:
+                yield dict(zip(header, map(list, zip(*rows))))
+                rows = []
+        if rows:
+            yield dict(zip(header, map(list, zip(*rows))))
+
+
+def read_parquet_chunks(path: str, chunk_rows: int) -> Iterator[dict[str, list]]:
+    """Streams a Parquet file as chunks of columns, needs pyarrow."""
+    import pyarrow.parquet as pq
+
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+        yield batch.to_pydict()
+
+
+class CSVChunkWriter:
+    def __init__(self, path: str):
+        self.file = open(path, "w", newline="")
+        self.writer = csv.writer(self.file)
+        self.header = None
+
+    def write(self, columns: dict[str, list]):
+        if self.header is None:
+            self.header = list(columns)
+            self.writer.writerow(self.header)
+        self.writer.writerows(zip(*(columns[name] for name in self.header)))
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetChunkWriter:
+    def __init__(self, path: str, schema=None):
+        """
+        Args:
+            path (str): Parquet file to write
+            schema (pyarrow.Schema): Schema of the file, taken from the first
+                chunk if None, which is only safe if no column can be all null
+        """
+        self.path = path
+        self.schema = schema
+        self.writer = None
+
+    def write(self, columns: dict[str, list]):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pydict(columns, schema=self.schema)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table.cast(self.writer.schema))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def is_parquet(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in (".parquet", ".pq")
+
+
+def output_schema(input_path: str, targets: list[str]):
+    """
+    Returns the schema of a Parquet source with its target columns as strings,
+    or None for a CSV source, whose cells are all strings.
+    """
+    if not is_parquet(input_path):
+        return None
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pq.ParquetFile(input_path).schema_arrow
+    for name in targets:
+        index = schema.get_field_index(name)
+        if index >= 0:
+            schema = schema.set(index, schema.field(index).with_type(pa.string()))
+    return schema
+
+
+def transform_table(
+    input_path: str,
+    output_path: str,
+    targets: list[str],
+    secretkeys: list[bytes],
+    key_column: str = None,
+    fpe_mode: str = "char",
+    decrypt: bool = False,
+    pass_short: bool = False,
+    chunk_rows: int = 10000,
+    workers: int = None,
+    report_interval: float = 10,
+) -> dict:
+    """
+    Streams a CSV or Parquet table through a process pool that encrypts or
+    decrypts its target columns chunk by chunk, and writes the chunks in order.
+    At most two chunks per worker are in memory at once, whatever the table size.
+
+        Args:
+            input_path (str): CSV or Parquet file to read
+            output_path (str): CSV or Parquet file to write
+            targets (list[str]): Columns to encrypt or decrypt
+            secretkeys (list[bytes]): Secret keys, one per user or tenant
+            key_column (str): Column of the index of each row's key, or None to
+                use the first key for every row
+            fpe_mode (str): "char" or "whole", like SSNAgent's fpe_mode
+            decrypt (bool): Whether to decrypt instead of encrypt
+            pass_short (bool): Whether to leave cells too short for whole mode
+                unchanged instead of raising ValueError
+            chunk_rows (int): Rows per chunk
+            workers (int): Worker processes, defaults to the CPU count
+            report_interval (float): Seconds between progress reports
+
+        Returns:
+            (dict): Rows, chunks, cells passed through, seconds and rows per
+                second of the run
+    """
+    read_chunks = read_parquet_chunks if is_parquet(input_path) else read_csv_chunks
+    writer = (
+        ParquetChunkWriter(output_path, output_schema(input_path, targets))
+        if is_parquet(output_path)
+        else CSVChunkWriter(output_path)
+    )
+    workers = workers or os.cpu_count()
+    required = targets + ([key_column] if key_column else [])
+    start = time.perf_counter()
+    last_report = start
+    rows = 0
+    chunks = 0
+    passed_through = 0
+
+    def write(future):
+        nonlocal rows, chunks, passed_through
+        result, passed = future.result()
+        writer.write(result)
+        rows += len(next(iter(result.values()), []))
+        chunks += 1
+        passed_through += passed
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=initialize_worker,
+        initargs=(secretkeys, fpe_mode, decrypt, pass_short),
+    ) as executor:
+        pending = deque()
+        try:
+            for columns in read_chunks(input_path, chunk_rows):
+                missing = set(required) - set(columns)
+                if missing:
+                    raise ValueError(f"{input_path} has no column {', '.join(missing)}")
+                pending.append(
+                    executor.submit(transform_chunk, columns, targets, key_column)
+                )
+                # Wait for the oldest chunk before reading more
+                while len(pending) >= 2 * workers:
+                    write(pending.popleft())
+                if time.perf_counter() - last_report >= report_interval:
+                    last_report = time.perf_counter()
+                    print(f"{rows} rows, {rows / (last_report - start):.0f} rows/s")
+            while pending:
+                write(pending.popleft())
+        finally:
+            for future in pending:
+                future.cancel()
+            writer.close()
+    seconds = time.perf_counter() - start
+    return {
+        "rows": rows,
+        "chunks": chunks,
+        "passed_through": passed_through,
+        "seconds": seconds,
+        "rows_per_second": rows / seconds if seconds else None,
+    }
+
+
+def main(args):
+    # Expecting one secret key per line, like SSNAgent
+    with open(args.secretkeys_path, "r") as f:
+        secretkeys = [bytes(key.strip(), encoding="utf-8") for key in f.readlines()]
+    stats = transform_table(
+        args.input,
+        args.output,
+        args.columns,
+        secretkeys,
+        args.key_column,
+        args.fpe_mode,
+        args.decrypt,
+        args.pass_short,
+        args.chunk_rows,
+        args.workers,
+    )
+    print(
+        f"{'Decrypted' if args.decrypt else 'Encrypted'} {stats['rows']} rows in "
+        f"{stats['seconds']:.1f} s, {stats['rows_per_second']:.0f} rows/s"
+    )
+    if stats["passed_through"]:
+        print(
+            f"{stats['passed_through']} cells too short for whole mode were "
+            "left unchanged"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", help="CSV or Parquet table to read")
+    parser.add_argument("output", help="CSV or Parquet table to write")
+    parser.add_argument(
+        "--columns", nargs="+", required=True, help="Columns to encrypt"
+    )
+    parser.add_argument(
+        "--secretkeys_path", default="secretkeys.txt", help="Path to secret keys"
+    )
+    parser.add_argument(
+        "--key_column",
+        default=None,
+        help="Column with the index of each row's secret key, for per-user or per-tenant keys",
+    )
+    parser.add_argument(
+        "--fpe_mode",
+        choices=["char", "whole"],
+        default="char",
+        help="Encrypt each character with pyffx or whole values with FF1",
+    )
+    parser.add_argument(
+        "--decrypt", action="store_true", help="Decrypt an encrypted table"
+    )
+    parser.add_argument(
+        "--pass_short",
+        action="store_true",
+        help="Leave cells too short for whole mode unchanged instead of failing",
+    )
+    parser.add_argument("--chunk_rows", type=int, default=10000, help="Rows per chunk")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Worker processes, defaults to the CPU count",
+    )
+
+    args = parser.parse_args()
+    main(args)
@@ -1,18 +1,14 @@
 import argparse
-from langchain.agents import AgentExecutor
-from langchain.agents.format_scratchpad.openai_tools import (
-    format_to_openai_tool_messages,
-)
-from langchain.agents.output_parsers.openai_tools import OpenAIToolsAgentOutputParser
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.runnables.base import Runnable
-from langchain_core.tools import StructuredTool
-from langchain_openai import ChatOpenAI
-from langchain.pydantic_v1 import BaseModel, Field
-import pyffx
+import asyncio
 import sys
+from typing import TYPE_CHECKING, AsyncIterable, AsyncIterator, Iterable
 
-from agents.chains import create_tool_selection_chain, create_request_handling_chain
+from agents.fpe import create_cipher
+from profiling import add_profile_arguments, run_profiled
+
+# Langchain is imported where agents are built so that FPE works without it
+if TYPE_CHECKING:
+    from langchain_core.runnables.base import Runnable
 
 
 # Template class for FPE Agents
@@ -28,7 +24,21 @@ class FormatPreservingAgent:
 
 
 class SSNAgent(FormatPreservingAgent):
-    def __init__(self, secretkeys_path, ssns_path):
+    def __init__(self, secretkeys_path, ssns_path, fpe_mode="char"):
+        """
+        Args:
+            secretkeys_path (str): File with one secret key per line
+            ssns_path (str): File with one SSN per line
+            fpe_mode (str): "char" encrypts each character on its own with pyffx,
+                so the LLM can slice ciphertexts. "whole" encrypts whole values
+                with FF1, which is faster and hides repeated characters, but only
+                whole values can be decrypted.
+        """
+        if fpe_mode not in ("char", "whole"):
+            raise ValueError(f"Unknown FPE mode {fpe_mode}")
+        self.fpe_mode = fpe_mode
+        # Ciphers of each secret key, they keep their setup between values
+        self.ciphers = {}
         # Private data setup
         # Expecting one secret key per line
         self.alphabet = "".join(
@@ -64,7 +74,9 @@ class SSNAgent(FormatPreservingAgent):
             Returns:
                 (str): Encrypted ciphertext of SSN
         """
-        encryptor = pyffx.String(secret_key, alphabet=self.alphabet, length=1)
+        if self.fpe_mode == "whole":
+            return self.cipher(secret_key).encrypt(value)
+        encryptor = self.cipher(secret_key)
         return "".join([encryptor.encrypt(digit) for digit in value])
 
     def decrypt(
@@ -82,9 +94,58 @@ class SSNAgent(FormatPreservingAgent):
             Returns:
                 (str): Original SSN
         """
-        encryptor = pyffx.String(secret_key, alphabet=self.alphabet, length=1)
+        if self.fpe_mode == "whole":
+            return self.cipher(secret_key).decrypt(ciphertext)
+        encryptor = self.cipher(secret_key)
         return "".join([encryptor.decrypt(digit) for digit in ciphertext])
 
+    def cipher(self, secret_key: str):
+        """
+        Returns the cipher of a secret key, created on first use
+
+            Args:
+                secret_key (str): Secret key
+
+            Returns:
+                (FF1 | pyffx.String): FF1 in whole mode, a one character pyffx
+                cipher in char mode
+        """
+        if secret_key not in self.ciphers:
+            self.ciphers[secret_key] = create_cipher(
+                secret_key, self.alphabet, self.fpe_mode
+            )
+        return self.ciphers[secret_key]
+
+    def encrypt_many(self, secret_key: str, values: Iterable[str]) -> list[str]:
+        """
+        Encrypts many values with one secret key, sharing the cipher setup
+
+            Args:
+                secret_key (str): Secret key
+                values (Iterable[str]): Values to encrypt
+
+            Returns:
+                (list[str]): Ciphertexts of the values
+        """
+        if self.fpe_mode == "whole":
+            return self.cipher(secret_key).encrypt_many(values)
+        return [self.encrypt(secret_key, value) for value in values]
+
+    def decrypt_many(self, secret_key: str, ciphertexts: Iterable[str]) -> list[str]:
+        """
+        Decrypts many ciphertexts of one secret key, sharing the cipher setup
+
+            Args:
+                secret_key (str): Secret key
+                ciphertexts (Iterable[str]): Ciphertexts to decrypt
+
+            Returns:
+                (list[str]): Decrypted values
+        """
+        if self.fpe_mode == "whole":
+            return self.cipher(secret_key).decrypt_many(ciphertexts)
+        return [self.decrypt(secret_key, ciphertext) for ciphertext in ciphertexts]
+
     def post_process(self, result: str, user_id: int) -> str:
         """
         Postprocesses output from LLM returned after agent execution by looking for any numbers and decrypting them
@@ -99,15 +160,86 @@ class SSNAgent(FormatPreservingAgent):
         # Decrypt using user's secret key
         return self.decrypt(self.secretkeys[user_id], result)
 
+    async def post_process_stream(
+        self, chunks: AsyncIterable[str], user_id: int
+    ) -> AsyncIterator[str]:
+        """
+        Streaming version of post_process that decrypts LLM output chunks as they
+        arrive, for example from a runnable's astream. In char mode each character
+        is encrypted on its own, so in-alphabet runs are decrypted without waiting
+        for the rest of the run. Characters outside the alphabet, such as spaces or
+        punctuation in a chatty answer, are passed through instead of failing.
+
+            Args:
+                chunks (AsyncIterable[str]): Chunks of output from LLM
+                user_id (int): User ID used to retrieve secret key
+
+            Yields:
+                (str): Chunk with in-alphabet characters decrypted
+        """
+        secret_key = self.secretkeys[user_id]
+        if self.fpe_mode == "whole":
+            async for chunk in self._post_process_stream_whole(chunks, secret_key):
+                yield chunk
+            return
+        encryptor = self.cipher(secret_key)
+        # Decryptions are cached because the same characters repeat across chunks
+        decrypted = {}
+        async for chunk in chunks:
+            for char in chunk:
+                if char in self.alphabet and char not in decrypted:
+                    decrypted[char] = encryptor.decrypt(char)
+            yield "".join(decrypted.get(char, char) for char in chunk)
+
+    async def _post_process_stream_whole(
+        self, chunks: AsyncIterable[str], secret_key: str
+    ) -> AsyncIterator[str]:
+        """
+        post_process_stream of whole mode. A run of in-alphabet characters can
+        only be decrypted once it is complete, so it is held back until a
+        character outside the alphabet or the end of the output. Runs too short
+        to be a ciphertext are passed through.
+        """
+        cipher = self.cipher(secret_key)
+
+        def decrypt_run(run: str) -> str:
+            return cipher.decrypt(run) if len(run) >= cipher.min_length else run
+
+        run = ""
+        async for chunk in chunks:
+            output = []
+            for char in chunk:
+                if char in self.alphabet:
+                    run += char
+                else:
+                    output.append(decrypt_run(run) + char)
+                    run = ""
+            if output:
+                yield "".join(output)
+        if run:
+            yield decrypt_run(run)
+
     def get_number(self, user_id: int) -> str:
         """Gets the encrypted ciphertext of the user's SSN"""
         return self.ciphertexts[user_id]
 
 
 class LlamaSSNAgent(SSNAgent):
-    def __init__(self, secretkeys_path, ssns_path, model_name):
-        super().__init__(secretkeys_path, ssns_path)
+    def __init__(
+        self,
+        secretkeys_path,
+        ssns_path,
+        model_name,
+        ollama_urls=None,
+        max_concurrency=1,
+        fpe_mode="char",
+    ):
+        from agents.chains import create_llm
+
+        super().__init__(secretkeys_path, ssns_path, fpe_mode)
         self.model_name = model_name
+        # Shared by every chain so requests are balanced over the Ollama servers
+        self.llm = create_llm(ollama_urls, max_concurrency)
 
     def run_agent(self, user_query: str, user_id: int) -> str:
         """
@@ -120,27 +252,61 @@ class LlamaSSNAgent(SSNAgent):
             Returns:
                 (str): Response generated by agent
         """
-        # Decide on what tool to use
-        tool_selector_chain = create_tool_selection_chain()
-        tool = tool_selector_chain.invoke({"input": user_query})
-        print("Selected tool: " + tool)
+        from agents.chains import create_request_handling_chain, select_tool
+
+        # Decide on what tool to use, the LLM is only asked if the router is unsure
+        decision = select_tool(user_query, llm=self.llm)
+        tool = decision.tool
+        print(
+            f"Selected tool: {tool} (by {decision.source} in "
+            f"{decision.latency * 1000:.1f} ms)"
+        )
         # Make sure that the correct tool is picked
         if tool != "get_number":
             sys.exit("Wrong tool")
         else:
             ciphertext = self.get_number(user_id)
         # Fulfill user request
-        request_handling_chain = create_request_handling_chain()
+        request_handling_chain = create_request_handling_chain(self.llm)
         result = request_handling_chain.invoke(
             {"input": user_query, "ciphertext": ciphertext}
         )
         print("Initial agent output: " + result)
         return result
 
+    async def astream_agent(self, user_query: str, user_id: int) -> AsyncIterator[str]:
+        """
+        Streaming version of run_agent that yields the response as it is generated
+
+            Args:
+                user_query (str): User input to respond to
+                user_id (int): User ID used to retrieve SSN if agent deems it necessary
+
+            Yields:
+                (str): Chunks of the response generated by agent
+        """
+        from agents.chains import create_request_handling_chain, select_tool
+
+        decision = await asyncio.to_thread(select_tool, user_query, llm=self.llm)
+        print(
+            f"Selected tool: {decision.tool} (by {decision.source} in "
+            f"{decision.latency * 1000:.1f} ms)"
+        )
+        if decision.tool != "get_number":
+            sys.exit("Wrong tool")
+        ciphertext = self.get_number(user_id)
+        async for chunk in create_request_handling_chain(self.llm).astream(
+            {"input": user_query, "ciphertext": ciphertext}
+        ):
+            yield chunk
+
 
 class OpenAISSNAgent(SSNAgent):
-    def __init__(self, secretkeys_path, ssns_path, model_name):
-        super().__init__(secretkeys_path, ssns_path)
+    def __init__(self, secretkeys_path, ssns_path, model_name, fpe_mode="char"):
+        from langchain_core.tools import StructuredTool
+        from langchain.pydantic_v1 import BaseModel, Field
+
+        super().__init__(secretkeys_path, ssns_path, fpe_mode)
         self.model_name = model_name
 
         # Tool creation
@@ -176,7 +342,7 @@ class OpenAISSNAgent(SSNAgent):
             args_schema=AddNumbersInput,
         )
 
-    def create_agent(self, model_name: str = "gpt-3.5-turbo") -> Runnable:
+    def create_agent(self, model_name: str = "gpt-3.5-turbo") -> "Runnable":
         """
         Creates an agent runnable with access to the tools return_number,
         dummy_tool, and add_numbers.
@@ -187,6 +353,15 @@ class OpenAISSNAgent(SSNAgent):
             Returns:
                 (Runnable): Langchain runnable representing agent
         """
+        from langchain.agents.format_scratchpad.openai_tools import (
+            format_to_openai_tool_messages,
+        )
+        from langchain.agents.output_parsers.openai_tools import (
+            OpenAIToolsAgentOutputParser,
+        )
+        from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+        from langchain_openai import ChatOpenAI
+
         # Need to set OPENAI_API_KEY environment variable: export OPENAI_API_KEY="<key>"
         llm = ChatOpenAI(model=model_name, temperature=0)
         llm_with_tools = llm.bind_tools(
@@ -244,6 +419,8 @@ class OpenAISSNAgent(SSNAgent):
             Returns:
                 (str): Response generated by agent
         """
+        from langchain.agents import AgentExecutor
+
         agent_executor = AgentExecutor(
             agent=self.create_agent(),
             tools=[self.return_number, self.dummy_tool, self.add_numbers],
@@ -252,6 +429,43 @@ class OpenAISSNAgent(SSNAgent):
         result = agent_executor.invoke({"question": user_query, "user_id": user_id})
         return result["output"]
 
+    async def astream_agent(self, user_query: str, user_id: int) -> AsyncIterator[str]:
+        """
+        Streaming version of run_agent that yields the final response as the LLM
+        generates it
+
+            Args:
+                user_query (str): User input to respond to
+                user_id (int): User ID used to retrieve SSN if agent deems it necessary
+
+            Yields:
+                (str): Chunks of the response generated by agent
+        """
+        from langchain.agents import AgentExecutor
+
+        agent_executor = AgentExecutor(
+            agent=self.create_agent(),
+            tools=[self.return_number, self.dummy_tool, self.add_numbers],
+        )
+        async for event in agent_executor.astream_events(
+            {"question": user_query, "user_id": user_id}, version="v1"
+        ):
+            # Tool calls stream with empty content, only the answer has text
+            if event["event"] == "on_chat_model_stream":
+                content = event["data"]["chunk"].content
+                if content:
+                    yield content
+
+
+async def stream(agent: SSNAgent, user_query: str, user_id: int):
+    """Prints the postprocessed output of the agent as it is generated"""
+    print("Postprocessed output: ", end="", flush=True)
+    async for chunk in agent.post_process_stream(
+        agent.astream_agent(user_query, user_id), user_id
+    ):
+        print(chunk, end="", flush=True)
+    print()
+
 
 def main(args):
     agents = {
@@ -264,11 +478,27 @@ def main(args):
     user_query = input("What would you like to do today?\n>>> ")
     # Run agent
     # User ID correlates to the index of the secret key in secretkeys, not really a user ID in essence
-    agent = agents[args.model](args.secretkeys_path, args.ssns_path, args.model)
-    result = agent.run_agent(user_query, args.user_id)
-    # Decrypt ciphertext
-    post_processed_result = agent.post_process(result, args.user_id)
-    print("Postprocessed output: " + post_processed_result)
+    if args.model == "llama2":
+        agent = LlamaSSNAgent(
+            args.secretkeys_path,
+            args.ssns_path,
+            args.model,
+            args.ollama_urls,
+            args.max_concurrency,
+            args.fpe_mode,
+        )
+    else:
+        agent = agents[args.model](
+            args.secretkeys_path, args.ssns_path, args.model, args.fpe_mode
+        )
+    if args.stream:
+        # Decrypt ciphertext while the response is generated
+        asyncio.run(stream(agent, user_query, args.user_id))
+    else:
+        result = agent.run_agent(user_query, args.user_id)
+        # Decrypt ciphertext
+        post_processed_result = agent.post_process(result, args.user_id)
+        print("Postprocessed output: " + post_processed_result)
     print(
         "Original SSN for comparison: "
         + agent.secretkey_to_ssn[agent.secretkeys[args.user_id]]
@@ -294,6 +524,30 @@ if __name__ == "__main__":
     parser.add_argument(
         "--secretkeys_path", default="secretkeys.txt", help="Path to secret keys"
     )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Decrypt and print the output while the LLM generates it",
+    )
+    parser.add_argument(
+        "--ollama_urls",
+        nargs="+",
+        default=None,
+        help="Ollama servers to balance llama2 requests over",
+    )
+    parser.add_argument(
+        "--max_concurrency",
+        type=int,
+        default=1,
+        help="Most llama2 requests one Ollama server runs at once",
+    )
+    parser.add_argument(
+        "--fpe_mode",
+        choices=["char", "whole"],
+        default="char",
+        help="Encrypt each character with pyffx or whole SSNs with FF1",
+    )
 
+    add_profile_arguments(parser)
     args = parser.parse_args()
-    main(args)
+    run_profiled(main, args)
@@ -1,10 +1,14 @@
 import argparse
 import datetime
+from itertools import islice
 import json
 from random import randrange, seed
 import time
 
 from agents.ssn_agent import OpenAISSNAgent, SSNAgent
+from profiling import add_profile_arguments, run_profiled
+from demo_evaluation.report import TrialLog
+from encoding_experiment.corpus import iter_trials
 
 
 def generate_random_string():
@@ -20,42 +24,62 @@ def generate_random_string():
     return s
 
 
+def generate_trials(num_trials: int):
+    """Generates trials from the seeded random module, used when there is no corpus."""
+    tested = {""}
+    s = ""
+    for _ in range(num_trials):
+        while s in tested:  # Generate a new random string
+            s = generate_random_string()
+        tested.add(s)
+        # Secret key for the agent's encryptor
+        key = generate_random_string()
+        location = randrange(0, 2)
+        slice_len = randrange(1, len(s))  # Arbitrary slice length
+        yield {"string": s, "key": key, "location": location, "slice_length": slice_len}
+
+
 def main(args):
     seed(args.seed)
-    tested = {""}
     success_cases = {}
     failure_cases = {}
     area = {0: "first", 1: "last"}
     agent: SSNAgent = OpenAISSNAgent("secretkeys.txt", "ssns.txt", args.model)
-    s = ""
-
-    i = 1
-    while i <= args.num_trials:
+    if args.corpus is not None:
+        # Stream pre-generated trials so every model gets identical inputs
+        trials = islice(iter_trials(args.corpus, args.corpus_start), args.num_trials)
+    else:
+        trials = generate_trials(args.num_trials)
+
+    trial_log = TrialLog(
+        args.trial_log, experiment="fpe", model=args.model, seed=args.seed
+    )
+    for i, trial in enumerate(trials, start=1):
         print(f"Trial {i} at time {datetime.datetime.now()}")
-
-        while s in tested:  # Generate a new random string
-            s = generate_random_string()
-        tested.add(s)
+        s = trial["string"]
 
         # Set up agent and encryptor
-        secretkey = bytes(generate_random_string(), encoding="utf-8")
+        secretkey = bytes(trial["key"], encoding="utf-8")
         agent.secretkeys = [secretkey]
         agent.secretkey_to_ssn = {secretkey: s}
         agent.ciphertexts = [agent.encrypt(secretkey, s)]
 
         # User prompt
-        location = randrange(0, 2)
-        slice_len = randrange(1, len(s))  # Arbitrary slice length
+        location = trial["location"]
+        slice_len = trial["slice_length"]
         user_query = (
             f"What are the {area[location]} {slice_len} characters of my string?"
         )
 
         # Code expects LLM to return just the slice we ask it for without preamble.
         # If there is an error with the response format, try the same query again.
+        retries = 0
         while True:
             try:
                 # Run agent
+                start = time.perf_counter()
                 result = agent.run_agent(user_query, 0)
+                latency = time.perf_counter() - start
                 # Decrypt ciphertext
                 post_processed_result = agent.post_process(result, 0)
                 # Compare decrypted result to expected result
@@ -74,15 +98,25 @@ def main(args):
                     success_cases[s] = trial_result
                 else:
                     failure_cases[s] = trial_result
-                i += 1
+                trial_log.write(
+                    id=trial.get("id"),
+                    success=post_processed_result == expected,
+                    slice_length=slice_len,
+                    location=area[location],
+                    latency=latency,
+                    retries=retries,
+                )
                 break
             except Exception as e:
+                retries += 1
                 print(e)
                 time.sleep(5)  # Don't send requests too fast
                 continue
         time.sleep(5)
 
-    print(f"Success rate: {len(success_cases) / args.num_trials * 100}%")
+    trial_log.close()
+    num_trials = len(success_cases) + len(failure_cases)
+    print(f"Success rate: {len(success_cases) / num_trials * 100}%")
 
     # Write logs (question and LLM result)
     if args.success_log is not None:
@@ -111,6 +145,23 @@ if __name__ == "__main__":
         "--failure_log", default=None, help="File to write unsuccessful trials to"
     )
     parser.add_argument("--seed", type=int, default=9172)
+    parser.add_argument(
+        "--trial_log",
+        default=None,
+        help="JSON lines file to append one record per trial to, for demo_evaluation/report.py",
+    )
+    parser.add_argument(
+        "--corpus",
+        default=None,
+        help="Trial corpus from encoding_experiment/corpus.py, trials are generated from the seed if not given",
+    )
+    parser.add_argument(
+        "--corpus_start",
+        type=int,
+        default=0,
+        help="Index of the first corpus trial to run",
+    )
 
+    add_profile_arguments(parser)
     args = parser.parse_args()
-    main(args)
+    run_profiled(main, args)
@@ -1,4 +1,5 @@
 import argparse
+import asyncio
 import datetime
 import json
 from langchain.agents import AgentExecutor
@@ -6,18 +7,24 @@ from math import prod, sqrt
 from random import randrange, seed
 import time
 
-from agents.HE_agent import create_agent, add_numbers, multiply_numbers
-from bfv.bfv_decryptor import BFVDecryptor
-from bfv.bfv_encryptor import BFVEncryptor
+from agents.HE_agent import create_agent, create_tools
+from agents.HE_tools import create_tool_pool
+from profiling import add_profile_arguments, run_profiled
+from demo_evaluation.report import TrialLog
 from bfv.bfv_key_generator import BFVKeyGenerator
 from bfv.bfv_parameters import BFVParameters
 from bfv.int_encoder import IntegerEncoder
 from HE_data.HE_data import (
+    find_ntt_root,
     load_ciphertext,
+    save_key_files,
     serialize_ciphertext,
-    save_encoder,
-    serialize_encoder,
+    NTTBFVDecryptor,
+    NTTBFVEncryptor,
+    SecretKeyBFVEncryptor,
+    PARAMETER_PRESETS,
 )
+from util.ntt import NTTContext
 
 
 def main(args):
@@ -25,29 +32,46 @@ def main(args):
     success_cases = {}
     failure_cases = {}
     operation = {0: "sum", 1: "product"}
+    # Independent tool calls from one step run in parallel in the pool
+    pool = create_tool_pool(args.tool_workers) if args.parallel_tools else None
     agent_executor = AgentExecutor(
         agent=create_agent(args.model),
-        tools=[add_numbers, multiply_numbers],
+        tools=create_tools(pool),
         verbose=True,
     )
 
+    # Encryption setup
+    preset = PARAMETER_PRESETS["evaluation"]
+    max_number = preset["plain_modulus"] - 1  # Support a good amount of numbers
+    params = BFVParameters(
+        poly_degree=preset["degree"],
+        plain_modulus=preset["plain_modulus"],
+        ciph_modulus=preset["ciph_modulus"],
+    )
+    # The NTT context only depends on the parameters, so share it across trials
+    ntt_root = find_ntt_root(params)
+    ntt_context = NTTContext(params.poly_degree, params.ciph_modulus, ntt_root)
+
+    trial_log = TrialLog(
+        args.trial_log, experiment="he", model=args.model, seed=args.seed
+    )
     i = 1
     while i <= args.num_trials:
         print(f"Trial {i} at time {datetime.datetime.now()}")
-        # Encryption setup
-        max_number = 1600  # Support a good amount of numbers
-        params = BFVParameters(
-            poly_degree=8,
-            plain_modulus=max_number + 1,
-            ciph_modulus=8000000000000,
-        )
         key_generator = BFVKeyGenerator(params)
-        # Save params and key_generator to file for tools to access
-        save_encoder("HE_data/HE.txt", serialize_encoder(params, key_generator))
+        # Save params and key_generator to key files for tools to access
+        save_key_files("HE_data", params, key_generator, ntt_root)
 
         encoder = IntegerEncoder(params, 10)
-        encryptor = BFVEncryptor(params, key_generator.public_key)
-        decryptor = BFVDecryptor(params, key_generator.secret_key)
+        # A trial encrypts its few operands right away, so a pool of encryptions
+        # of zero would have nothing to hide the cost behind
+        if args.symmetric:
+            encryptor = SecretKeyBFVEncryptor(
+                params, key_generator.secret_key, ntt_context
+            )
+        else:
+            encryptor = NTTBFVEncryptor(params, key_generator.public_key, ntt_context)
+        decryptor = NTTBFVDecryptor(params, key_generator.secret_key, ntt_context)
 
         while True:
             # Get a dict of random numbers to ciphertexts
@@ -79,14 +103,18 @@ def main(args):
 
         # Code expects LLM to return just the operation result without preamble.
         # If there is an error with the response format, try the same query again.
+        retries = 0
         while True:
             try:
-                result_ciphertext = agent_executor.invoke(
-                    {
-                        "question": question,
-                        "numbers": nums_ciphertexts,
-                    }
-                )["output"]
+                start = time.perf_counter()
+                agent_input = {"question": question, "numbers": nums_ciphertexts}
+                if pool:
+                    result_ciphertext = asyncio.run(
+                        agent_executor.ainvoke(agent_input)
+                    )["output"]
+                else:
+                    result_ciphertext = agent_executor.invoke(agent_input)["output"]
+                latency = time.perf_counter() - start
                 result = load_ciphertext(serialization=result_ciphertext)
                 decoded_result = encoder.decode(decryptor.decrypt(result))
                 # Check result
@@ -103,14 +131,25 @@ def main(args):
                     success_cases[trial_encoding] = trial_result
                 else:  # LLM result is wrong
                     failure_cases[trial_encoding] = trial_result
+                trial_log.write(
+                    success=decoded_result == expected_result,
+                    operation=operation[op_num],
+                    operands=len(nums),
+                    latency=latency,
+                    retries=retries,
+                )
                 i += 1
                 break
             except Exception as e:
+                retries += 1
                 print(e)
                 time.sleep(5)  # Don't send requests too fast
                 continue
         time.sleep(5)  # Don't send requests too fast
 
+    trial_log.close()
+    if pool:
+        pool.shutdown()
     print(f"Success rate: {len(success_cases) / args.num_trials * 100}%")
 
     # Write logs (question and LLM result)
@@ -140,6 +179,28 @@ if __name__ == "__main__":
         "--failure_log", default=None, help="File to write unsuccessful trials to"
     )
     parser.add_argument("--seed", type=int, default=9172)
+    parser.add_argument(
+        "--trial_log",
+        default=None,
+        help="JSON lines file to append one record per trial to, for demo_evaluation/report.py",
+    )
+    parser.add_argument(
+        "--parallel_tools",
+        action="store_true",
+        help="Run independent tool calls from one step in parallel processes",
+    )
+    parser.add_argument(
+        "--tool_workers",
+        type=int,
+        default=None,
+        help="Number of tool processes, defaults to the CPU count",
+    )
+    parser.add_argument(
+        "--symmetric",
+        action="store_true",
+        help="Encrypt with the secret key and send c1 as a seed, shrinking ciphertexts by up to half",
+    )
 
+    add_profile_arguments(parser)
     args = parser.parse_args()
-    main(args)
+    run_profiled(main, args)
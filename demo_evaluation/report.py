@@ -0,0 +1,257 @@
+import argparse
+import json
+import math
+from typing import Iterable, Iterator
+
+# Trial fields that success rates are broken down by
+DIMENSIONS = ["slice_length", "location", "operation", "operands"]
+# Latency histogram buckets grow by this factor, so reported percentiles are
+# at most 10% above the true ones
+BUCKET_GROWTH = 1.1
+# Upper bound of the first latency bucket in seconds
+MIN_LATENCY = 0.001
+# z-score of the confidence intervals
+CONFIDENCE_Z = 1.96
+
+
+class TrialLog:
+    """
+    Appends one JSON line per trial to a file, so reports can stream a log of
+    any size. Writing to None does nothing.
+    """
+
+    def __init__(self, path: str, **fields):
+        """
+        Args:
+            path (str): JSON lines file to append to, or None to not log
+            **fields: Fields added to every record, like experiment, model and seed
+        """
+        self.file = open(path, "a") if path is not None else None
+        self.fields = fields
+
+    def write(self, **record):
+        """Writes a trial with at least success, latency and retries."""
+        if self.file is not None:
+            self.file.write(json.dumps({**self.fields, **record}) + "\n")
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+    def __enter__(self) -> "TrialLog":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def wilson_interval(successes: int, trials: int) -> tuple[float, float]:
+    """Returns the Wilson score confidence interval of a success rate."""
+    if trials == 0:
+        return (0.0, 1.0)
+    rate = successes / trials
+    z2 = CONFIDENCE_Z**2
+    center = (rate + z2 / (2 * trials)) / (1 + z2 / trials)
+    margin = (
+        CONFIDENCE_Z
+        * math.sqrt(rate * (1 - rate) / trials + z2 / (4 * trials**2))
+        / (1 + z2 / trials)
+    )
+    # The interval always contains the rate, rounding could leave it out at 0 or 1
+    return (min(rate, max(0.0, center - margin)), max(rate, min(1.0, center + margin)))
+
+
+def latency_bucket(latency: float) -> int:
+    """Returns the index of the histogram bucket a latency falls into."""
+    if latency <= MIN_LATENCY:
+        return 0
+    return math.ceil(math.log(latency / MIN_LATENCY, BUCKET_GROWTH))
+
+
+class Stats:
+    """
+    Mergeable statistics of a group of trials. Memory only grows with the number
+    of distinct dimension values and latency buckets, not with the number of trials.
+    """
+
+    def __init__(self):
+        self.trials = 0
+        self.successes = 0
+        # Number of trials that needed each number of retries
+        self.retries = {}
+        # Number of latencies in each histogram bucket
+        self.latencies = {}
+        # Dimension to value to [successes, trials]
+        self.breakdowns = {dimension: {} for dimension in DIMENSIONS}
+
+    def add(self, record: dict):
+        """Adds a trial record written by TrialLog."""
+        self.trials += 1
+        self.successes += bool(record["success"])
+        retries = str(record.get("retries", 0))
+        self.retries[retries] = self.retries.get(retries, 0) + 1
+        if record.get("latency") is not None:
+            bucket = str(latency_bucket(record["latency"]))
+            self.latencies[bucket] = self.latencies.get(bucket, 0) + 1
+        for dimension in DIMENSIONS:
+            if record.get(dimension) is not None:
+                tally = self.breakdowns[dimension].setdefault(
+                    str(record[dimension]), [0, 0]
+                )
+                tally[0] += bool(record["success"])
+                tally[1] += 1
+
+    def merge(self, other: "Stats"):
+        """Adds the trials of other to these statistics."""
+        self.trials += other.trials
+        self.successes += other.successes
+        for mine, theirs in [
+            (self.retries, other.retries),
+            (self.latencies, other.latencies),
+        ]:
+            for key, count in theirs.items():
+                mine[key] = mine.get(key, 0) + count
+        for dimension, values in other.breakdowns.items():
+            for value, (successes, trials) in values.items():
+                tally = self.breakdowns[dimension].setdefault(value, [0, 0])
+                tally[0] += successes
+                tally[1] += trials
+
+    def latency_percentile(self, percentile: float) -> float:
+        """Returns the upper bound of the bucket holding a latency percentile."""
+        total = sum(self.latencies.values())
+        if total == 0:
+            return None
+        seen = 0
+        for bucket in sorted(self.latencies, key=int):
+            seen += self.latencies[bucket]
+            if seen >= percentile / 100 * total:
+                return MIN_LATENCY * BUCKET_GROWTH ** int(bucket)
+
+    def to_dict(self) -> dict:
+        """Returns the statistics as JSON-serializable data."""
+        return {
+            "trials": self.trials,
+            "successes": self.successes,
+            "retries": self.retries,
+            "latencies": self.latencies,
+            "breakdowns": self.breakdowns,
+        }
+
+    def merge_dict(self, data: dict):
+        """Adds statistics saved by to_dict."""
+        other = Stats()
+        other.trials = data["trials"]
+        other.successes = data["successes"]
+        other.retries = data["retries"]
+        other.latencies = data["latencies"]
+        other.breakdowns = data["breakdowns"]
+        self.merge(other)
+
+
+def read_records(paths: Iterable[str]) -> Iterator[dict]:
+    """Streams trial records from JSON lines files one line at a time."""
+    for path in paths:
+        with open(path, "r") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def build_report(log_paths: list[str] = [], summary_paths: list[str] = []) -> dict:
+    """
+    Streams trial logs and merges earlier summaries into statistics per
+    experiment and model.
+
+        Args:
+            log_paths (list[str]): JSON lines trial logs written by TrialLog
+            summary_paths (list[str]): Summaries written by write_summary
+
+        Returns:
+            (dict[str, Stats]): Statistics keyed by "<experiment> <model>"
+    """
+    report = {}
+    for record in read_records(log_paths):
+        group = f"{record.get('experiment')} {record.get('model')}"
+        report.setdefault(group, Stats()).add(record)
+    for path in summary_paths:
+        with open(path, "r") as f:
+            for group, data in json.load(f).items():
+                report.setdefault(group, Stats()).merge_dict(data)
+    return report
+
+
+def write_summary(report: dict, path: str):
+    """Writes a compact summary that build_report can merge with other runs."""
+    with open(path, "w") as f:
+        json.dump({group: stats.to_dict() for group, stats in report.items()}, f)
+
+
+def sort_key(value: str) -> tuple:
+    """Sorts numeric values numerically and before other values."""
+    return (0, int(value), "") if value.isdigit() else (1, 0, value)
+
+
+def format_rate(successes: int, trials: int) -> str:
+    low, high = wilson_interval(successes, trials)
+    rate = successes / trials if trials else 0
+    return (
+        f"{rate * 100:.1f}% [{low * 100:.1f}%, {high * 100:.1f}%] "
+        f"({successes}/{trials})"
+    )
+
+
+def format_report(report: dict) -> str:
+    """Formats success rates with 95% confidence intervals, latencies and retries."""
+    lines = []
+    for group, stats in sorted(report.items()):
+        lines.append(f"{group}: {format_rate(stats.successes, stats.trials)}")
+        percentiles = [(p, stats.latency_percentile(p)) for p in (50, 90, 99)]
+        if percentiles[0][1] is not None:
+            lines.append(
+                "  latency "
+                + " ".join(f"p{p}={latency:.2f}s" for p, latency in percentiles)
+            )
+        lines.append(
+            "  retries "
+            + " ".join(
+                f"{retries}:{count}"
+                for retries, count in sorted(
+                    stats.retries.items(), key=lambda item: int(item[0])
+                )
+            )
+        )
+        for dimension, values in stats.breakdowns.items():
+            if not values:
+                continue
+            lines.append(f"  by {dimension}")
+            for value, (successes, trials) in sorted(
+                values.items(), key=lambda item: sort_key(item[0])
+            ):
+                lines.append(f"    {value}: {format_rate(successes, trials)}")
+    return "\n".join(lines)
+
+
+def main(args):
+    report = build_report(args.logs, args.summaries)
+    print(format_report(report))
+    if args.output is not None:
+        write_summary(report, args.output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("logs", nargs="*", help="Trial logs written with --trial_log")
+    parser.add_argument(
+        "--summaries",
+        nargs="+",
+        default=[],
+        help="Summaries from earlier reports to merge in",
+    )
+    parser.add_argument(
+        "--output", default=None, help="File to write the merged summary to"
+    )
+
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,365 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import importlib
+import json
+from multiprocessing import Manager
+import os
+import shutil
+import time
+import traceback
+
+from demo_evaluation.report import build_report, write_summary
+from encoding_experiment.corpus import generate_corpus, save_corpus
+
+# Module whose main runs the trials of each defense
+DEFENSES = {
+    "fpe": "demo_evaluation.evaluate_fpe",
+    "he": "demo_evaluation.evaluate_he",
+    "encoding": "encoding_experiment.experiment",
+}
+# Defenses whose trials come from a shared corpus
+CORPUS_DEFENSES = {"fpe", "encoding"}
+# Files evaluate_fpe.py expects in its working directory
+FPE_FILES = ["secretkeys.txt", "ssns.txt"]
+# Substring of a langchain llm_string identifying each provider
+PROVIDERS = {"openai": "openai", "ollama": "ollama"}
+
+
+class RateBudget:
+    """
+    Spaces out requests to each provider across all the processes of a sweep so
+    that together they stay within a requests per minute budget.
+    """
+
+    def __init__(self, manager: Manager, requests_per_minute: dict[str, float]):
+        """
+        Args:
+            manager (Manager): Manager holding the state shared between processes
+            requests_per_minute (dict[str, float]): Budget of each provider,
+                providers without a budget are not limited
+        """
+        self.requests_per_minute = requests_per_minute
+        self.lock = manager.Lock()
+        self.next_slot = manager.dict(
+            {provider: 0.0 for provider in requests_per_minute}
+        )
+
+    def acquire(self, provider: str):
+        """Blocks until the provider's budget allows another request."""
+        if provider not in self.requests_per_minute:
+            return
+        with self.lock:
+            now = time.time()
+            slot = max(now, self.next_slot[provider])
+            self.next_slot[provider] = slot + 60 / self.requests_per_minute[provider]
+        time.sleep(slot - now)
+
+
+def create_cache(path: str, budget: RateBudget):
+    """
+    Returns an LLM cache stored in a SQLite database shared by every shard. Only
+    cache misses and retries become requests, so they are the calls charged to
+    the budget.
+    """
+    from langchain_community.cache import SQLiteCache
+
+    class RateLimitedCache(SQLiteCache):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            # Hashes of the calls this process already looked up
+            self.looked_up = set()
+
+        def lookup(self, prompt: str, llm_string: str):
+            # The defenses only send a prompt again to retry an answer that
+            # failed checking, so a repeated call skips the cache and its fresh
+            # answer replaces the stored one
+            key = hash((prompt, llm_string))
+            result = None
+            if key not in self.looked_up:
+                self.looked_up.add(key)
+                result = super().lookup(prompt, llm_string)
+            if result is None:
+                for provider, name in PROVIDERS.items():
+                    if name in llm_string:
+                        budget.acquire(provider)
+                        break
+            return result
+
+    return RateLimitedCache(database_path=path)
+
+
+def initialize_worker(cache_path: str, budget: RateBudget):
+    """Installs the shared LLM cache and rate budget in a worker process."""
+    from langchain.globals import set_llm_cache
+
+    set_llm_cache(create_cache(cache_path, budget))
+
+
+def plan_shards(
+    models: list[str],
+    defenses: list[str],
+    seeds: list[int],
+    num_trials: int,
+    shards: int,
+    output_dir: str,
+    symmetric: bool = False,
+) -> list[dict]:
+    """
+    Splits every model x defense x seed run into shards of about equal size.
+    Corpus shards of a seed run consecutive slices of the same corpus. HE shards
+    derive their own seed from the run's seed, because HE trials are generated
+    while they run.
+
+        Args:
+            models (list[str]): LLMs to evaluate
+            defenses (list[str]): Keys of DEFENSES to evaluate
+            seeds (list[int]): Seeds of the runs
+            num_trials (int): Trials per run
+            shards (int): Shards per run
+            output_dir (str): Directory shard directories are created in
+            symmetric (bool): Encrypt HE operands with the secret key
+
+        Returns:
+            (list[dict]): Shards with the arguments of their defense's main
+    """
+    planned = []
+    for model in models:
+        for defense in defenses:
+            # Repeated seeds would run the same trials twice
+            for seed in dict.fromkeys(seeds):
+                start = 0
+                for index in range(shards):
+                    count = num_trials // shards + (index < num_trials % shards)
+                    if count == 0:
+                        continue
+                    name = f"{model}_{defense}_seed{seed}_shard{index}"
+                    directory = os.path.join(output_dir, name)
+                    args = {
+                        "model": model,
+                        "num_trials": count,
+                        "success_log": os.path.join(directory, "success.json"),
+                        "failure_log": os.path.join(directory, "failure.json"),
+                        "trial_log": os.path.join(directory, "trials.jsonl"),
+                        "seed": seed * shards + index,
+                    }
+                    if defense in CORPUS_DEFENSES:
+                        args["seed"] = seed
+                        args["corpus"] = os.path.join(
+                            output_dir, f"corpus_seed{seed}.npy"
+                        )
+                        args["corpus_start"] = start
+                    if defense == "encoding":
+                        args["batch_size"] = 1
+                    if defense == "he":
+                        args["parallel_tools"] = False
+                        args["tool_workers"] = None
+                        args["symmetric"] = symmetric
+                    planned.append(
+                        {
+                            "name": name,
+                            "model": model,
+                            "defense": defense,
+                            "seed": seed,
+                            "directory": directory,
+                            "args": args,
+                        }
+                    )
+                    start += count
+    return planned
+
+
+def run_shard(shard: dict) -> dict:
+    """
+    Runs one shard in its own directory, since the defenses write key files and
+    read data files relative to the working directory.
+
+        Args:
+            shard (dict): Shard from plan_shards
+
+        Returns:
+            (dict): Shard with its run time and error, if any
+    """
+    cwd = os.getcwd()
+    os.makedirs(shard["directory"], exist_ok=True)
+    os.chdir(shard["directory"])
+    if shard["defense"] == "he":
+        os.makedirs("HE_data", exist_ok=True)
+    start = time.perf_counter()
+    try:
+        module = importlib.import_module(DEFENSES[shard["defense"]])
+        module.main(argparse.Namespace(**shard["args"]))
+        error = None
+    except Exception:
+        error = traceback.format_exc()
+    finally:
+        # Workers are reused for other shards
+        os.chdir(cwd)
+    return {**shard, "seconds": time.perf_counter() - start, "error": error}
+
+
+def merge_logs(shards: list[dict], output_dir: str) -> dict:
+    """
+    Merges the success and failure logs of the shards of every model x defense
+    pair and writes them next to a summary of every run.
+
+        Args:
+            shards (list[dict]): Shards returned by run_shard
+            output_dir (str): Directory to write the merged logs to
+
+        Returns:
+            (dict): Summary mapping model/defense to per-seed and total counts
+    """
+    merged = {}
+    summary = {}
+    for shard in shards:
+        cell = f"{shard['model']}_{shard['defense']}"
+        logs = merged.setdefault(cell, {"success": {}, "failure": {}})
+        run = summary.setdefault(cell, {}).setdefault(
+            f"seed{shard['seed']}", {"successes": 0, "trials": 0, "errors": []}
+        )
+        if shard["error"] is not None:
+            run["errors"].append({"shard": shard["name"], "error": shard["error"]})
+        for outcome in ("success", "failure"):
+            path = shard["args"][f"{outcome}_log"]
+            if not os.path.exists(path):
+                continue
+            with open(path, "r") as f:
+                cases = json.load(f)
+            # Prefix keys with the seed so equal questions from different seeds
+            # don't overwrite each other
+            logs[outcome].update(
+                {f"seed{shard['seed']}: {key}": value for key, value in cases.items()}
+            )
+            run["trials"] += len(cases)
+            if outcome == "success":
+                run["successes"] += len(cases)
+
+    for cell, logs in merged.items():
+        for outcome, cases in logs.items():
+            with open(os.path.join(output_dir, f"{cell}_{outcome}.json"), "w") as f:
+                f.write(json.dumps(cases, indent=4))
+        runs = summary[cell]
+        successes = sum(run["successes"] for run in runs.values())
+        trials = sum(run["trials"] for run in runs.values())
+        summary[cell] = {
+            "runs": runs,
+            "successes": successes,
+            "trials": trials,
+            "success_rate": successes / trials if trials else None,
+        }
+    with open(os.path.join(output_dir, "summary.json"), "w") as f:
+        f.write(json.dumps(summary, indent=4))
+    # Statistics of every trial, for demo_evaluation/report.py --summaries
+    report = build_report(
+        [
+            shard["args"]["trial_log"]
+            for shard in shards
+            if os.path.exists(shard["args"]["trial_log"])
+        ]
+    )
+    write_summary(report, os.path.join(output_dir, "report.json"))
+    return summary
+
+
+def main(args):
+    output_dir = os.path.abspath(args.output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    shards = plan_shards(
+        args.models,
+        args.defenses,
+        args.seeds,
+        args.num_trials,
+        args.shards,
+        output_dir,
+        args.symmetric,
+    )
+
+    # Corpora are generated once and shared by every model and shard of a seed
+    if CORPUS_DEFENSES.intersection(args.defenses):
+        for seed in args.seeds:
+            path = os.path.join(output_dir, f"corpus_seed{seed}.npy")
+            if not os.path.exists(path):
+                save_corpus(path, generate_corpus(args.num_trials, seed))
+    for shard in shards:
+        os.makedirs(shard["directory"], exist_ok=True)
+        if shard["defense"] == "fpe":
+            for filename in FPE_FILES:
+                if os.path.exists(filename):
+                    shutil.copy(filename, shard["directory"])
+
+    budgets = {"openai": args.openai_rpm, "ollama": args.ollama_rpm}
+    start = time.perf_counter()
+    with Manager() as manager:
+        budget = RateBudget(
+            manager,
+            {provider: rpm for provider, rpm in budgets.items() if rpm is not None},
+        )
+        cache_path = os.path.join(output_dir, "llm_cache.db")
+        # Create the cache table before workers race to create it
+        create_cache(cache_path, budget)
+        with ProcessPoolExecutor(
+            max_workers=args.workers,
+            initializer=initialize_worker,
+            initargs=(cache_path, budget),
+        ) as executor:
+            results = []
+            for result in executor.map(run_shard, shards):
+                status = "failed" if result["error"] else "done"
+                print(f"{result['name']} {status} in {result['seconds']:.1f} s")
+                results.append(result)
+
+    summary = merge_logs(results, output_dir)
+    print(f"Sweep finished in {time.perf_counter() - start:.1f} s")
+    for cell, result in summary.items():
+        print(f"{cell}: {result['successes']}/{result['trials']} successful")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--models",
+        nargs="+",
+        choices=["gpt-3.5-turbo", "gpt-4-turbo"],
+        default=["gpt-3.5-turbo", "gpt-4-turbo"],
+        help="LLMs to evaluate",
+    )
+    parser.add_argument(
+        "--defenses",
+        nargs="+",
+        choices=list(DEFENSES),
+        default=list(DEFENSES),
+        help="Defenses to evaluate",
+    )
+    parser.add_argument(
+        "--seeds", nargs="+", type=int, default=[9172], help="Seeds of the runs"
+    )
+    parser.add_argument(
+        "--num_trials", type=int, default=1000, help="Number of trials per run"
+    )
+    parser.add_argument("--shards", type=int, default=4, help="Shards per run")
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Shards run at the same time"
+    )
+    parser.add_argument(
+        "--symmetric",
+        action="store_true",
+        help="Encrypt HE operands with the secret key, see evaluate_he.py",
+    )
+    parser.add_argument(
+        "--openai_rpm",
+        type=float,
+        default=None,
+        help="Requests per minute to OpenAI across all shards",
+    )
+    parser.add_argument(
+        "--ollama_rpm",
+        type=float,
+        default=None,
+        help="Requests per minute to Ollama across all shards",
+    )
+    parser.add_argument(
+        "--output_dir", default="sweep", help="Directory for shard and merged logs"
+    )
+
+    args = parser.parse_args()
+    main(args)
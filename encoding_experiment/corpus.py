@@ -0,0 +1,153 @@
+import argparse
+from typing import Iterator
+
+import numpy as np
+
+from encoding_experiment.encoder import Encoder
+
+# Longest string or secret key in a corpus
+MAX_LENGTH = 40
+# One fixed-size record per trial so the corpus can be memory-mapped
+TRIAL_DTYPE = np.dtype(
+    [
+        ("id", "<u4"),
+        ("slice_length", "u1"),
+        # 0 for the first characters of the string, 1 for the last characters
+        ("location", "u1"),
+        # Null-padded, the padding is dropped when the record is read
+        ("string", f"S{MAX_LENGTH}"),
+        # Secret key for format-preserving encryption of the string
+        ("key", f"S{MAX_LENGTH}"),
+    ]
+)
+
+
+def random_strings(
+    rng: np.random.Generator,
+    count: int,
+    min_length: int,
+    max_length: int,
+    alphabet: list[str],
+) -> np.ndarray:
+    """Generates count random strings of random length over alphabet at once."""
+    symbols = np.frombuffer("".join(alphabet).encode(), dtype=np.uint8)
+    lengths = rng.integers(min_length, max_length + 1, count)
+    chars = symbols[rng.integers(0, len(symbols), (count, MAX_LENGTH))]
+    chars[np.arange(MAX_LENGTH) >= lengths[:, None]] = 0
+    return chars.view(f"S{MAX_LENGTH}").ravel()
+
+
+def generate_corpus(
+    num_trials: int,
+    seed: int,
+    min_length: int = 2,
+    max_length: int = MAX_LENGTH,
+    alphabet: list[str] = Encoder().encoding,
+) -> np.ndarray:
+    """
+    Generates slicing trials over unique random strings.
+
+        Args:
+            num_trials (int): Number of trials
+            seed (int): Seed of the random generator
+            min_length (int): Shortest string, at least 2 so it can be sliced
+            max_length (int): Longest string, at most MAX_LENGTH
+            alphabet (list[str]): Characters strings and keys are made of
+
+        Returns:
+            (np.ndarray): Trials as records of TRIAL_DTYPE with ids 0 to num_trials - 1
+    """
+    if not 2 <= min_length <= max_length <= MAX_LENGTH:
+        raise ValueError(
+            f"Need 2 <= min_length <= max_length <= {MAX_LENGTH}, "
+            f"got {min_length} and {max_length}"
+        )
+    capacity = sum(
+        len(alphabet) ** length for length in range(min_length, max_length + 1)
+    )
+    if num_trials > capacity:
+        raise ValueError(
+            f"Only {capacity} unique strings exist, {num_trials} requested"
+        )
+    rng = np.random.default_rng(seed)
+    trials = np.zeros(num_trials, dtype=TRIAL_DTYPE)
+    seen = set()
+    filled = 0
+    while filled < num_trials:
+        candidates = random_strings(
+            rng, num_trials - filled, min_length, max_length, alphabet
+        )
+        # Keep the first occurrence of every string not generated before
+        unique = []
+        for i, string in enumerate(candidates.tolist()):
+            if string not in seen:
+                seen.add(string)
+                unique.append(i)
+        trials["string"][filled : filled + len(unique)] = candidates[unique]
+        filled += len(unique)
+
+    lengths = np.char.str_len(trials["string"])
+    trials["id"] = np.arange(num_trials)
+    trials["slice_length"] = rng.integers(1, lengths)
+    trials["location"] = rng.integers(0, 2, num_trials)
+    trials["key"] = random_strings(rng, num_trials, 2, MAX_LENGTH, alphabet)
+    return trials
+
+
+def save_corpus(path: str, trials: np.ndarray):
+    """Writes trials to a .npy file that load_corpus can memory-map."""
+    np.save(path, trials)
+
+
+def load_corpus(path: str) -> np.ndarray:
+    """Memory-maps a corpus written by save_corpus without reading it."""
+    trials = np.load(path, mmap_mode="r")
+    if trials.dtype != TRIAL_DTYPE:
+        raise ValueError(f"{path} is not a trial corpus")
+    return trials
+
+
+def iter_trials(path: str, start: int = 0) -> Iterator[dict]:
+    """
+    Streams the trials of a corpus file.
+
+        Args:
+            path (str): Corpus written by save_corpus
+            start (int): Index of the first trial to yield
+
+        Yields:
+            (dict): Trial with keys id, string, slice_length, location and key
+    """
+    trials = load_corpus(path)
+    for trial in trials[start:]:
+        yield {
+            "id": int(trial["id"]),
+            "string": trial["string"].decode(),
+            "slice_length": int(trial["slice_length"]),
+            "location": int(trial["location"]),
+            "key": trial["key"].decode(),
+        }
+
+
+def main(args):
+    trials = generate_corpus(
+        args.num_trials, args.seed, args.min_length, args.max_length
+    )
+    save_corpus(args.output, trials)
+    print(f"Wrote {len(trials)} trials to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--num_trials", type=int, default=10000, help="Number of trials in corpus"
+    )
+    parser.add_argument("--seed", type=int, default=9172)
+    parser.add_argument("--min_length", type=int, default=2, help="Shortest string")
+    parser.add_argument(
+        "--max_length", type=int, default=MAX_LENGTH, help="Longest string"
+    )
+    parser.add_argument("--output", default="trials.npy", help="Corpus file to write")
+
+    args = parser.parse_args()
+    main(args)
@@ -1,12 +1,17 @@
 import argparse
+from itertools import islice
 from langchain_openai import ChatOpenAI
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
 from random import randrange, seed
 import json
+import re
 import time
 import datetime
 
+from profiling import add_profile_arguments, run_profiled
+from demo_evaluation.report import TrialLog
+from encoding_experiment.corpus import iter_trials
 from encoding_experiment.encoder import Encoder
 
 
@@ -30,6 +35,59 @@ def create_chain(model: str):
     return {"question": lambda x: x["question"]} | prompt | llm | StrOutputParser()
 
 
+def create_batch_chain(model: str):
+    """Creates chain that asks the LLM several numbered questions in one call."""
+    llm = ChatOpenAI(model=model, temperature=0)
+    query_template = """
+    You are an assistant that responds to user questions. You know that slicing
+    a string involves getting the characters in the specified locations. Here
+    are some examples:
+    First three characters of hello: hel
+    Last three characters of hello: llo
+
+    Answer each of the numbered questions below. Respond with only a JSON list
+    of strings containing the answers in the same order as the questions,
+    for example ["hel", "llo"].
+
+    Questions:
+    {questions}
+
+    Response:
+    """
+    prompt = ChatPromptTemplate.from_template(query_template)
+    return {"questions": lambda x: x["questions"]} | prompt | llm | StrOutputParser()
+
+
+def parse_answers(response: str, count: int) -> list:
+    """
+    Parses the answers to a batch of numbered questions. The response can be a
+    JSON list of answers or one numbered answer per line, like "1. hel".
+
+        Args:
+            response (str): Output of the batch chain
+            count (int): Number of questions in the batch
+
+        Returns:
+            (list[str]): Answer to each question, None where it is missing or malformed
+    """
+    match = re.search(r"\[.*\]", response, re.DOTALL)
+    if match:
+        try:
+            answers = json.loads(match[0])
+        except json.JSONDecodeError:
+            answers = None
+        # A list of the wrong length can't be matched up with the questions
+        if isinstance(answers, list) and len(answers) == count:
+            return [answer if isinstance(answer, str) else None for answer in answers]
+
+    answers = [None] * count
+    for line in response.splitlines():
+        match = re.match(r"\s*([0-9]+)[.):]\s*(.+)", line)
+        if match and 1 <= int(match[1]) <= count:
+            answers[int(match[1]) - 1] = match[2].strip().strip("\"'")
+    return answers
+
+
 def generate_random_string(encoder: Encoder):
     """
     Generates a random string of random size composed of only characters in
@@ -48,6 +106,17 @@ def generate_random_string(encoder: Encoder):
     )
 
 
+def check_result(trial: dict, result: str, encoder: Encoder) -> bool:
+    """
+    Checks whether the LLM's encoded answer is the expected slice. Raises
+    ValueError if the answer has characters outside the encoder's alphabet.
+    """
+    decoded_result = encoder.encode(result)
+    if trial["location"] == 0:
+        return decoded_result == trial["string"][: trial["slice_length"]]
+    return decoded_result == trial["string"][-trial["slice_length"] :]
+
+
 def main(args):
     seed(args.seed)
     # Set of already tested strings as a safeguard to not test duplicate strings
@@ -56,44 +125,106 @@ def main(args):
     failure_cases = {}
     area = {0: "first", 1: "last"}
     chain = create_chain(args.model)
+    batch_chain = create_batch_chain(args.model)
     encoder = Encoder()
     s = ""
 
+    if args.corpus is not None:
+        # Stream pre-generated trials so every model gets identical inputs
+        trials = islice(iter_trials(args.corpus, args.corpus_start), args.num_trials)
+    else:
+        # Generate every trial up front so batching doesn't change the trials
+        trials = []
+        for _ in range(args.num_trials):
+            while s in tested:
+                s = generate_random_string(encoder)
+            tested.add(s)
+            slice_length = randrange(1, len(s))
+            location = randrange(0, 2)
+            trials.append(
+                {"string": s, "slice_length": slice_length, "location": location}
+            )
+
+    trials = iter(trials)
+    trial_log = TrialLog(
+        args.trial_log, experiment="encoding", model=args.model, seed=args.seed
+    )
+    calls = 0
     i = 1
-    while i <= args.num_trials:
-        print(f"Trial {i} at time {datetime.datetime.now()}")
-        while s in tested:
-            s = generate_random_string(encoder)
-        tested.add(s)
-        encoded_s = encoder.encode(s)
-        slice_length = randrange(1, len(s))
-        location = randrange(0, 2)
-        question = (
-            f"What are the {area[location]} {slice_length} characters of {encoded_s}"
-        )
-        # Code expects LLM to return just the slice we ask it for without preamble.
-        # If there is an error with the response format, try the same query again.
-        while True:
+    while batch := list(islice(trials, args.batch_size)):
+        for trial in batch:
+            trial["question"] = (
+                f"What are the {area[trial['location']]} {trial['slice_length']} "
+                f"characters of {encoder.encode(trial['string'])}"
+            )
+        results = [None] * len(batch)
+        latency = None
+        if len(batch) > 1:
+            print(f"Trials {i}-{i + len(batch) - 1} at time {datetime.datetime.now()}")
+            questions = "\n".join(
+                f"{j + 1}. {trial['question']}" for j, trial in enumerate(batch)
+            )
             try:
-                result = chain.invoke({"question": question})
-                print(question)
-                print(result)
-                decoded_result = encoder.encode(result)
-                # Check result
-                if location == 0 and decoded_result == s[:slice_length]:
-                    success_cases[question] = result
-                elif location == 1 and decoded_result == s[-slice_length:]:
-                    success_cases[question] = result
-                else:  # LLM result is wrong
-                    failure_cases[question] = result
-                i += 1
-                break
+                calls += 1
+                start = time.perf_counter()
+                response = batch_chain.invoke({"questions": questions})
+                latency = time.perf_counter() - start
+                print(questions)
+                print(response)
+                results = parse_answers(response, len(batch))
             except Exception as e:
                 print(e)
+            time.sleep(5)  # Don't send requests too fast
+
+        for trial, result in zip(batch, results):
+            question = trial["question"]
+            trial_latency = latency
+            # Failed batch calls and malformed answers count as one retry
+            retries = int(len(batch) > 1)
+            # Malformed answers from the batch are retried on their own
+            try:
+                if result is not None:
+                    success = check_result(trial, result, encoder)
+                    retries = 0
+            except ValueError:
+                result = None
+            # Code expects LLM to return just the slice we ask it for without preamble.
+            # If there is an error with the response format, try the same query again.
+            while result is None:
+                print(f"Trial {i} at time {datetime.datetime.now()}")
+                try:
+                    calls += 1
+                    start = time.perf_counter()
+                    result = chain.invoke({"question": question})
+                    trial_latency = time.perf_counter() - start
+                    print(question)
+                    print(result)
+                    success = check_result(trial, result, encoder)
+                except Exception as e:
+                    print(e)
+                    result = None
+                    retries += 1
                 time.sleep(5)  # Don't send requests too fast
-        time.sleep(5)  # Don't send requests too fast
 
-    print(f"Success rate: {len(success_cases) / args.num_trials * 100}%")
+            if success:
+                success_cases[question] = result
+            else:  # LLM result is wrong
+                failure_cases[question] = result
+            trial_log.write(
+                id=trial.get("id"),
+                success=success,
+                slice_length=trial["slice_length"],
+                location=area[trial["location"]],
+                latency=trial_latency,
+                retries=retries,
+                batch_size=len(batch),
+            )
+            i += 1
+
+    trial_log.close()
+    num_trials = len(success_cases) + len(failure_cases)
+    print(f"Success rate: {len(success_cases) / num_trials * 100}%")
+    print(f"LLM calls: {calls}")
 
     # Write logs (question and LLM result)
     if args.success_log is not None:
@@ -122,6 +253,28 @@ if __name__ == "__main__":
         "--failure_log", default=None, help="File to write unsuccessful trials to"
     )
     parser.add_argument("--seed", type=int, default=9172)
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=1,
+        help="Number of questions asked in one LLM call",
+    )
+    parser.add_argument(
+        "--corpus",
+        default=None,
+        help="Trial corpus from encoding_experiment/corpus.py, trials are generated from the seed if not given",
+    )
+    parser.add_argument(
+        "--trial_log",
+        default=None,
+        help="JSON lines file to append one record per trial to, for demo_evaluation/report.py",
+    )
+    parser.add_argument(
+        "--corpus_start",
+        type=int,
+        default=0,
+        help="Index of the first corpus trial to run",
+    )
+    add_profile_arguments(parser)
     args = parser.parse_args()
-
-    main(args)
+    run_profiled(main, args)
@@ -0,0 +1,345 @@
+import argparse
+import cProfile
+from collections import Counter
+import json
+import linecache
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+from typing import Any, Callable
+
+# Deepest stack kept in collapsed stacks
+MAX_DEPTH = 64
+# Frames tracemalloc keeps per allocation, each one slows down every allocation
+MEMORY_DEPTH = 32
+# Call paths given less time than this by cProfile are left out of collapsed stacks
+MIN_PATH_SECONDS = 1e-6
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser, llm: bool = True):
+    """Adds the profiling options, and the LLM replay options if llm is set."""
+    parser.add_argument(
+        "--profile",
+        choices=["cpu", "mem"],
+        default=None,
+        help="Profile the run's CPU time or memory allocations",
+    )
+    parser.add_argument(
+        "--profile_output",
+        default="profile",
+        help="Prefix of the .collapsed, .txt and .pstats profile files",
+    )
+    parser.add_argument(
+        "--profile_top",
+        type=int,
+        default=25,
+        help="Entries in the top-N report",
+    )
+    parser.add_argument(
+        "--profile_interval",
+        type=float,
+        default=None,
+        help="Sample stacks (cpu) or peak allocations (mem) every this many seconds",
+    )
+    if llm:
+        parser.add_argument(
+            "--llm_record",
+            default=None,
+            help="JSON lines file every LLM response is recorded to",
+        )
+        parser.add_argument(
+            "--llm_replay",
+            default=None,
+            help="Answer LLM calls in order from a --llm_record file without calling the LLM",
+        )
+
+
+def frame_label(filename: str, lineno: int, name: str = None) -> str:
+    """Names a function or line in collapsed stacks by its short location."""
+    location = os.path.join(*filename.split(os.sep)[-2:]) if filename else "~"
+    if name is None:
+        return f"{location}:{lineno}"
+    return f"{name} ({location}:{lineno})"
+
+
+def write_collapsed(path: str, stacks: Counter):
+    """Writes stacks in the collapsed format read by flamegraph.pl and speedscope."""
+    with open(path, "w") as f:
+        for stack, weight in sorted(stacks.items()):
+            if round(weight) > 0:
+                f.write(f"{stack} {round(weight)}\n")
+
+
+def collapse_cprofile(stats: pstats.Stats) -> Counter:
+    """
+    Rebuilds call stacks from cProfile's caller graph. cProfile only records
+    caller/callee pairs, so a function's time is split over the paths leading
+    to it in proportion to the time each caller spent in it.
+
+        Args:
+            stats (pstats.Stats): Statistics of a cProfile run
+
+        Returns:
+            (Counter): Microseconds of own time keyed by ";"-joined stack
+    """
+    entries = stats.stats
+    callees = {}
+    for func, (_, _, _, _, callers) in entries.items():
+        for caller, (_, _, _, cumulative) in callers.items():
+            callees.setdefault(caller, {})[func] = cumulative
+    stacks = Counter()
+
+    def visit(func, seconds, path, on_path):
+        _, _, own, cumulative, _ = entries[func]
+        if cumulative <= 0 or seconds < MIN_PATH_SECONDS:
+            return
+        path = path + [frame_label(*func)]
+        scale = seconds / cumulative
+        stacks[";".join(path)] += own * scale * 1e6
+        if len(path) >= MAX_DEPTH:
+            return
+        for callee, callee_seconds in callees.get(func, {}).items():
+            # Recursive calls are already counted in the outer call's time
+            if callee not in on_path:
+                visit(callee, callee_seconds * scale, path, on_path | {callee})
+
+    for func, (_, _, _, cumulative, callers) in entries.items():
+        if not callers:
+            visit(func, cumulative, [], {func})
+    return stacks
+
+
+class StackSampler:
+    """Records the stacks of every other thread at a fixed interval."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.switch_interval = sys.getswitchinterval()
+
+    def start(self):
+        # A busy thread only hands over the GIL every switch interval, which
+        # would otherwise limit the sampling rate
+        sys.setswitchinterval(min(self.switch_interval, self.interval))
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        sys.setswitchinterval(self.switch_interval)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.thread.ident:
+                    continue
+                path = []
+                while frame is not None and len(path) < MAX_DEPTH:
+                    code = frame.f_code
+                    path.append(
+                        frame_label(code.co_filename, code.co_firstlineno, code.co_name)
+                    )
+                    frame = frame.f_back
+                path.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(path))] += 1
+            self.samples += 1
+
+    def report(self, top: int) -> str:
+        """Lists the functions with the most own and total samples."""
+        own = Counter()
+        total = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")[1:]
+            if frames:
+                own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        lines = [f"{self.samples} samples every {self.interval}s"]
+        for title, counter in [("Own time", own), ("Total time", total)]:
+            lines.append(f"\n{title}")
+            for frame, count in counter.most_common(top):
+                lines.append(f"{count * self.interval:10.3f}s  {frame}")
+        return "\n".join(lines) + "\n"
+
+
+def profile_cpu(main: Callable, args: argparse.Namespace) -> Any:
+    """Runs main with cProfile, or with a StackSampler if an interval is given."""
+    prefix = args.profile_output
+    if args.profile_interval is not None:
+        sampler = StackSampler(args.profile_interval)
+        sampler.start()
+        try:
+            return main(args)
+        finally:
+            sampler.stop()
+            write_collapsed(prefix + ".collapsed", sampler.stacks)
+            with open(prefix + ".txt", "w") as f:
+                f.write(sampler.report(args.profile_top))
+
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(main, args)
+    finally:
+        profiler.dump_stats(prefix + ".pstats")
+        write_collapsed(
+            prefix + ".collapsed", collapse_cprofile(pstats.Stats(profiler))
+        )
+        with open(prefix + ".txt", "w") as f:
+            stats = pstats.Stats(profiler, stream=f)
+            for sort in ("tottime", "cumulative"):
+                stats.sort_stats(sort).print_stats(args.profile_top)
+
+
+class PeakSnapshotter:
+    """Takes a tracemalloc snapshot whenever traced memory reaches a new peak."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.snapshot = None
+        self.size = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            current, _ = tracemalloc.get_traced_memory()
+            if current > self.size:
+                self.snapshot = tracemalloc.take_snapshot()
+                self.size = current
+
+
+def profile_memory(main: Callable, args: argparse.Namespace) -> Any:
+    """
+    Runs main with tracemalloc. Reports allocations by line and as collapsed
+    stacks weighted in bytes, either those still alive when main returns or,
+    if an interval is given, those alive at the largest sampled peak.
+    """
+    prefix = args.profile_output
+    tracemalloc.start(MEMORY_DEPTH)
+    snapshotter = None
+    if args.profile_interval is not None:
+        snapshotter = PeakSnapshotter(args.profile_interval)
+        snapshotter.start()
+    try:
+        return main(args)
+    finally:
+        if snapshotter is not None:
+            snapshotter.stop()
+        current, peak = tracemalloc.get_traced_memory()
+        if snapshotter is not None and snapshotter.snapshot is not None:
+            snapshot = snapshotter.snapshot
+            title = f"at the sampled peak of {snapshotter.size / 1024:.1f} KiB"
+        else:
+            snapshot = tracemalloc.take_snapshot()
+            title = "still allocated on exit"
+        tracemalloc.stop()
+        snapshot = snapshot.filter_traces(
+            [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+                tracemalloc.Filter(False, "<unknown>"),
+            ]
+        )
+        stacks = Counter()
+        for stat in snapshot.statistics("traceback"):
+            stack = ";".join(
+                frame_label(frame.filename, frame.lineno) for frame in stat.traceback
+            )
+            stacks[stack] += stat.size
+        write_collapsed(prefix + ".collapsed", stacks)
+        with open(prefix + ".txt", "w") as f:
+            f.write(f"Peak traced memory: {peak / 1024:.1f} KiB\n")
+            f.write(f"Still allocated on exit: {current / 1024:.1f} KiB\n")
+            f.write(f"\nTop {args.profile_top} lines by bytes {title}\n")
+            for stat in snapshot.statistics("lineno")[: args.profile_top]:
+                frame = stat.traceback[0]
+                source = linecache.getline(frame.filename, frame.lineno).strip()
+                f.write(
+                    f"{stat.size / 1024:10.1f} KiB {stat.count:8d} blocks  "
+                    f"{frame.filename}:{frame.lineno}  {source}\n"
+                )
+
+
+def create_replay_cache(record_path: str = None, replay_path: str = None):
+    """
+    Returns an LLM cache that records every response to a JSON lines file, or
+    answers every call with the next recorded response. Replay ignores prompts,
+    which change between runs with freshly encrypted data, so it must run the
+    same workload that was recorded.
+
+        Args:
+            record_path (str): File to append responses to
+            replay_path (str): File written with record_path to answer calls from
+
+        Returns:
+            (BaseCache): Cache to install with langchain's set_llm_cache
+    """
+    from langchain_core.caches import BaseCache
+    from langchain_core.load import dumps, loads
+
+    class ReplayCache(BaseCache):
+        def __init__(self):
+            self.lock = threading.Lock()
+            self.record = open(record_path, "a") if record_path else None
+            self.replay = None
+            if replay_path:
+                with open(replay_path, "r") as f:
+                    self.replay = iter([line for line in f if line.strip()])
+
+        def lookup(self, prompt: str, llm_string: str):
+            if self.replay is None:
+                return None
+            with self.lock:
+                line = next(self.replay, None)
+            if line is None:
+                raise RuntimeError(f"No recorded LLM responses left in {replay_path}")
+            return [loads(generation) for generation in json.loads(line)]
+
+        def update(self, prompt: str, llm_string: str, return_val):
+            if self.record is None:
+                return
+            with self.lock:
+                self.record.write(
+                    json.dumps([dumps(generation) for generation in return_val]) + "\n"
+                )
+                self.record.flush()
+
+        def clear(self, **kwargs):
+            pass
+
+    return ReplayCache()
+
+
+def run_profiled(main: Callable, args: argparse.Namespace) -> Any:
+    """
+    Runs an entry point's main with the profiler and LLM replay chosen in args.
+    Replaying recorded LLM responses keeps LLM wait time out of the profile.
+    """
+    if getattr(args, "llm_record", None) or getattr(args, "llm_replay", None):
+        from langchain.globals import set_llm_cache
+
+        set_llm_cache(create_replay_cache(args.llm_record, args.llm_replay))
+    if args.profile is None:
+        return main(args)
+    try:
+        if args.profile == "cpu":
+            return profile_cpu(main, args)
+        return profile_memory(main, args)
+    finally:
+        print(
+            f"Wrote {args.profile} profile to {args.profile_output}.collapsed "
+            f"and {args.profile_output}.txt"
+        )
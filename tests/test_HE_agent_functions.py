@@ -1,9 +1,16 @@
+import asyncio
 from hypothesis import given
+import json
 from hypothesis import strategies as st
 
 from agents.HE_agent import (
     add_encrypted_numbers,
+    add_plain,
+    create_tool_pool,
+    create_tools,
+    evaluate_encrypted_expression,
     multiply_encrypted_numbers,
+    multiply_plain,
     initialize_ciphertexts,
 )
 from HE_data.HE_data import serialize_ciphertext, load_ciphertext, load_encoder
@@ -53,3 +60,103 @@ def test_multiply_encrypted_numbers(num1, num2):
     assert num1 * num2 == encoder.decode(
         decryptor.decrypt(load_ciphertext(serialization=result))
     )
+
+
+@given(st.integers(min_value=0, max_value=20), st.integers(min_value=0, max_value=380))
+def test_add_plain(num, plain):
+    # Setup
+    ciphtexts = initialize_ciphertexts("./HE_data")
+    params, key_generator = load_encoder("HE_data/HE.txt")
+    encoder = IntegerEncoder(params, 10)
+    decryptor = BFVDecryptor(params, key_generator.secret_key)
+
+    # Test
+    result = add_plain(serialize_ciphertext(ciphtexts[num]), plain)
+    assert num + plain == encoder.decode(
+        decryptor.decrypt(load_ciphertext(serialization=result))
+    )
+
+
+@given(st.integers(min_value=0, max_value=20), st.integers(min_value=0, max_value=20))
+def test_multiply_plain(num, plain):
+    # Setup
+    ciphtexts = initialize_ciphertexts("./HE_data")
+    params, key_generator = load_encoder("HE_data/HE.txt")
+    encoder = IntegerEncoder(params, 10)
+    decryptor = BFVDecryptor(params, key_generator.secret_key)
+
+    # Test
+    result = multiply_plain(serialize_ciphertext(ciphtexts[num]), plain)
+    assert num * plain == encoder.decode(
+        decryptor.decrypt(load_ciphertext(serialization=result))
+    )
+
+
+def test_parallel_tools():
+    # Setup
+    ciphtexts = initialize_ciphertexts("./HE_data")
+    params, key_generator = load_encoder("HE_data/HE.txt")
+    encoder = IntegerEncoder(params, 10)
+    decryptor = BFVDecryptor(params, key_generator.secret_key)
+    nums = [serialize_ciphertext(ciphtexts[num]) for num in (3, 5, 7)]
+
+    # Test that calls gathered like AgentExecutor does run in the pool and keep
+    # their order
+    async def run_tools(tools):
+        return await asyncio.gather(
+            tools[0].ainvoke({"nums": nums}),
+            # One multiplication stays within the noise budget of any key set
+            tools[1].ainvoke({"nums": nums[1:]}),
+            tools[2].ainvoke({"num": nums[0], "plain": 4}),
+        )
+
+    with create_tool_pool(2) as pool:
+        results = asyncio.run(run_tools(create_tools(pool)))
+    assert [
+        encoder.decode(decryptor.decrypt(load_ciphertext(serialization=result)))
+        for result in results
+    ] == [15, 35, 7]
+
+
+def test_invalid_ciphertext_argument():
+    # Setup
+    ciphtexts = initialize_ciphertexts("./HE_data")
+    num = serialize_ciphertext(ciphtexts[3])
+
+    # Test that the error names the argument instead of raising
+    error = json.loads(add_encrypted_numbers([num, num[:-5]]))
+    assert error["error"] == "invalid_ciphertext"
+    assert error["argument"] == "nums[1]"
+    error = json.loads(multiply_plain(num.replace("w", " "), 2))
+    assert error["argument"] == "num"
+    # Without its header a changed ciphertext could still parse
+    error = json.loads(multiply_plain(num.split(":", 2)[2], 2))
+    assert error["error"] == "invalid_ciphertext"
+    assert "header" in error["reason"]
+
+
+def test_invalid_expression():
+    # Setup
+    ciphtexts = initialize_ciphertexts("./HE_data")
+    nums = [serialize_ciphertext(ciphtexts[num]) for num in (3, 5)]
+
+    # Test that expressions that can't be evaluated return the reason
+    for expression in ("x0 +", "x0 * x2", "x0 + -1", "2 * 3", "y0"):
+        error = json.loads(evaluate_encrypted_expression(expression, nums))
+        assert error["error"] == "invalid_expression"
+        assert error["reason"]
+    error = json.loads(evaluate_encrypted_expression("x0", []))
+    assert error["error"] == "invalid_expression"
+
+
+def test_invalid_plain():
+    # Setup
+    ciphtexts = initialize_ciphertexts("./HE_data")
+    params, _ = load_encoder("HE_data/HE.txt")
+    num = serialize_ciphertext(ciphtexts[3])
+
+    # Test that plaintexts the encoder can't represent are rejected
+    for plain in (-1, params.plain_modulus):
+        for tool in (add_plain, multiply_plain):
+            error = json.loads(tool(num, plain))
+            assert error["error"] == "invalid_plain"
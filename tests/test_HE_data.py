@@ -1,8 +1,11 @@
 from hypothesis import given
 from hypothesis import strategies as st
-from tempfile import NamedTemporaryFile
+import os
+import pytest
+from tempfile import NamedTemporaryFile, TemporaryDirectory
 
 from HE_data.HE_data import (
+    CiphertextFormatError,
     serialize_encoder,
     save_encoder,
     load_encoder,
@@ -10,6 +13,26 @@ from HE_data.HE_data import (
     serialize_ciphertext,
     load_ciphertext,
     serialize_polynomial,
+    find_ntt_modulus,
+    find_ntt_root,
+    get_zero_pool,
+    is_ntt_friendly,
+    load_ntt_context,
+    open_key_file,
+    validate_ciphertext,
+    validate_preset,
+    NTTBFVDecryptor,
+    NTTBFVEncryptor,
+    NTTBFVEvaluator,
+    save_key_files,
+    KeyFile,
+    SecretKeyBFVEncryptor,
+    SeededCiphertext,
+    PARAMETER_PRESETS,
+    PUBLIC_KEY_FILE,
+    SECRET_KEY_FILE,
+    ZeroEncryptionPool,
+    _zero_pools,
 )
 from bfv.bfv_decryptor import BFVDecryptor
 from bfv.bfv_encryptor import BFVEncryptor
@@ -17,6 +40,7 @@ from bfv.bfv_key_generator import BFVKeyGenerator
 from bfv.bfv_parameters import BFVParameters
 from bfv.int_encoder import IntegerEncoder
 from util.ciphertext import Ciphertext
+from util.ntt import NTTContext
 from util.polynomial import Polynomial
 
 
@@ -103,3 +127,227 @@ def test_encoder_functions():
 
     # Cleanup
     temp_file.close()
+
+
+def test_load_encoder_missing_sections():
+    # Setup
+    params = BFVParameters(poly_degree=8, plain_modulus=401, ciph_modulus=8000000000000)
+    key_generator = BFVKeyGenerator(params)
+
+    # Test that keys of a file without them are not made up
+    with TemporaryDirectory() as directory:
+        save_key_files(directory, params, key_generator)
+        _, public_key_generator = load_encoder(os.path.join(directory, PUBLIC_KEY_FILE))
+    assert public_key_generator.secret_key is None
+    assert serialize_polynomial(
+        public_key_generator.public_key.p0
+    ) == serialize_polynomial(key_generator.public_key.p0)
+
+
+def test_parameter_presets():
+    for preset in PARAMETER_PRESETS.values():
+        validate_preset(preset)
+        assert find_ntt_modulus(preset["degree"], preset["ciph_modulus"]) == (
+            preset["ciph_modulus"]
+        )
+    assert not is_ntt_friendly(8, 8000000000000)
+    assert find_ntt_modulus(8, 8000000000000) == 8000000000753
+
+
+@given(st.integers(min_value=0, max_value=20), st.integers(min_value=0, max_value=20))
+def test_ntt_functions(num1, num2):
+    # Setup
+    preset = PARAMETER_PRESETS["default"]
+    params = BFVParameters(
+        poly_degree=preset["degree"],
+        plain_modulus=preset["plain_modulus"],
+        ciph_modulus=preset["ciph_modulus"],
+    )
+    key_generator = BFVKeyGenerator(params)
+    ntt_root = find_ntt_root(params)
+    temp_file = NamedTemporaryFile()
+    save_encoder(temp_file.name, serialize_encoder(params, key_generator, ntt_root))
+    ntt_context = load_ntt_context(temp_file.name)
+    encoder = IntegerEncoder(params, 10)
+    encryptor = NTTBFVEncryptor(params, key_generator.public_key, ntt_context)
+    decryptor = NTTBFVDecryptor(params, key_generator.secret_key, ntt_context)
+    evaluator = NTTBFVEvaluator(params, ntt_context)
+
+    # Test
+    assert ntt_context is not None
+    ciphtext1 = encryptor.encrypt(encoder.encode(num1))
+    ciphtext2 = encryptor.encrypt(encoder.encode(num2))
+    assert encoder.decode(decryptor.decrypt(ciphtext1)) == num1
+    product = evaluator.multiply(ciphtext1, ciphtext2, key_generator.relin_key)
+    assert encoder.decode(decryptor.decrypt(product)) == num1 * num2
+
+    # Cleanup
+    temp_file.close()
+
+
+@given(st.lists(st.integers(min_value=0, max_value=400), min_size=1, max_size=10))
+def test_zero_encryption_pool(nums):
+    # Setup
+    params = BFVParameters(poly_degree=8, plain_modulus=401, ciph_modulus=8000000000000)
+    key_generator = BFVKeyGenerator(params)
+    encoder = IntegerEncoder(params, 10)
+    decryptor = BFVDecryptor(params, key_generator.secret_key)
+    pool = ZeroEncryptionPool(
+        params, BFVEncryptor(params, key_generator.public_key), size=4, background=False
+    )
+    pool.fill()
+
+    # Test
+    ciphtexts = [pool.encrypt(encoder.encode(num)) for num in nums]
+    assert [encoder.decode(decryptor.decrypt(c)) for c in ciphtexts] == nums
+    # Pooled encryptions of zero are never handed out twice
+    c1_serializations = [serialize_polynomial(c.c1) for c in ciphtexts]
+    assert len(set(c1_serializations)) == len(c1_serializations)
+
+    # Cleanup
+    pool.close()
+
+
+def test_get_zero_pool():
+    # Setup, with keys of its own so the pool of HE_data's keys is left alone
+    params = BFVParameters(poly_degree=8, plain_modulus=401, ciph_modulus=8000000000000)
+    temp_dir = TemporaryDirectory()
+    save_key_files(temp_dir.name, params, BFVKeyGenerator(params))
+    path = os.path.join(temp_dir.name, PUBLIC_KEY_FILE)
+
+    # Test
+    key_file = open_key_file(path)
+    pool = get_zero_pool(key_file.params, key_file.public_key, key_file.ntt_context)
+    # Calls for the same key file share its parsed public key and so the pool
+    key_file = open_key_file(path)
+    assert pool is get_zero_pool(
+        key_file.params, key_file.public_key, key_file.ntt_context
+    )
+
+    # Cleanup
+    _zero_pools.pop(id(key_file.public_key)).close()
+    temp_dir.cleanup()
+
+
+def test_key_files():
+    # Setup
+    params = BFVParameters(poly_degree=8, plain_modulus=401, ciph_modulus=8000000000000)
+    key_generator = BFVKeyGenerator(params)
+    temp_dir = TemporaryDirectory()
+    save_key_files(temp_dir.name, params, key_generator)
+
+    # Test
+    public_key_file = KeyFile(os.path.join(temp_dir.name, PUBLIC_KEY_FILE))
+    assert public_key_file.params.ciph_modulus == params.ciph_modulus
+    # Sections are only parsed when accessed
+    assert "relin_key" not in vars(public_key_file)
+    assert str(public_key_file.public_key) == str(key_generator.public_key)
+    assert check_load_relin_key(key_generator.relin_key, public_key_file.relin_key)
+    assert not public_key_file.has_section("secret_key")
+    assert public_key_file.ntt_context is None
+
+    secret_key_file = KeyFile(os.path.join(temp_dir.name, SECRET_KEY_FILE))
+    assert str(secret_key_file.secret_key) == str(key_generator.secret_key)
+    assert not secret_key_file.has_section("relin_key")
+
+    # Cleanup
+    temp_dir.cleanup()
+
+
+@given(st.integers(min_value=0, max_value=400), st.data())
+def test_validate_ciphertext(num, data):
+    # Setup
+    params = BFVParameters(poly_degree=8, plain_modulus=401, ciph_modulus=8000000000000)
+    key_generator = BFVKeyGenerator(params)
+    encoder = IntegerEncoder(params, 10)
+    encryptor = BFVEncryptor(params, key_generator.public_key)
+    serialization = serialize_ciphertext(encryptor.encrypt(encoder.encode(num)))
+    header, body = serialization.rsplit(":", 1)
+
+    # Test
+    assert validate_ciphertext(serialization, params) == body
+    # Serializations without a header are still accepted
+    assert validate_ciphertext(body, params) == body
+    with pytest.raises(CiphertextFormatError):
+        validate_ciphertext(body, params, require_header=True)
+    # Truncated serializations
+    cut = data.draw(
+        st.integers(min_value=len(header) + 1, max_value=len(serialization) - 1)
+    )
+    with pytest.raises(CiphertextFormatError, match="truncated"):
+        load_ciphertext(serialization=serialization[:cut])
+    # Changed digits
+    digits = [
+        i for i, char in enumerate(serialization) if char.isdigit() and i > len(header)
+    ]
+    i = data.draw(st.sampled_from(digits))
+    changed = (
+        serialization[:i]
+        + str((int(serialization[i]) + 1) % 10)
+        + serialization[i + 1 :]
+    )
+    with pytest.raises(CiphertextFormatError, match="checksum"):
+        load_ciphertext(serialization=changed)
+    # Malformed serializations without a header
+    with pytest.raises(CiphertextFormatError, match="coefficients"):
+        validate_ciphertext(body.rsplit(" ", 1)[0])
+    with pytest.raises(CiphertextFormatError, match="ring degree"):
+        validate_ciphertext(body, BFVParameters(16, 401, 8000000000000))
+
+
+@given(
+    st.integers(min_value=0, max_value=20),
+    st.integers(min_value=0, max_value=20),
+    st.data(),
+)
+def test_secret_key_encryptor(num1, num2, data):
+    # Setup
+    preset = PARAMETER_PRESETS["default"]
+    params = BFVParameters(
+        poly_degree=preset["degree"],
+        plain_modulus=preset["plain_modulus"],
+        ciph_modulus=preset["ciph_modulus"],
+    )
+    key_generator = BFVKeyGenerator(params)
+    ntt_context = NTTContext(
+        params.poly_degree, params.ciph_modulus, find_ntt_root(params)
+    )
+    encoder = IntegerEncoder(params, 10)
+    encryptor = SecretKeyBFVEncryptor(params, key_generator.secret_key, ntt_context)
+    public_encryptor = NTTBFVEncryptor(params, key_generator.public_key, ntt_context)
+    decryptor = NTTBFVDecryptor(params, key_generator.secret_key, ntt_context)
+    evaluator = NTTBFVEvaluator(params, ntt_context)
+
+    # Test
+    serialization = serialize_ciphertext(encryptor.encrypt(encoder.encode(num1)))
+    public = serialize_ciphertext(public_encryptor.encrypt(encoder.encode(num2)))
+    assert len(serialization) < 0.75 * len(public)
+    ciphtext1 = load_ciphertext(serialization=serialization, params=params)
+    assert isinstance(ciphtext1, SeededCiphertext)
+    # c1 is only expanded when used
+    assert "c1" not in vars(ciphtext1)
+    assert serialize_ciphertext(ciphtext1) == serialization
+    assert encoder.decode(decryptor.decrypt(ciphtext1)) == num1
+    ciphtext2 = load_ciphertext(serialization=public)
+    assert encoder.decode(decryptor.decrypt(evaluator.add(ciphtext1, ciphtext2))) == (
+        num1 + num2
+    )
+    product = evaluator.multiply(ciphtext1, ciphtext2, key_generator.relin_key)
+    assert encoder.decode(decryptor.decrypt(product)) == num1 * num2
+    # Pools keep the seed
+    pool = ZeroEncryptionPool(params, encryptor, size=2, background=False)
+    pooled = pool.encrypt(encoder.encode(num2))
+    assert isinstance(pooled, SeededCiphertext)
+    assert (
+        encoder.decode(decryptor.decrypt(load_ciphertext(serialize_ciphertext(pooled))))
+        == num2
+    )
+    pool.close()
+    # Altered seeds are caught by the checksum, malformed ones by the format
+    with pytest.raises(CiphertextFormatError, match="checksum"):
+        load_ciphertext(serialization=serialization[:-1] + "x")
+    body = validate_ciphertext(serialization)
+    with pytest.raises(CiphertextFormatError, match="Seeded"):
+        validate_ciphertext(body[:-1])
+    with pytest.raises(CiphertextFormatError, match="modulus"):
+        validate_ciphertext(body, BFVParameters(8, 401, 8000000000000))
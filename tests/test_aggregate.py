@@ -0,0 +1,159 @@
+from concurrent.futures import ProcessPoolExecutor
+from hypothesis import given, settings
+from hypothesis import strategies as st
+import json
+import math
+import os
+import pytest
+from tempfile import TemporaryDirectory
+
+from agents import HE_tools
+from bfv.bfv_key_generator import BFVKeyGenerator
+from bfv.bfv_parameters import BFVParameters
+from bfv.int_encoder import IntegerEncoder
+from HE_data.aggregate import (
+    aggregate,
+    max_rows,
+    ResultOverflowError,
+    tree_reduce,
+)
+from HE_data.HE_data import (
+    find_ntt_root,
+    load_ciphertext,
+    load_encoder,
+    NTTBFVDecryptor,
+    PARAMETER_PRESETS,
+    PUBLIC_KEY_FILE,
+    save_key_files,
+)
+from HE_data.ingest import ingest
+
+preset = PARAMETER_PRESETS["default"]
+params = BFVParameters(
+    poly_degree=preset["degree"],
+    plain_modulus=preset["plain_modulus"],
+    ciph_modulus=preset["ciph_modulus"],
+)
+encoder = IntegerEncoder(params, 10)
+
+
+def create_keys(directory):
+    key_generator = BFVKeyGenerator(params)
+    save_key_files(directory, params, key_generator, find_ntt_root(params))
+    return NTTBFVDecryptor(params, key_generator.secret_key)
+
+
+def ingest_column(store_dir, key_file, column, values):
+    """Ingests a column whose rows have IDs 10, 11, ..."""
+    path = store_dir + ".csv"
+    with open(path, "w") as f:
+        f.write(f"id,{column}\n")
+        for i, value in enumerate(values):
+            f.write(f"{10 + i},{value}\n")
+    ingest(path, store_dir, key_file, [column], "id", workers=1)
+
+
+@given(st.lists(st.integers(), min_size=1, max_size=20))
+def test_tree_reduce(items):
+    assert tree_reduce(items, lambda a, b: a + b) == sum(items)
+    depth = tree_reduce([0] * len(items), lambda a, b: max(a, b) + 1)
+    assert 2**depth >= len(items) > 2 ** (depth - 1) or depth == 0
+
+
+@settings(deadline=None, max_examples=5)
+@given(
+    st.lists(st.integers(min_value=0, max_value=20), min_size=1, max_size=20),
+    # Products of more than 2 ciphertexts overflow the noise budget of the
+    # default parameters
+    st.lists(st.integers(min_value=0, max_value=20), min_size=1, max_size=2),
+    st.sets(st.integers(min_value=0, max_value=30)),
+    st.integers(min_value=1, max_value=5),
+)
+def test_aggregate(values, factors, row_ids, shard_rows):
+    with TemporaryDirectory() as directory:
+        decryptor = create_keys(directory)
+        key_file = os.path.join(directory, PUBLIC_KEY_FILE)
+        store_dir = os.path.join(directory, "store")
+        ingest_column(store_dir, key_file, "value", values)
+        ingest_column(store_dir, key_file, "factor", factors)
+
+        def decrypt(result):
+            return encoder.decode(decryptor.decrypt(result))
+
+        with ProcessPoolExecutor(2) as executor:
+            for kwargs in [{}, {"executor": executor, "shard_rows": shard_rows}]:
+                result, rows = aggregate(
+                    store_dir, "value", key_file=key_file, **kwargs
+                )
+                assert (decrypt(result), rows) == (sum(values), len(values))
+                result, rows = aggregate(
+                    store_dir, "factor", "product", key_file=key_file, **kwargs
+                )
+                assert (decrypt(result), rows) == (math.prod(factors), len(factors))
+
+                # Test aggregating the rows with given IDs
+                matched = [v for i, v in enumerate(values) if 10 + i in row_ids]
+                result, rows = aggregate(
+                    store_dir, "value", "sum", list(row_ids), key_file, **kwargs
+                )
+                assert (decrypt(result), rows) == (sum(matched), len(matched))
+                matched = [f for i, f in enumerate(factors) if 10 + i in row_ids]
+                result, rows = aggregate(
+                    store_dir, "factor", "product", list(row_ids), key_file, **kwargs
+                )
+                assert (decrypt(result), rows) == (math.prod(matched), len(matched))
+
+
+def test_aggregate_tool(monkeypatch):
+    # Setup, the tool uses the keys in HE_data like the other tools
+    params, key_generator = load_encoder("HE_data/HE.txt")
+    encoder = IntegerEncoder(params, 10)
+    decryptor = NTTBFVDecryptor(params, key_generator.secret_key)
+    with TemporaryDirectory() as directory:
+        store_dir = os.path.join(directory, "store")
+        ingest_column(store_dir, f"HE_data/{PUBLIC_KEY_FILE}", "age", [3, 5, 7, 9])
+        monkeypatch.setattr(HE_tools, "STORE_DIR", store_dir)
+
+        # Test
+        for kwargs, expected in [
+            ({"column": "age"}, 24),
+            ({"column": "age", "row_ids": [11, 13]}, 14),
+            ({"column": "age", "operation": "product", "row_ids": [10, 11]}, 15),
+        ]:
+            result = HE_tools.aggregate_encrypted_column(**kwargs)
+            assert expected == encoder.decode(
+                decryptor.decrypt(load_ciphertext(serialization=result))
+            )
+        error = json.loads(HE_tools.aggregate_encrypted_column("weight"))
+        assert error["error"] == "invalid_column"
+        assert error["columns"] == ["age"]
+
+        monkeypatch.setattr(HE_tools, "STORE_DIR", os.path.join(directory, "empty"))
+        error = json.loads(HE_tools.aggregate_encrypted_column("age"))
+        assert error["error"] == "no_store"
+
+
+def test_result_overflow(monkeypatch):
+    # Sums of 45 nines carry past the plaintext modulus of 401 in the units digit
+    assert max_rows(params, "sum") == 44
+    assert max_rows(params, "product") == 2
+    with TemporaryDirectory() as directory:
+        decryptor = create_keys(directory)
+        key_file = os.path.join(directory, PUBLIC_KEY_FILE)
+        store_dir = os.path.join(directory, "store")
+        ingest_column(store_dir, key_file, "value", [9] * 45)
+        with pytest.raises(ResultOverflowError):
+            aggregate(store_dir, "value", key_file=key_file)
+        with pytest.raises(ResultOverflowError):
+            aggregate(store_dir, "value", "product", [10, 11, 12], key_file)
+        # Selecting few enough rows fits
+        result, rows = aggregate(store_dir, "value", "sum", range(10, 54), key_file)
+        assert (encoder.decode(decryptor.decrypt(result)), rows) == (396, 44)
+
+        # The tool returns the limit instead of a wrong result
+        store_dir = os.path.join(directory, "tool_store")
+        ingest_column(store_dir, f"HE_data/{PUBLIC_KEY_FILE}", "value", [9] * 45)
+        monkeypatch.setattr(HE_tools, "STORE_DIR", store_dir)
+        error = json.loads(HE_tools.aggregate_encrypted_column("value"))
+        assert error["error"] == "result_overflow"
+        assert (error["rows"], error["max_rows"]) == (45, 44)
@@ -0,0 +1,114 @@
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import socket
+import threading
+import time
+
+import pytest
+
+from agents.backend_pool import BackendPool, NoBackendAvailableError
+from agents.chains import create_llm
+
+
+class StubOllama(ThreadingHTTPServer):
+    """Local server answering Ollama's health and generate endpoints"""
+
+    def __init__(self, name, delay=0.0, status=200):
+        super().__init__(("127.0.0.1", 0), StubOllamaHandler)
+        self.name = name
+        self.delay = delay
+        self.status = status
+        self.outstanding = 0
+        self.max_outstanding = 0
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def send_json_lines(self, status, lines):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        for line in lines:
+            self.wfile.write((json.dumps(line) + "\n").encode())
+
+    def do_GET(self):
+        self.send_json_lines(self.server.status, [{"models": []}])
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        with self.server.lock:
+            self.server.outstanding += 1
+            self.server.max_outstanding = max(
+                self.server.max_outstanding, self.server.outstanding
+            )
+        time.sleep(self.server.delay)
+        with self.server.lock:
+            self.server.outstanding -= 1
+        self.send_json_lines(
+            self.server.status,
+            [
+                {"response": self.server.name, "done": False},
+                {"response": "", "done": True},
+            ],
+        )
+
+
+def unused_url():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{s.getsockname()[1]}"
+
+
+def test_least_outstanding_routing():
+    servers = [StubOllama("a", delay=0.3), StubOllama("b", delay=0.3)]
+    llm = create_llm([server.url for server in servers], max_concurrency=2)
+
+    # Concurrent requests are spread evenly and never exceed the limit
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(llm.invoke, ["hi"] * 4))
+    assert sorted(results) == ["a", "a", "b", "b"]
+    assert [server.max_outstanding for server in servers] == [2, 2]
+    assert "".join(llm.stream("hi")) in ("a", "b")
+
+
+def test_concurrency_limit():
+    server = StubOllama("a", delay=0.1)
+    llm = create_llm([server.url], max_concurrency=1)
+    with ThreadPoolExecutor(3) as executor:
+        assert list(executor.map(llm.invoke, ["hi"] * 3)) == ["a"] * 3
+    assert server.max_outstanding == 1
+
+
+def test_failover():
+    healthy = StubOllama("healthy")
+    broken = StubOllama("broken", status=500)
+    dead_url = unused_url()
+    pool = BackendPool(
+        [dead_url, broken.url, healthy.url], lambda url: create_llm([url])
+    )
+    # Health checks mark the dead and broken servers as failed
+    assert [backend.healthy for backend in pool.backends] == [False, False, True]
+    assert pool.run(lambda llm: llm.invoke("hi")) == "healthy"
+
+    # A server failing between health checks is failed over from
+    broken.status = 200
+    pool.check_health()
+    broken.status = 500
+    assert [pool.run(lambda llm: llm.invoke("hi")) for _ in range(2)] == [
+        "healthy",
+        "healthy",
+    ]
+    assert not pool.backends[1].healthy
+
+    healthy.status = 500
+    with pytest.raises(NoBackendAvailableError):
+        pool.run(lambda llm: llm.invoke("hi"))
@@ -0,0 +1,46 @@
+from hypothesis import given
+from hypothesis import strategies as st
+
+from agents.chains import select_tool, ToolRouter
+
+
+class StubChain:
+    """Stands in for the tool selection chain and records its calls"""
+
+    def __init__(self, tool):
+        self.tool = tool
+        self.calls = 0
+
+    def invoke(self, input):
+        self.calls += 1
+        return self.tool
+
+
+@given(
+    st.sampled_from(["first", "last"]),
+    st.integers(min_value=1, max_value=40),
+    st.sampled_from(["characters of my string", "digits of my number"]),
+)
+def test_router_skips_llm(area, slice_len, target):
+    fallback = StubChain("brew_coffee")
+    decision = select_tool(
+        f"What are the {area} {slice_len} {target}?", fallback=fallback
+    )
+    assert decision.tool == "get_number"
+    assert decision.source == "router"
+    assert decision.confidence >= ToolRouter().threshold
+    assert decision.latency >= 0
+    assert fallback.calls == 0
+
+
+def test_router_falls_back_to_llm():
+    fallback = StubChain("get_number\n")
+    decision = select_tool("Hello there", fallback=fallback)
+    assert decision.tool == "get_number"
+    assert decision.source == "llm"
+    assert decision.confidence is None
+    assert fallback.calls == 1
+
+    router = ToolRouter()
+    assert router.route("Please brew a cup of coffee")[0] == "brew_coffee"
+    assert router.route("What is the sum of 4 and 9?")[0] == "add_numbers"
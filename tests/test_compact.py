@@ -0,0 +1,99 @@
+from hypothesis import given
+from hypothesis import strategies as st
+import os
+import pytest
+from tempfile import TemporaryDirectory, TemporaryFile
+
+from agents.HE_tools import initialize_ciphertexts
+from HE_data.compact import CompactCiphertext, CompactCiphertextArray
+from HE_data.HE_data import (
+    CiphertextFormatError,
+    SecretKeyBFVEncryptor,
+    SeededCiphertext,
+    load_ciphertext,
+    serialize_ciphertext,
+)
+from bfv.bfv_decryptor import BFVDecryptor
+from bfv.bfv_encryptor import BFVEncryptor
+from bfv.bfv_key_generator import BFVKeyGenerator
+from bfv.bfv_parameters import BFVParameters
+from bfv.int_encoder import IntegerEncoder
+from util.ciphertext import Ciphertext
+from util.polynomial import Polynomial
+
+
+@given(st.lists(st.integers(min_value=0, max_value=400), min_size=1, max_size=5))
+def test_compact_ciphertext(nums):
+    # Setup
+    params = BFVParameters(poly_degree=8, plain_modulus=401, ciph_modulus=8000000000000)
+    key_generator = BFVKeyGenerator(params)
+    encoder = IntegerEncoder(params, 10)
+    encryptor = BFVEncryptor(params, key_generator.public_key)
+    decryptor = BFVDecryptor(params, key_generator.secret_key)
+    ciphtexts = [encryptor.encrypt(encoder.encode(num)) for num in nums]
+
+    # Test
+    ciphtext_array = CompactCiphertextArray(params.poly_degree)
+    for ciphtext in ciphtexts:
+        compact = CompactCiphertext.from_ciphertext(ciphtext)
+        assert compact.serialize() == serialize_ciphertext(ciphtext)
+        assert (
+            CompactCiphertext.from_serialization(compact.serialize()).coeffs
+            == compact.coeffs
+        )
+        assert list(compact.c0) == ciphtext.c0.coeffs
+        ciphtext_array.append(compact)
+
+    with TemporaryFile() as f:
+        ciphtext_array.tofile(f)
+        f.seek(0)
+        loaded = CompactCiphertextArray.fromfile(f)
+    assert len(loaded) == len(nums)
+    for i, num in enumerate(nums):
+        ciphtext = loaded[i].to_ciphertext()
+        assert str(ciphtext) == str(ciphtexts[i])
+        assert encoder.decode(decryptor.decrypt(ciphtext)) == num
+
+
+@given(st.integers(min_value=0, max_value=400))
+def test_compact_seeded_ciphertext(num):
+    # Setup
+    params = BFVParameters(poly_degree=8, plain_modulus=401, ciph_modulus=8000000000000)
+    key_generator = BFVKeyGenerator(params)
+    encoder = IntegerEncoder(params, 10)
+    encryptor = SecretKeyBFVEncryptor(params, key_generator.secret_key)
+    decryptor = BFVDecryptor(params, key_generator.secret_key)
+    serialization = serialize_ciphertext(encryptor.encrypt(encoder.encode(num)))
+
+    # Test that the seed survives the compact form
+    compact = CompactCiphertext.from_serialization(serialization)
+    assert compact.serialize() == serialization
+    assert list(compact.c1) == load_ciphertext(serialization).c1.coeffs
+    ciphtext = compact.to_ciphertext()
+    assert isinstance(ciphtext, SeededCiphertext)
+    assert serialize_ciphertext(ciphtext) == serialization
+    assert CompactCiphertext.from_ciphertext(ciphtext).serialize() == serialization
+    assert encoder.decode(decryptor.decrypt(ciphtext)) == num
+    # Views into arrays store c1 in full
+    ciphtext_array = CompactCiphertextArray(params.poly_degree)
+    ciphtext_array.append(compact)
+    assert encoder.decode(decryptor.decrypt(ciphtext_array[0].to_ciphertext())) == num
+
+
+def test_compact_large_modulus():
+    # Setup
+    params = BFVParameters(poly_degree=8, plain_modulus=401, ciph_modulus=2**70)
+    ciphtext = Ciphertext(Polynomial(8, [2**65] * 8), Polynomial(8, [1] * 8))
+    serialization = serialize_ciphertext(ciphtext)
+
+    # Test that coefficients above 64 bits are a format error
+    with pytest.raises(CiphertextFormatError):
+        CompactCiphertext.from_serialization(serialization)
+    with pytest.raises(CiphertextFormatError):
+        CompactCiphertext.from_serialization(serialization, params)
+    # and that those ciphertexts are loaded as py-fhe ones instead
+    with TemporaryDirectory(dir=".") as directory:
+        with open(os.path.join(directory, "0.txt"), "w") as f:
+            f.write(serialization)
+        ciphtexts = initialize_ciphertexts(os.path.basename(directory), compact=True)
+    assert serialize_ciphertext(ciphtexts[0]) == serialization
@@ -0,0 +1,35 @@
+from hypothesis import given, settings
+from hypothesis import strategies as st
+import os
+from tempfile import TemporaryDirectory
+
+from encoding_experiment.corpus import generate_corpus, iter_trials, save_corpus
+from encoding_experiment.encoder import Encoder
+
+
+@settings(deadline=None)
+@given(
+    st.integers(min_value=1, max_value=200),
+    st.integers(min_value=0, max_value=2**32),
+    st.integers(min_value=2, max_value=5),
+)
+def test_corpus(num_trials, seed, max_length):
+    # Setup
+    encoder = Encoder()
+    corpus = generate_corpus(num_trials, seed, max_length=max_length)
+    with TemporaryDirectory() as directory:
+        path = os.path.join(directory, "trials.npy")
+        save_corpus(path, corpus)
+        trials = list(iter_trials(path))
+
+    # Test
+    assert (generate_corpus(num_trials, seed, max_length=max_length) == corpus).all()
+    assert [trial["id"] for trial in trials] == list(range(num_trials))
+    assert len({trial["string"] for trial in trials}) == num_trials
+    for trial in trials:
+        assert 2 <= len(trial["string"]) <= max_length
+        assert 1 <= trial["slice_length"] < len(trial["string"])
+        assert trial["location"] in (0, 1)
+        assert len(trial["key"]) >= 2
+        for char in trial["string"] + trial["key"]:
+            assert char in encoder.encoding
@@ -1,4 +1,4 @@
-from encoding_experiment.experiment import generate_random_string
+from encoding_experiment.experiment import generate_random_string, parse_answers
 from encoding_experiment.encoder import Encoder
 
 
@@ -10,3 +10,12 @@ def test_generate_random_strings():
         assert 1 < len(s) <= 40
         for char in s:
             assert char in encoder.encoding
+
+
+def test_parse_answers():
+    assert parse_answers('["abc", "d"]', 2) == ["abc", "d"]
+    assert parse_answers('Here you go:\n["abc", 5]', 2) == ["abc", None]
+    assert parse_answers("1. abc\n2) d", 2) == ["abc", "d"]
+    # Missing or unmatched answers are left for individual retries
+    assert parse_answers("2. d\n7. x", 3) == [None, "d", None]
+    assert parse_answers('["abc"]', 2) == [None, None]
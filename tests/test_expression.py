@@ -0,0 +1,98 @@
+from hypothesis import given
+from hypothesis import strategies as st
+import pytest
+
+from HE_data.expression import (
+    evaluate_expression,
+    multiplicative_depth,
+    parse_expression,
+)
+from HE_data.HE_data import NTTBFVEvaluator
+from bfv.bfv_decryptor import BFVDecryptor
+from bfv.bfv_encryptor import BFVEncryptor
+from bfv.bfv_key_generator import BFVKeyGenerator
+from bfv.bfv_parameters import BFVParameters
+from bfv.int_encoder import IntegerEncoder
+
+
+def test_parse_expression():
+    # Commutative reorderings and parentheses give the same node
+    assert parse_expression("x1 * x0") == parse_expression("(x0 * x1)")
+    assert parse_expression("x0 + (x1 + x2)") == parse_expression("(x2 + x1) + x0")
+    # Constants are folded
+    assert parse_expression("x0 * 2 * 3") == parse_expression("6 * x0")
+    assert parse_expression("x0 + 0") == ("operand", 0)
+    for expression in ["x0 - x1", "y0 + x1", "x0 + -1", "x0 +", "x0 / 2"]:
+        with pytest.raises(ValueError):
+            parse_expression(expression)
+
+
+def test_multiplicative_depth():
+    assert multiplicative_depth(parse_expression("x0 + x1 + 3")) == 0
+    assert multiplicative_depth(parse_expression("(x0 + x1) * x2")) == 1
+    # Products are balanced instead of chained
+    assert multiplicative_depth(parse_expression("x0 * x1 * x2 * x3")) == 2
+
+
+@given(
+    st.integers(min_value=0, max_value=9),
+    st.integers(min_value=0, max_value=9),
+    st.integers(min_value=0, max_value=9),
+)
+def test_evaluate_expression(num1, num2, num3):
+    # Setup
+    params = BFVParameters(poly_degree=8, plain_modulus=401, ciph_modulus=8000000000000)
+    key_generator = BFVKeyGenerator(params)
+    encoder = IntegerEncoder(params, 10)
+    encryptor = BFVEncryptor(params, key_generator.public_key)
+    decryptor = BFVDecryptor(params, key_generator.secret_key)
+    evaluator = NTTBFVEvaluator(params)
+    operands = [encryptor.encrypt(encoder.encode(num)) for num in (num1, num2, num3)]
+
+    # Test
+    for expression, expected in [
+        ("(x0 + x1) * x2", (num1 + num2) * num3),
+        ("x0 * x1 + x1 * x0 + 3", 2 * num1 * num2 + 3),
+        ("2 * (x0 + x2) + x1", 2 * (num1 + num3) + num2),
+    ]:
+        result = evaluate_expression(
+            expression, operands, evaluator, key_generator.relin_key, encoder
+        )
+        assert encoder.decode(decryptor.decrypt(result)) == expected
+    with pytest.raises(ValueError):
+        evaluate_expression(
+            "x3 + x0", operands, evaluator, key_generator.relin_key, encoder
+        )
+
+
+@given(st.lists(st.integers(min_value=0, max_value=9), min_size=4, max_size=4))
+def test_sum_of_products(nums):
+    # Setup
+    params = BFVParameters(poly_degree=8, plain_modulus=401, ciph_modulus=8000000000000)
+    key_generator = BFVKeyGenerator(params)
+    encoder = IntegerEncoder(params, 10)
+    encryptor = BFVEncryptor(params, key_generator.public_key)
+    decryptor = BFVDecryptor(params, key_generator.secret_key)
+    evaluator = NTTBFVEvaluator(params)
+    operands = [encryptor.encrypt(encoder.encode(num)) for num in nums]
+    relinearizations = []
+    relinearize = evaluator.relinearize
+
+    def counting_relinearize(*args):
+        relinearizations.append(args)
+        return relinearize(*args)
+
+    evaluator.relinearize = counting_relinearize
+
+    # Test that the products of a sum are relinearized once
+    result = evaluate_expression(
+        "x0 * x1 + x2 * x3 + 2 * x0 * x2 + x1",
+        operands,
+        evaluator,
+        key_generator.relin_key,
+        encoder,
+    )
+    assert encoder.decode(decryptor.decrypt(result)) == (
+        nums[0] * nums[1] + nums[2] * nums[3] + 2 * nums[0] * nums[2] + nums[1]
+    )
+    assert len(relinearizations) == 1
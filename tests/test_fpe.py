@@ -0,0 +1,174 @@
+from hypothesis import given
+from hypothesis import strategies as st
+from itertools import product
+import pytest
+
+from agents import fpe
+from agents.fpe import ALPHABET, FF1
+
+
+def xtime(a):
+    return ((a << 1) ^ 0x1B) & 0xFF if a & 0x80 else a << 1
+
+
+def gmul(a, b):
+    result = 0
+    while b:
+        if b & 1:
+            result ^= a
+        a = xtime(a)
+        b >>= 1
+    return result
+
+
+def rotl8(x, shift):
+    return ((x << shift) | (x >> (8 - shift))) & 0xFF
+
+
+def make_sbox():
+    sbox = []
+    for x in range(256):
+        inverse = next((y for y in range(1, 256) if gmul(x, y) == 1), 0)
+        sbox.append(
+            inverse
+            ^ rotl8(inverse, 1)
+            ^ rotl8(inverse, 2)
+            ^ rotl8(inverse, 3)
+            ^ rotl8(inverse, 4)
+            ^ 0x63
+        )
+    return sbox
+
+
+SBOX = make_sbox()
+
+
+class AES128:
+    """Minimal AES-128 block encryption, only used to check FF1 test vectors"""
+
+    def __init__(self, key):
+        words = [list(key[i : i + 4]) for i in range(0, 16, 4)]
+        rcon = 1
+        for i in range(4, 44):
+            word = list(words[i - 1])
+            if i % 4 == 0:
+                word = [SBOX[byte] for byte in word[1:] + word[:1]]
+                word[0] ^= rcon
+                rcon = xtime(rcon)
+            words.append([a ^ b for a, b in zip(words[i - 4], word)])
+        self.round_keys = [sum(words[i : i + 4], []) for i in range(0, 44, 4)]
+
+    def encrypt(self, block):
+        state = [a ^ b for a, b in zip(block, self.round_keys[0])]
+        for round in range(1, 11):
+            state = [SBOX[byte] for byte in state]
+            state = [state[r + 4 * ((c + r) % 4)] for c in range(4) for r in range(4)]
+            if round < 10:
+                mixed = []
+                for c in range(4):
+                    a0, a1, a2, a3 = state[4 * c : 4 * c + 4]
+                    mixed += [
+                        gmul(a0, 2) ^ gmul(a1, 3) ^ a2 ^ a3,
+                        a0 ^ gmul(a1, 2) ^ gmul(a2, 3) ^ a3,
+                        a0 ^ a1 ^ gmul(a2, 2) ^ gmul(a3, 3),
+                        gmul(a0, 3) ^ a1 ^ a2 ^ gmul(a3, 2),
+                    ]
+                state = mixed
+            state = [a ^ b for a, b in zip(state, self.round_keys[round])]
+        return bytes(state)
+
+
+class AESFF1(FF1):
+    """FF1 with the AES CBC-MAC round function of NIST SP 800-38G"""
+
+    def __init__(self, key, alphabet, tweak):
+        super().__init__(key, alphabet, tweak)
+        self.aes = AES128(key)
+
+    def _start_prf(self, data):
+        return data
+
+    def _finish_prf(self, state, data):
+        message = state + data
+        y = bytes(16)
+        for i in range(0, len(message), 16):
+            y = self.aes.encrypt(bytes(a ^ b for a, b in zip(y, message[i : i + 16])))
+        return y
+
+    def _extend(self, r, j):
+        return self.aes.encrypt(bytes(a ^ b for a, b in zip(r, j.to_bytes(16, "big"))))
+
+
+def test_aes128():
+    # FIPS-197 appendix C.1
+    aes = AES128(bytes(range(16)))
+    plaintext = bytes.fromhex("00112233445566778899aabbccddeeff")
+    assert aes.encrypt(plaintext).hex() == "69c4e0d86a7b0430d8cdb78070b4c55a"
+
+
+@pytest.mark.parametrize(
+    "alphabet,tweak,plaintext,ciphertext",
+    [
+        # NIST SP 800-38G FF1-AES128 samples 1 to 3
+        ("0123456789", "", "0123456789", "2433477484"),
+        ("0123456789", "39383736353433323130", "0123456789", "6124200773"),
+        (
+            "0123456789abcdefghijklmnopqrstuvwxyz",
+            "3737373770717273373737",
+            "0123456789abcdefghi",
+            "a9tv40mll9kdu509eum",
+        ),
+    ],
+)
+def test_nist_vectors(alphabet, tweak, plaintext, ciphertext):
+    key = bytes.fromhex("2B7E151628AED2A6ABF7158809CF4F3C")
+    cipher = AESFF1(key, alphabet, bytes.fromhex(tweak))
+    assert cipher.encrypt(plaintext) == ciphertext
+    assert cipher.decrypt(ciphertext) == plaintext
+
+
+@pytest.mark.parametrize(
+    "key,tweak,plaintext,ciphertext",
+    [
+        # HMAC-SHA256 FF1 used by SSNAgent's whole mode, to catch changes
+        (b"secretkey", b"", "123456789", "9mAavYjwA"),
+        (b"secretkey", b"0", "123456789", "3TtEleXhf"),
+        (b"anotherkey", b"", "abcd", "6366"),
+    ],
+)
+def test_known_answers(key, tweak, plaintext, ciphertext):
+    cipher = FF1(key, ALPHABET, tweak)
+    assert cipher.encrypt(plaintext) == ciphertext
+    assert cipher.decrypt(ciphertext) == plaintext
+
+
+@given(
+    st.binary(min_size=1, max_size=32),
+    st.lists(st.text(alphabet=ALPHABET, min_size=4, max_size=60), max_size=20),
+)
+def test_encrypt_many(key, values):
+    cipher = FF1(key)
+    ciphertexts = cipher.encrypt_many(values)
+    assert [len(ciphertext) for ciphertext in ciphertexts] == list(map(len, values))
+    assert all(set(ciphertext) <= set(ALPHABET) for ciphertext in ciphertexts)
+    assert ciphertexts == [FF1(key).encrypt(value) for value in values]
+    assert cipher.decrypt_many(ciphertexts) == values
+
+
+def test_permutation(monkeypatch):
+    # Domains of fewer than 10^6 strings are rejected
+    cipher = FF1(b"key", "0123456789")
+    assert cipher.min_length == 6
+    with pytest.raises(ValueError):
+        cipher.encrypt("12345")
+    with pytest.raises(ValueError):
+        cipher.encrypt("12345a")
+
+    # Every 3 digit string maps to a different 3 digit string, checked on a
+    # domain small enough to enumerate
+    monkeypatch.setattr(fpe, "MIN_DOMAIN", 1000)
+    cipher = FF1(b"key", "0123456789")
+    values = ["".join(digits) for digits in product("0123456789", repeat=3)]
+    assert sorted(cipher.encrypt_many(values)) == values
+    with pytest.raises(ValueError):
+        cipher.encrypt("1")
@@ -0,0 +1,49 @@
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Top-level packages of the LLM stack that crypto-only imports must not load
+LLM_PACKAGES = {
+    "langchain",
+    "langchain_community",
+    "langchain_core",
+    "langchain_openai",
+    "openai",
+    "pydantic",
+}
+
+
+def profile_import(module: str) -> tuple[set[str], float]:
+    """
+    Imports a module in a fresh interpreter with -X importtime.
+
+        Returns:
+            (tuple[set[str], float]): Top-level packages that were imported and the
+            total import time in seconds
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    packages = set()
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, _, name = line[len("import time:") :].split("|")
+        packages.add(name.strip().split(".")[0])
+        total += int(self_us)
+    return packages, total / 1e6
+
+
+def test_crypto_imports_skip_llm_stack():
+    for module in ["agents.HE_tools", "agents.HE_agent", "agents.ssn_agent"]:
+        packages, seconds = profile_import(module)
+        print(f"import {module}: {seconds:.3f}s")
+        assert (
+            not packages & LLM_PACKAGES
+        ), f"{module} imports {packages & LLM_PACKAGES}"
@@ -0,0 +1,131 @@
+from hypothesis import given, settings
+from hypothesis import strategies as st
+import numpy as np
+import os
+import pytest
+from tempfile import TemporaryDirectory
+
+from bfv.bfv_key_generator import BFVKeyGenerator
+from bfv.bfv_parameters import BFVParameters
+from bfv.int_encoder import IntegerEncoder
+from HE_data.HE_data import (
+    find_ntt_root,
+    NTTBFVDecryptor,
+    open_key_file,
+    PARAMETER_PRESETS,
+    PUBLIC_KEY_FILE,
+    save_key_files,
+)
+from HE_data.ingest import ingest
+from HE_data.store import CiphertextStore
+
+preset = PARAMETER_PRESETS["default"]
+params = BFVParameters(
+    poly_degree=preset["degree"],
+    plain_modulus=preset["plain_modulus"],
+    ciph_modulus=preset["ciph_modulus"],
+)
+values = st.integers(min_value=0, max_value=preset["plain_modulus"] - 1)
+
+
+def create_keys(directory):
+    key_generator = BFVKeyGenerator(params)
+    save_key_files(directory, params, key_generator, find_ntt_root(params))
+    return NTTBFVDecryptor(params, key_generator.secret_key)
+
+
+def decrypt_column(store, column, decryptor):
+    encoder = IntegerEncoder(params, 10)
+    row_ids, ciphertexts = store.read(column)
+    return list(row_ids), [
+        encoder.decode(decryptor.decrypt(ciphertexts[i].to_ciphertext()))
+        for i in range(len(ciphertexts))
+    ]
+
+
+@settings(deadline=None, max_examples=5)
+@given(
+    st.lists(st.tuples(values, values), min_size=1, max_size=20),
+    st.integers(min_value=1, max_value=6),
+)
+def test_ingest_csv(rows, chunk_rows):
+    with TemporaryDirectory() as directory:
+        decryptor = create_keys(directory)
+        key_file = os.path.join(directory, PUBLIC_KEY_FILE)
+        store_dir = os.path.join(directory, "store")
+        path = os.path.join(directory, "data.csv")
+        with open(path, "w") as f:
+            f.write("id,age,weight,name\n")
+            for i, (age, weight) in enumerate(rows):
+                f.write(f"{100 + 2 * i},{age},{weight},name{i}\n")
+
+        stats = ingest(
+            path,
+            store_dir,
+            key_file,
+            ["age", "weight"],
+            id_column="id",
+            chunk_rows=chunk_rows,
+            workers=2,
+        )
+        assert stats["rows"] == len(rows)
+        assert stats["ciphertexts"] == 2 * len(rows)
+        store = CiphertextStore(store_dir)
+        assert store.columns == ["age", "weight"]
+        row_ids = [100 + 2 * i for i in range(len(rows))]
+        for column, expected in zip(store.columns, zip(*rows)):
+            assert store.count(column) == len(rows)
+            assert decrypt_column(store, column, decryptor) == (row_ids, list(expected))
+        chunks = list(store.iter_chunks("age", chunk_rows))
+        assert sum(len(ids) for ids, _ in chunks) == len(rows)
+
+        # Test appending rows numbered on from the store
+        ingest(path, store_dir, key_file, ["age"], chunk_rows=chunk_rows, workers=1)
+        store = CiphertextStore(store_dir)
+        first = row_ids[-1] + 1
+        assert decrypt_column(store, "age", decryptor) == (
+            row_ids + list(range(first, first + len(rows))),
+            [age for age, _ in rows] * 2,
+        )
+
+
+def test_ingest_npy():
+    with TemporaryDirectory() as directory:
+        decryptor = create_keys(directory)
+        key_file = os.path.join(directory, PUBLIC_KEY_FILE)
+        path = os.path.join(directory, "data.npy")
+
+        # 2D arrays are addressed by column index
+        np.save(path, np.array([[1, 2], [3, 4], [400, 0]], dtype=np.int64))
+        ingest(path, os.path.join(directory, "a"), key_file, ["1"], chunk_rows=2)
+        store = CiphertextStore(os.path.join(directory, "a"))
+        assert decrypt_column(store, "1", decryptor) == ([0, 1, 2], [2, 4, 0])
+
+        # Structured arrays by field name
+        data = np.array(
+            [(7, 5.0), (9, 6.0)], dtype=[("id", np.int64), ("dose", np.float64)]
+        )
+        np.save(path, data)
+        ingest(path, os.path.join(directory, "b"), key_file, ["dose"], "id")
+        store = CiphertextStore(os.path.join(directory, "b"))
+        assert decrypt_column(store, "dose", decryptor) == ([7, 9], [5, 6])
+
+
+def test_ingest_invalid():
+    with TemporaryDirectory() as directory:
+        create_keys(directory)
+        key_file = os.path.join(directory, PUBLIC_KEY_FILE)
+        store_dir = os.path.join(directory, "store")
+        path = os.path.join(directory, "data.csv")
+        for cell in [str(preset["plain_modulus"]), "-1", "1.5", ""]:
+            with open(path, "w") as f:
+                f.write(f"value,note\n1,a\n{cell},b\n")
+            with pytest.raises(ValueError, match="Row 1 of column value"):
+                ingest(path, store_dir, key_file, ["value"], workers=1)
+        with pytest.raises(ValueError):
+            ingest(path, store_dir, key_file, ["missing"], workers=1)
+
+        # Stores only take ciphertexts of their own keys
+        create_keys(directory)
+        with pytest.raises(ValueError):
+            CiphertextStore(store_dir, open_key_file(key_file))
@@ -0,0 +1,97 @@
+import argparse
+import os
+from tempfile import TemporaryDirectory
+import time
+
+from langchain.globals import set_llm_cache
+from langchain_core.language_models.fake import FakeListLLM
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+import pytest
+
+from profiling import (
+    add_profile_arguments,
+    create_replay_cache,
+    run_profiled,
+)
+
+
+def inner(n):
+    return sum(i * i for i in range(n))
+
+
+def outer(args):
+    time.sleep(0.01)
+    return [inner(args.size) for _ in range(5)]
+
+
+# Frame labels of the profiled functions
+INNER = f"inner (tests/test_profiling.py:{inner.__code__.co_firstlineno})"
+OUTER = f"outer (tests/test_profiling.py:{outer.__code__.co_firstlineno})"
+
+
+def read_collapsed(path):
+    stacks = {}
+    with open(path, "r") as f:
+        for line in f:
+            stack, weight = line.rsplit(" ", 1)
+            stacks[stack] = int(weight)
+    return stacks
+
+
+@pytest.mark.parametrize(
+    "profile,interval", [("cpu", None), ("cpu", 0.001), ("mem", None), ("mem", 0.001)]
+)
+def test_run_profiled(profile, interval):
+    parser = argparse.ArgumentParser()
+    add_profile_arguments(parser, llm=False)
+    with TemporaryDirectory() as directory:
+        prefix = os.path.join(directory, "profile")
+        args = parser.parse_args(
+            ["--profile", profile, "--profile_output", prefix, "--profile_top", "100"]
+        )
+        args.profile_interval = interval
+        # Tracing every allocation is much slower than sampling
+        args.size = 50000 if profile == "cpu" else 2000
+        assert run_profiled(outer, args) == outer(args)
+
+        stacks = read_collapsed(prefix + ".collapsed")
+        assert stacks and all(weight > 0 for weight in stacks.values())
+        with open(prefix + ".txt", "r") as f:
+            report = f.read()
+        if profile == "cpu":
+            # inner is only ever called from outer
+            inner_stacks = [
+                stack.split(";") for stack in stacks if INNER in stack.split(";")
+            ]
+            assert inner_stacks
+            assert all(
+                OUTER in stack and stack.index(OUTER) < stack.index(INNER)
+                for stack in inner_stacks
+            )
+            assert "inner" in report
+            assert os.path.exists(prefix + ".pstats") == (interval is None)
+        else:
+            assert "Peak traced memory" in report
+
+
+def test_replay_cache():
+    with TemporaryDirectory() as directory:
+        path = os.path.join(directory, "llm.jsonl")
+        try:
+            set_llm_cache(create_replay_cache(record_path=path))
+            llm = FakeListLLM(responses=["first", "second"])
+            chat = FakeListChatModel(responses=["third"])
+            assert [llm.invoke("a"), llm.invoke("b")] == ["first", "second"]
+            assert chat.invoke("c").content == "third"
+
+            # Recorded responses come back in order whatever the prompts are
+            set_llm_cache(create_replay_cache(replay_path=path))
+            llm = FakeListLLM(responses=["live"])
+            chat = FakeListChatModel(responses=["live"])
+            assert llm.invoke("x") == "first"
+            assert llm.invoke("y") == "second"
+            assert chat.invoke("z").content == "third"
+            with pytest.raises(RuntimeError):
+                llm.invoke("x")
+        finally:
+            set_llm_cache(None)
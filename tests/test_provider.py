@@ -0,0 +1,87 @@
+from hypothesis import given, settings
+from hypothesis import strategies as st
+import os
+import pytest
+from tempfile import TemporaryDirectory
+
+from bfv.bfv_key_generator import BFVKeyGenerator
+from bfv.bfv_parameters import BFVParameters
+from bfv.int_encoder import IntegerEncoder
+from HE_data.HE_data import (
+    find_ntt_root,
+    NTTBFVDecryptor,
+    PARAMETER_PRESETS,
+    PUBLIC_KEY_FILE,
+    save_key_files,
+)
+from HE_data.provider import CiphertextProvider
+
+preset = PARAMETER_PRESETS["default"]
+params = BFVParameters(
+    poly_degree=preset["degree"],
+    plain_modulus=preset["plain_modulus"],
+    ciph_modulus=preset["ciph_modulus"],
+)
+
+
+def create_keys(directory):
+    key_generator = BFVKeyGenerator(params)
+    save_key_files(directory, params, key_generator, find_ntt_root(params))
+    return NTTBFVDecryptor(params, key_generator.secret_key)
+
+
+@settings(deadline=None, max_examples=20)
+@given(
+    st.lists(
+        st.integers(min_value=0, max_value=preset["plain_modulus"] - 1),
+        min_size=1,
+        max_size=10,
+    ),
+    st.integers(min_value=1, max_value=4),
+)
+def test_provider(values, max_entries):
+    encoder = IntegerEncoder(params, 10)
+    with TemporaryDirectory() as directory:
+        decryptor = create_keys(directory)
+        key_file = os.path.join(directory, PUBLIC_KEY_FILE)
+        cache_dir = os.path.join(directory, "cache")
+
+        # Test encrypting on demand with a bounded cache
+        with CiphertextProvider(key_file, cache_dir, max_entries) as provider:
+            for value in values:
+                assert encoder.decode(decryptor.decrypt(provider[value])) == value
+                assert len(provider.memory) <= max_entries
+                assert len(os.listdir(provider.directory)) <= max_entries
+            unique = list(dict.fromkeys(values))
+            assert provider.stats["encrypted"] >= len(unique)
+            assert sum(provider.stats.values()) == len(values)
+
+        # Test reusing the cache directory in a later run
+        with CiphertextProvider(key_file, cache_dir, max_entries) as provider:
+            cached = [value for value in unique if value in provider]
+            assert 0 < len(cached) <= max_entries
+            for value in cached:
+                assert encoder.decode(decryptor.decrypt(provider[value])) == value
+            assert provider.stats == {"memory": 0, "disk": len(cached), "encrypted": 0}
+
+
+def test_prefetch():
+    encoder = IntegerEncoder(params, 10)
+    with TemporaryDirectory() as directory:
+        decryptor = create_keys(directory)
+        key_file = os.path.join(directory, PUBLIC_KEY_FILE)
+        cache_dir = os.path.join(directory, "cache")
+        with CiphertextProvider(key_file, cache_dir) as provider:
+            for future in provider.prefetch([3, 12, 5]):
+                future.result()
+            assert provider.stats["encrypted"] == 3
+            for value in [3, 12, 5]:
+                assert encoder.decode(decryptor.decrypt(provider[value])) == value
+            assert provider.stats["encrypted"] == 3
+            with pytest.raises(ValueError):
+                provider.serialize(preset["plain_modulus"])
+
+        # Ciphertexts of other keys are not reused
+        create_keys(directory)
+        with CiphertextProvider(key_file, cache_dir) as provider:
+            assert 3 not in provider
@@ -0,0 +1,63 @@
+from hypothesis import given, settings
+from hypothesis import strategies as st
+import os
+from tempfile import TemporaryDirectory
+
+from demo_evaluation.report import (
+    build_report,
+    format_report,
+    TrialLog,
+    wilson_interval,
+    write_summary,
+)
+
+records = st.lists(
+    st.fixed_dictionaries(
+        {
+            "success": st.booleans(),
+            "slice_length": st.integers(min_value=1, max_value=5),
+            "location": st.sampled_from(["first", "last"]),
+            "latency": st.floats(min_value=0.01, max_value=100),
+            "retries": st.integers(min_value=0, max_value=3),
+        }
+    ),
+    min_size=1,
+    max_size=50,
+)
+
+
+@settings(deadline=None)
+@given(records, records)
+def test_report(records1, records2):
+    # Setup
+    with TemporaryDirectory() as directory:
+        paths = [os.path.join(directory, f"trials{i}.jsonl") for i in range(2)]
+        for path, records in zip(paths, [records1, records2]):
+            with TrialLog(path, experiment="fpe", model="gpt-4-turbo") as log:
+                for record in records:
+                    log.write(**record)
+        report = build_report(paths)
+        # Summaries of each log merge into the report of both logs
+        summary_paths = [os.path.join(directory, f"summary{i}.json") for i in range(2)]
+        for path, summary_path in zip(paths, summary_paths):
+            write_summary(build_report([path]), summary_path)
+        merged = build_report(summary_paths=summary_paths)
+
+    # Test
+    records = records1 + records2
+    stats = report["fpe gpt-4-turbo"]
+    assert stats.to_dict() == merged["fpe gpt-4-turbo"].to_dict()
+    assert stats.trials == len(records)
+    assert stats.successes == sum(record["success"] for record in records)
+    low, high = wilson_interval(stats.successes, stats.trials)
+    assert low <= stats.successes / stats.trials <= high
+    for location in ("first", "last"):
+        trials = [record for record in records if record["location"] == location]
+        assert stats.breakdowns["location"].get(location, [0, 0]) == [
+            sum(record["success"] for record in trials),
+            len(trials),
+        ]
+    assert sum(stats.retries.values()) == len(records)
+    latencies = sorted(record["latency"] for record in records)
+    assert latencies[-1] <= stats.latency_percentile(100) <= latencies[-1] * 1.1
+    assert "fpe gpt-4-turbo" in format_report(report)
@@ -0,0 +1,83 @@
+import asyncio
+from hypothesis import given
+from hypothesis import strategies as st
+import os
+from tempfile import TemporaryDirectory
+
+from agents.ssn_agent import SSNAgent
+
+ALPHABET = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+@given(
+    st.text(alphabet=ALPHABET, min_size=1, max_size=20),
+    st.text(alphabet=" .,:!\n", max_size=5),
+    st.integers(min_value=1, max_value=8),
+)
+def test_post_process_stream(ssn, punctuation, chunk_size):
+    # Setup
+    with TemporaryDirectory() as directory:
+        secretkeys_path = os.path.join(directory, "secretkeys.txt")
+        ssns_path = os.path.join(directory, "ssns.txt")
+        with open(secretkeys_path, "w") as f:
+            f.write("secretkey\n")
+        with open(ssns_path, "w") as f:
+            f.write(ssn + "\n")
+        agent = SSNAgent(secretkeys_path, ssns_path)
+
+    # Chatty output with the ciphertext surrounded by text outside the alphabet
+    ciphertext = agent.get_number(0)
+    output = f"Here:{punctuation}{ciphertext}{punctuation}"
+    chunks = [output[i : i + chunk_size] for i in range(0, len(output), chunk_size)]
+
+    async def stream_chunks():
+        for chunk in chunks:
+            yield chunk
+
+    async def collect():
+        return [chunk async for chunk in agent.post_process_stream(stream_chunks(), 0)]
+
+    # Test
+    result = asyncio.run(collect())
+    assert len(result) == len(chunks)
+    assert "".join(result).endswith(f":{punctuation}{ssn}{punctuation}")
+    assert agent.post_process(ciphertext, 0) == ssn
+
+
+@given(
+    st.lists(st.text(alphabet=ALPHABET, min_size=4, max_size=20), min_size=1),
+    st.text(alphabet=" .,:!\n", min_size=1, max_size=5),
+    st.integers(min_value=1, max_value=8),
+)
+def test_whole_mode(ssns, punctuation, chunk_size):
+    # Setup
+    with TemporaryDirectory() as directory:
+        secretkeys_path = os.path.join(directory, "secretkeys.txt")
+        ssns_path = os.path.join(directory, "ssns.txt")
+        with open(secretkeys_path, "w") as f:
+            f.write("secretkey\n")
+        with open(ssns_path, "w") as f:
+            f.write(ssns[0] + "\n")
+        agent = SSNAgent(secretkeys_path, ssns_path, fpe_mode="whole")
+    key = agent.secretkeys[0]
+
+    # Test batch API
+    ciphertexts = agent.encrypt_many(key, ssns)
+    assert ciphertexts[0] == agent.get_number(0)
+    assert [len(c) for c in ciphertexts] == [len(ssn) for ssn in ssns]
+    assert agent.decrypt_many(key, ciphertexts) == ssns
+    assert agent.post_process(ciphertexts[0], 0) == ssns[0]
+
+    # Test streaming, each ciphertext is decrypted once it is complete
+    output = punctuation.join(ciphertexts) + punctuation
+    chunks = [output[i : i + chunk_size] for i in range(0, len(output), chunk_size)]
+
+    async def stream_chunks():
+        for chunk in chunks:
+            yield chunk
+
+    async def collect():
+        return [chunk async for chunk in agent.post_process_stream(stream_chunks(), 0)]
+
+    result = asyncio.run(collect())
+    assert "".join(result) == punctuation.join(ssns) + punctuation
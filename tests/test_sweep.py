@@ -0,0 +1,162 @@
+from hypothesis import given
+from hypothesis import strategies as st
+import json
+from multiprocessing import Manager
+import os
+from tempfile import TemporaryDirectory
+import time
+
+import demo_evaluation.evaluate_fpe as evaluate_fpe
+import demo_evaluation.evaluate_he as evaluate_he
+from demo_evaluation.sweep import (
+    initialize_worker,
+    merge_logs,
+    plan_shards,
+    RateBudget,
+    run_shard,
+)
+from encoding_experiment.corpus import generate_corpus, save_corpus
+import encoding_experiment.experiment as experiment
+
+
+@given(
+    st.integers(min_value=1, max_value=50),
+    st.integers(min_value=1, max_value=8),
+    st.lists(st.integers(min_value=0, max_value=100), min_size=1, max_size=3),
+)
+def test_plan_shards(num_trials, shards, seeds):
+    planned = plan_shards(
+        ["gpt-3.5-turbo"], ["fpe", "he"], seeds, num_trials, shards, "out"
+    )
+    for defense in ("fpe", "he"):
+        for seed in seeds:
+            run = [
+                shard
+                for shard in planned
+                if shard["defense"] == defense and shard["seed"] == seed
+            ]
+            assert sum(shard["args"]["num_trials"] for shard in run) == num_trials
+            if defense == "fpe":
+                # Corpus shards cover consecutive slices of the seed's corpus
+                start = 0
+                for shard in run:
+                    assert shard["args"]["corpus_start"] == start
+                    start += shard["args"]["num_trials"]
+    assert len({shard["directory"] for shard in planned}) == len(planned)
+
+
+def test_merge_logs():
+    with TemporaryDirectory() as directory:
+        shards = plan_shards(["gpt-4-turbo"], ["encoding"], [1, 2], 4, 2, directory)
+        for i, shard in enumerate(shards):
+            os.makedirs(shard["directory"])
+            with open(shard["args"]["success_log"], "w") as f:
+                json.dump(
+                    {f"question {i}": "answer", f"other question {i}": "answer"}, f
+                )
+            with open(shard["args"]["failure_log"], "w") as f:
+                json.dump({f"failed question {i}": "answer"}, f)
+            shard["error"] = None
+        shards[-1]["error"] = "Traceback"
+        os.remove(shards[-1]["args"]["failure_log"])
+
+        summary = merge_logs(shards, directory)
+        with open(os.path.join(directory, "gpt-4-turbo_encoding_success.json")) as f:
+            successes = json.load(f)
+
+    cell = summary["gpt-4-turbo_encoding"]
+    assert cell["successes"] == len(successes) == 8
+    assert cell["trials"] == 11
+    assert cell["runs"]["seed2"]["errors"][0]["error"] == "Traceback"
+
+
+def test_rate_budget():
+    with Manager() as manager:
+        budget = RateBudget(manager, {"openai": 1200})
+        start = time.perf_counter()
+        for _ in range(4):
+            budget.acquire("openai")
+            budget.acquire("ollama")
+        # Requests are 0.05 s apart and providers without a budget don't wait
+        assert 0.15 <= time.perf_counter() - start < 1
+
+
+class FakeAgentExecutor:
+    def __init__(self, **kwargs):
+        pass
+
+    def invoke(self, agent_input):
+        return {"output": agent_input["numbers"][0]}
+
+
+class FakeSSNAgent:
+    def __init__(self, *args):
+        pass
+
+    def encrypt(self, secretkey, s):
+        return s
+
+    def run_agent(self, user_query, index):
+        return "answer"
+
+    def post_process(self, result, index):
+        return result
+
+
+class FakeChain:
+    def invoke(self, question):
+        return ""
+
+
+def test_run_shard(monkeypatch):
+    # Every defense's main runs with the arguments plan_shards gives it
+    monkeypatch.setattr(time, "sleep", lambda seconds: None)
+    monkeypatch.setattr(evaluate_he, "AgentExecutor", FakeAgentExecutor)
+    monkeypatch.setattr(evaluate_he, "create_agent", lambda model: None)
+    monkeypatch.setattr(evaluate_he, "create_tools", lambda pool: [])
+    monkeypatch.setattr(evaluate_fpe, "OpenAISSNAgent", FakeSSNAgent)
+    monkeypatch.setattr(experiment, "create_chain", lambda model: FakeChain())
+    monkeypatch.setattr(experiment, "create_batch_chain", lambda model: FakeChain())
+    with TemporaryDirectory() as directory:
+        save_corpus(os.path.join(directory, "corpus_seed1.npy"), generate_corpus(2, 1))
+        for shard in plan_shards(
+            ["gpt-3.5-turbo"], ["fpe", "he", "encoding"], [1], 2, 2, directory
+        ):
+            result = run_shard(shard)
+            assert result["error"] is None, result["error"]
+            assert os.path.exists(shard["args"]["trial_log"])
+
+
+def test_run_shard_retry(monkeypatch):
+    # A retried prompt gets a fresh answer instead of the cached malformed one
+    from langchain.globals import set_llm_cache
+    from langchain_community.llms.fake import FakeListLLM
+    from langchain_core.prompts import PromptTemplate
+
+    llm = FakeListLLM(responses=["\u2603", "ab"])
+    sleeps = []
+
+    def sleep(seconds):
+        # Every call sleeps, so the cached answer would be retried forever
+        sleeps.append(seconds)
+        assert len(sleeps) < 10, "Retries keep getting the cached answer"
+
+    monkeypatch.setattr(time, "sleep", sleep)
+    monkeypatch.setattr(
+        experiment,
+        "create_chain",
+        lambda model: PromptTemplate.from_template("{question}") | llm,
+    )
+    monkeypatch.setattr(experiment, "create_batch_chain", lambda model: FakeChain())
+    with TemporaryDirectory() as directory, Manager() as manager:
+        save_corpus(os.path.join(directory, "corpus_seed1.npy"), generate_corpus(1, 1))
+        initialize_worker(os.path.join(directory, "cache.db"), RateBudget(manager, {}))
+        try:
+            (shard,) = plan_shards(["fake"], ["encoding"], [1], 1, 1, directory)
+            result = run_shard(shard)
+        finally:
+            set_llm_cache(None)
+        assert result["error"] is None, result["error"]
+        with open(shard["args"]["trial_log"]) as f:
+            (trial,) = [json.loads(line) for line in f if line.strip()]
+    assert trial["retries"] == 1
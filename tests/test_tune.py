@@ -0,0 +1,76 @@
+import json
+import math
+import os
+import random
+from tempfile import TemporaryDirectory
+
+from hypothesis import given, settings
+from hypothesis import strategies as st
+from util.number_theory import is_prime
+
+from HE_data.HE_data import load_preset
+from HE_data.tune import (
+    Candidate,
+    check_correctness,
+    fastest,
+    find_plain_modulus,
+    MARGIN_BITS,
+    smallest,
+    tune,
+)
+
+
+@given(st.integers(min_value=1, max_value=100000))
+def test_find_plain_modulus(max_value):
+    modulus = find_plain_modulus(max_value)
+    assert modulus > max_value and modulus % 16 == 1 and is_prime(modulus)
+    assert not any(is_prime(smaller) for smaller in range(modulus - 16, max_value, -16))
+
+
+@settings(deadline=None, max_examples=5)
+@given(st.integers(min_value=16, max_value=1600), st.integers(0, 1))
+def test_tune(max_value, depth):
+    random.seed(max_value)
+    results = tune(max_value, depth, degrees=[8], modulus_bits=[20, 36, 52], repeats=1)
+    assert len(results) == 1
+    preset = {
+        key: results[0][key] for key in ("degree", "plain_modulus", "ciph_modulus")
+    }
+    assert check_correctness(
+        Candidate(preset), max_value, depth, trials=5, margin_bits=MARGIN_BITS
+    )
+    # The margin keeps a larger modulus than the smallest that decrypts correctly
+    unsafe = tune(
+        max_value,
+        depth,
+        degrees=[8],
+        modulus_bits=[20, 36, 52],
+        repeats=1,
+        margin_bits=0,
+    )
+    assert unsafe[0]["ciph_modulus"] <= preset["ciph_modulus"]
+    assert fastest(results) == smallest(results) == results[0]
+
+    with TemporaryDirectory() as directory:
+        path = os.path.join(directory, "preset.json")
+        with open(path, "w") as f:
+            json.dump(results[0], f)
+        assert load_preset(path) == preset
+
+
+def test_correctness_fails_without_noise_budget():
+    # A ciphertext modulus barely above the plaintext modulus cannot multiply
+    random.seed(0)
+    preset = {"degree": 8, "plain_modulus": 401, "ciph_modulus": 433}
+    assert not check_correctness(Candidate(preset), 400, 1, trials=5)
+
+
+def test_noise_budget():
+    # Fresh ciphertexts have most of their budget, multiplications use it up
+    random.seed(0)
+    preset = {"degree": 8, "plain_modulus": 401, "ciph_modulus": 8000000000753}
+    candidate = Candidate(preset)
+    ciphertext = candidate.encrypt(20)
+    fresh = candidate.noise_budget(ciphertext)
+    product = candidate.noise_budget(candidate.multiply(ciphertext, ciphertext))
+    assert 0 < product < fresh < math.log2(preset["ciph_modulus"] / 401)